@@ -1,32 +1,47 @@
 #!/usr/bin/env python3
 
+import sys
+import json
+import time
+import hashlib
 import logging
 import yaml
+import manifests
+import metrics
+import podspec
+import tracing
+import violations
 from pathlib import Path
 from ops.charm import CharmBase
 from ops.main import main
 from ops.framework import StoredState
-from ops.model import ActiveStatus, MaintenanceStatus
-from jinja2 import Template
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
 import os
 from oci_image import OCIImageResource, OCIImageResourceError
 
 logger = logging.getLogger(__name__)
 
+CRD_FILES = [
+    "files/configs.config.gatekeeper.sh.yaml",
+    "files/constrainttemplates.templates.gatekeeper.sh.yaml",
+    "files/constraintpodstatuses.status.gatekeeper.sh.yaml",
+    "files/constrainttemplatepodstatuses.status.gatekeeper.sh.yaml",
+]
 
-class CustomResourceDefintion(object):
-    def __init__(self, name, spec):
+# Audit tuning options and the gatekeeper flags they are rendered into
+AUDIT_INT_FLAGS = [
+    ("auditInterval", "--audit-interval"),
+    ("constraintViolationsLimit", "--constraint-violations-limit"),
+    ("auditChunkSize", "--audit-chunk-size"),
+]
+AUDIT_BOOL_FLAGS = [
+    ("auditFromCache", "--audit-from-cache"),
+    ("auditMatchKindOnly", "--audit-match-kind-only"),
+]
 
-        self._name = name
-        self._spec = spec
 
-    @property
-    def spec(self):
-        return self._spec
-
-    @property
-    def name(self):
-        return self._name
+class AuditConfigError(Exception):
+    """The audit options in the charm config are invalid."""
 
 
 class OPAAuditCharm(CharmBase):
@@ -38,10 +53,33 @@ class OPAAuditCharm(CharmBase):
 
     def __init__(self, *args):
         super().__init__(*args)
+        tracing.tracer.start(
+            self._hook_name(),
+            trace_allocations=self.model.config["traceAllocations"],
+        )
         self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.leader_elected, self._on_config_changed)
         self.framework.observe(self.on.stop, self._on_stop)
         self.framework.observe(self.on.install, self._on_install)
-        self._stored.set_default(things=[])
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(
+            self.on.violations_relation_joined, self._on_violations_joined
+        )
+        self.framework.observe(
+            self.on.export_violations_action, self._on_export_violations_action
+        )
+        self.framework.observe(
+            self.on.metrics_endpoint_relation_joined, self._on_metrics_endpoint_joined
+        )
+        self.framework.observe(self.framework.on.commit, self._on_commit)
+        self._stored.set_default(
+            things=[],
+            spec_fingerprint=None,
+            spec_hash=None,
+            spec_cache_hits=0,
+            spec_cache_misses=0,
+            violations_summary=None,
+        )
         self.image = OCIImageResource(self, "gatekeeper-image")
 
     def _on_config_changed(self, _):
@@ -49,6 +87,203 @@ class OPAAuditCharm(CharmBase):
         Set a new Juju pod specification
         """
         self._configure_pod()
+        self._publish_scrape_jobs()
+
+    def _on_metrics_endpoint_joined(self, _):
+        self._publish_scrape_jobs()
+
+    def _publish_scrape_jobs(self):
+        """
+        Publish the scrape job of the audit pod on the metrics-endpoint
+        relations
+        """
+        relations = self.model.relations["metrics-endpoint"]
+        if not self.unit.is_leader() or not relations:
+            return
+
+        jobs = json.dumps(
+            metrics.scrape_jobs(self.app.name, os.environ["JUJU_MODEL_NAME"])
+        )
+        metadata = json.dumps(
+            metrics.scrape_metadata(
+                self.model.name, self.model.uuid, self.app.name, self.meta.name
+            )
+        )
+        for relation in relations:
+            data = relation.data[self.app]
+            if data.get("scrape_jobs") != jobs:
+                data["scrape_jobs"] = jobs
+            if data.get("scrape_metadata") != metadata:
+                data["scrape_metadata"] = metadata
+
+    def _on_update_status(self, _):
+        """
+        Summarize the violations found by the audit in the unit status and
+        on the violations relations
+        """
+        if not self.unit.is_leader() or self.unit.status.name != "active":
+            return
+
+        import kubeapi
+
+        try:
+            with tracing.span("summarize_violations") as span:
+                summary = violations.summarize(
+                    page_size=self.model.config["violationsPageSize"],
+                    top_constraints=self.model.config["violationsTopConstraints"],
+                    top_namespaces=self.model.config["violationsTopNamespaces"],
+                )
+                span.set(constraints=summary["constraints"])
+        except kubeapi.ApiException as e:
+            logger.warning("Could not summarize the audit violations: %s", e)
+            return
+
+        self._stored.violations_summary = json.dumps(summary, sort_keys=True)
+        self.unit.status = self._active_status()
+        self._publish_violations()
+
+    def _active_status(self):
+        """
+        Active status showing the last violation summary
+        """
+        if self._stored.violations_summary is None:
+            return ActiveStatus()
+        summary = json.loads(self._stored.violations_summary)
+        return ActiveStatus(violations.status_message(summary))
+
+    def _on_violations_joined(self, _):
+        self._publish_violations()
+
+    def _publish_violations(self):
+        """
+        Publish the last violation summary on the violations relations
+        """
+        summary = self._stored.violations_summary
+        if not self.unit.is_leader() or summary is None:
+            return
+
+        for relation in self.model.relations["violations"]:
+            data = relation.data[self.app]
+            if data.get("summary") != summary:
+                data["summary"] = summary
+
+    def _on_export_violations_action(self, event):
+        """
+        Stream the recorded violations matching the filters into a
+        gzip-compressed file
+        """
+        import kubeapi
+
+        params = event.params
+        export_format = params["format"]
+        path = params["path"] or f"/tmp/violations.{export_format}.gz"
+        started = time.monotonic()
+        try:
+            with tracing.span("export_violations", format=export_format) as span:
+                counts = violations.export(
+                    path,
+                    export_format,
+                    page_size=params["page-size"]
+                    or self.model.config["violationsPageSize"],
+                    kinds=params["kinds"],
+                    namespaces=params["namespaces"],
+                    actions=params["enforcement-actions"],
+                    label_selector=params["selector"] or None,
+                )
+                span.set(**counts)
+        except (violations.ExportError, OSError, kubeapi.ApiException) as e:
+            event.fail(f"{path}: {e}")
+            return
+        event.set_results(
+            dict(
+                counts,
+                path=path,
+                bytes=os.path.getsize(path),
+                seconds=round(time.monotonic() - started, 3),
+            )
+        )
+
+    def _violations_options(self):
+        """
+        Validate the violation summary options
+        """
+        config = self.model.config
+        if config["violationsPageSize"] < 1:
+            raise AuditConfigError("violationsPageSize must be positive")
+        for option in ("violationsTopConstraints", "violationsTopNamespaces"):
+            if config[option] < 0:
+                raise AuditConfigError(f"{option} must not be negative")
+
+    def _hook_name(self):
+        action = os.environ.get("JUJU_ACTION_NAME")
+        if action:
+            return f"{action}-action"
+        return os.environ.get("JUJU_HOOK_NAME") or os.path.basename(
+            os.environ.get("JUJU_DISPATCH_PATH", "unknown")
+        )
+
+    def _on_commit(self, _):
+        """
+        Emit the hook's trace and export its metrics
+        """
+        root = tracing.tracer.finish()
+        self._emit_trace()
+        self._export_hook_metrics(root.duration)
+
+    def _emit_trace(self):
+        """
+        Log the hook's spans as one JSON line, and append them to the OTLP
+        file when one is configured
+        """
+        trace = tracing.tracer.to_dict(application=self.app.name, unit=self.unit.name)
+        logger.info("Hook trace: %s", json.dumps(trace, separators=(",", ":")))
+        path = self.model.config["traceOTLPFile"]
+        if not path:
+            return
+
+        try:
+            tracing.append_json_line(
+                path,
+                tracing.tracer.otlp(
+                    self.app.name,
+                    **{"juju.model": self.model.name, "juju.unit": self.unit.name},
+                ),
+            )
+        except OSError as e:
+            logger.warning("Could not export the hook trace: %s", e)
+
+    def _export_hook_metrics(self, seconds):
+        """
+        Export how long the hook took, and the Kubernetes API calls it made,
+        for the textfile collector and/or a Pushgateway
+        """
+        directory = self.model.config["metricsTextfileDirectory"]
+        url = self.model.config["metricsPushgatewayURL"]
+        if not directory and not url:
+            return
+
+        hook = self._hook_name()
+        # the API stats only exist when the hook loaded kubeapi
+        kubeapi = sys.modules.get("kubeapi")
+        text = metrics.hook_metrics(
+            {"application": self.app.name, "unit": self.unit.name, "hook": hook},
+            seconds,
+            time.time(),
+            kubeapi.api_stats if kubeapi else None,
+        )
+        try:
+            if directory:
+                metrics.write_textfile(
+                    directory, metrics.textfile_name(self.unit.name, hook), text
+                )
+            if url:
+                metrics.push(
+                    url,
+                    [("job", metrics.PREFIX), ("unit", self.unit.name), ("hook", hook)],
+                    text,
+                )
+        except OSError as e:
+            logger.warning("Could not export the hook metrics: %s", e)
 
     def _on_stop(self, _):
         """
@@ -60,51 +295,25 @@ class OPAAuditCharm(CharmBase):
     def _on_install(self, event):
         logger.info("Congratulations, the charm was properly installed!")
 
-    def _build_pod_spec(self):
+    def _build_pod_spec(self, image_details):
         """
         Construct a Juju pod specification for OPA
         """
         logger.debug("Building Pod Spec")
         crds = []
-        try:
-            crds = [
-                yaml.load(Path(f).read_text())
-                for f in [
-                    "files/configs.config.gatekeeper.sh.yaml",
-                    "files/constrainttemplates.templates.gatekeeper.sh.yaml",
-                    "files/constraintpodstatuses.status.gatekeeper.sh.yaml",
-                    "files/constrainttemplatepodstatuses.status.gatekeeper.sh.yaml",
-                ]
-            ]
-        except yaml.YAMLError as exc:
-            logger.error("Error in configuration file:", exc)
-
-        crd_objects = [
-            CustomResourceDefintion(crd["metadata"]["name"], crd["spec"])
-            for crd in crds
-        ]
-
-        config = self.model.config
-        spec_template = {}
-        with open("files/pod-spec.yaml.jinja2") as fh:
-            spec_template = Template(fh.read())
+        if podspec.crds_in_pod_spec(self.model.config["crdInstall"]):
+            with tracing.span("load_crds", files=len(CRD_FILES)):
+                try:
+                    crds = [manifests.load_yaml(f) for f in CRD_FILES]
+                except yaml.YAMLError as exc:
+                    logger.error("Error in configuration file:", exc)
 
-        try:
-            image_details = self.image.fetch()
-        except OCIImageResourceError as e:
-            self.model.unit.status = e.status
-            return
-
-        template_args = {
-            "crds": crd_objects,
-            "image_details": image_details,
-            "imagePullPolicy": config["imagePullPolicy"],
-            "app_name": self.app.name,
-            "audit_cli_args": self._audit_cli_args(),
-            "namespace": os.environ["JUJU_MODEL_NAME"],
-        }
-
-        spec = yaml.load(spec_template.render(**template_args))
+        spec = podspec.audit_pod_spec(
+            crds,
+            image_details,
+            self.model.config["imagePullPolicy"],
+            self._audit_cli_args(),
+        )
 
         print(f"Pod spec: {spec}")
         return spec
@@ -114,14 +323,38 @@ class OPAAuditCharm(CharmBase):
         Construct command line arguments for OPA Audit
         """
 
+        config = self.model.config
         args = [
             "--operation=audit",
             "--operation=status",
             "--logtostderr",
         ]
+        for option, flag in AUDIT_INT_FLAGS:
+            if config[option] < 0:
+                raise AuditConfigError(f"{option} must not be negative")
+            args.append(f"{flag}={config[option]}")
+        for option, flag in AUDIT_BOOL_FLAGS:
+            args.append(f"{flag}={str(config[option]).lower()}")
 
         return args
 
+    def _spec_fingerprint(self, image_details):
+        """
+        Hash every input the pod specification is built from
+        """
+        digest = hashlib.sha256()
+        for f in [podspec.__file__] + CRD_FILES:
+            digest.update(hashlib.sha256(Path(f).read_bytes()).digest())
+        inputs = {
+            "config": dict(self.model.config),
+            "image_details": image_details,
+            "app_name": self.app.name,
+            "audit_cli_args": self._audit_cli_args(),
+            "namespace": os.environ["JUJU_MODEL_NAME"],
+        }
+        digest.update(json.dumps(inputs, sort_keys=True).encode())
+        return digest.hexdigest()
+
     def _configure_pod(self):
         """
         Setup a new opa pod specification
@@ -133,10 +366,42 @@ class OPAAuditCharm(CharmBase):
             return
 
         self.unit.status = MaintenanceStatus("Setting pod spec.")
-        pod_spec = self._build_pod_spec()
+        try:
+            with tracing.span("image_fetch"):
+                image_details = self.image.fetch()
+        except OCIImageResourceError as e:
+            self.model.unit.status = e.status
+            return
+
+        try:
+            self._audit_cli_args()
+            self._violations_options()
+            podspec.crds_in_pod_spec(self.model.config["crdInstall"])
+        except (AuditConfigError, podspec.PodSpecConfigError) as e:
+            self.unit.status = BlockedStatus(str(e))
+            return
 
-        self.model.pod.set_spec(pod_spec)
-        self.unit.status = ActiveStatus()
+        fingerprint = self._spec_fingerprint(image_details)
+        if fingerprint == self._stored.spec_fingerprint:
+            self._stored.spec_cache_hits += 1
+        else:
+            self._stored.spec_cache_misses += 1
+            with tracing.span("build_pod_spec"):
+                pod_spec = self._build_pod_spec(image_details)
+            spec_hash = hashlib.sha256(
+                json.dumps(pod_spec, sort_keys=True).encode()
+            ).hexdigest()
+            if spec_hash != self._stored.spec_hash:
+                with tracing.span("set_spec"):
+                    self.model.pod.set_spec(pod_spec)
+                self._stored.spec_hash = spec_hash
+            self._stored.spec_fingerprint = fingerprint
+        logger.debug(
+            "Pod spec cache: %d hits, %d misses",
+            self._stored.spec_cache_hits,
+            self._stored.spec_cache_misses,
+        )
+        self.unit.status = self._active_status()
 
 
 if __name__ == "__main__":
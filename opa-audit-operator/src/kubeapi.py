@@ -0,0 +1,125 @@
+"""Read-only Kubernetes API access for the audit charm.
+
+The audit charm only discovers the constraint kinds and lists constraints
+page by page, so this module holds just that: one keep-alive API client per
+hook process, created on first use, whose calls are counted in api_stats for
+the hook metrics. Applying, watching and deleting objects is the manager
+charm's business.
+"""
+
+import os
+import threading
+import time
+
+from kubernetes import client, config
+from kubernetes.client.rest import ApiException
+
+__all__ = ["ApiException", "api_resource_kinds", "api_stats", "list_page"]
+
+
+class ApiCallStats(object):
+    """Count and time the Kubernetes API calls made by this process.
+
+    The audit charm neither rate limits nor retries its calls, so retries
+    and throttled_seconds, read by the hook metrics, stay at zero.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self.retries = 0
+            self.throttled_seconds = 0.0
+
+    def record(self, method, seconds, failed):
+        with self._lock:
+            stats = self._methods.setdefault(
+                method, {"calls": 0, "errors": 0, "seconds": 0.0}
+            )
+            stats["calls"] += 1
+            stats["errors"] += int(failed)
+            stats["seconds"] += seconds
+
+    @property
+    def calls(self):
+        with self._lock:
+            return sum(stats["calls"] for stats in self._methods.values())
+
+    def snapshot(self):
+        """Per HTTP method call counts, error counts and total seconds."""
+        with self._lock:
+            return {method: dict(stats) for method, stats in self._methods.items()}
+
+
+api_stats = ApiCallStats()
+
+_lock = threading.Lock()
+_api_client = None
+
+
+def _load_kube_config():
+    # TODO: Remove this workaround when bug LP:1892255 is fixed
+    from pathlib import Path
+
+    os.environ.update(
+        dict(
+            e.split("=")
+            for e in Path("/proc/1/environ").read_text().split("\x00")
+            if "KUBERNETES_SERVICE" in e
+        )
+    )
+    # end workaround
+    config.load_incluster_config()
+
+
+def _client():
+    global _api_client
+    with _lock:
+        if _api_client is None:
+            _load_kube_config()
+            _api_client = client.ApiClient()
+        return _api_client
+
+
+def _get(path, query_params=None):
+    """GET an API path, returning the decoded JSON response."""
+    started = time.monotonic()
+    failed = True
+    try:
+        response = _client().call_api(
+            path,
+            "GET",
+            query_params=query_params or [],
+            header_params={"Accept": "application/json"},
+            response_type="object",
+            auth_settings=["BearerToken"],
+            _return_http_data_only=True,
+        )
+        failed = False
+        return response
+    finally:
+        api_stats.record("GET", time.monotonic() - started, failed)
+
+
+def api_resource_kinds(group_version):
+    """Map the kinds of the resources, without subresources, served in a
+    groupVersion to their resource names."""
+    path = "/api/v1" if group_version == "v1" else f"/apis/{group_version}"
+    return {
+        resource["kind"]: resource["name"]
+        for resource in _get(path).get("resources", [])
+        if "/" not in resource["name"]
+    }
+
+
+def list_page(collection, limit, continue_token=None, label_selector=None):
+    """One page of a paginated list, the raw List with its metadata.continue."""
+    query_params = [("limit", limit)]
+    if continue_token:
+        query_params.append(("continue", continue_token))
+    if label_selector:
+        query_params.append(("labelSelector", label_selector))
+    return _get(collection, query_params)
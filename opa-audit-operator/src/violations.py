@@ -0,0 +1,251 @@
+"""Summarize the violations found by gatekeeper's audit.
+
+The audit records its results in the status of every constraint:
+totalViolations, the number of objects violating it, and violations, the
+first constraintViolationsLimit of those objects with their namespace. The
+summary lists each constraint kind page by page (limit and continue) and
+keeps running totals and the most violated constraints only, so the memory
+it needs grows with the number of namespaces, not with the number or the
+size of the constraint objects.
+
+Namespaces are counted from the recorded violations, so when a constraint
+has more violations than its status records the namespace counts are a
+sample of them.
+
+The export streams every recorded violation to a gzip-compressed JSON lines
+or CSV file as the pages are read, so it never holds more than a page of
+constraints either. Constraint kinds and labels are filtered by the API
+server, by listing only the matching kinds with a labelSelector; namespaces
+and enforcement actions live in the constraints' status, which the server
+cannot filter on, and are filtered while streaming.
+
+kubeapi is imported by the functions that list constraints, so that the charm
+can format a summary without loading the Kubernetes client.
+"""
+
+import csv
+import gzip
+import heapq
+import json
+import os
+from collections import Counter
+
+CONSTRAINTS_API = "constraints.gatekeeper.sh/v1beta1"
+PAGE_SIZE = 100
+TOP_CONSTRAINTS = 10
+TOP_NAMESPACES = 5
+# constraints without spec.enforcementAction are enforced
+DEFAULT_ENFORCEMENT_ACTION = "deny"
+
+EXPORT_FORMATS = ["jsonl", "csv"]
+EXPORT_FIELDS = [
+    "constraintKind",
+    "constraint",
+    "enforcementAction",
+    "kind",
+    "namespace",
+    "name",
+    "message",
+]
+# zlib's default, several times faster than gzip's 9 for a little more size
+EXPORT_COMPRESSLEVEL = 6
+
+
+class ExportError(Exception):
+    """The export parameters are invalid."""
+
+
+def constraint_collections(kinds=None):
+    """API paths of the constraint kinds, or of those in kinds, none before
+    any template exists."""
+    import kubeapi
+
+    try:
+        plurals = kubeapi.api_resource_kinds(CONSTRAINTS_API)
+    except kubeapi.ApiException as err:
+        if err.status == 404:
+            return []
+        raise
+    return [
+        f"/apis/{CONSTRAINTS_API}/{plural}"
+        for kind, plural in sorted(plurals.items())
+        if not kinds or kind in kinds
+    ]
+
+
+def constraints(collection, page_size=PAGE_SIZE, label_selector=None):
+    """Yield the constraints of a kind, requesting them page_size at a time."""
+    import kubeapi
+
+    continue_token = None
+    while True:
+        page = kubeapi.list_page(
+            collection, page_size, continue_token, label_selector=label_selector
+        )
+        continue_token = page.get("metadata", {}).get("continue")
+        items = page.get("items", [])
+        # only one page is held at a time, not this one and the next
+        del page
+        yield from items
+        del items
+        if not continue_token:
+            return
+
+
+def enforcement_action(constraint):
+    """The enforcement action of a constraint."""
+    spec = constraint.get("spec") or {}
+    return spec.get("enforcementAction") or DEFAULT_ENFORCEMENT_ACTION
+
+
+def summarize(
+    page_size=PAGE_SIZE, top_constraints=TOP_CONSTRAINTS, top_namespaces=TOP_NAMESPACES
+):
+    """Total the violations of every constraint.
+
+    Returns a JSON-serializable dict: the total, the number of constraints
+    and of violated constraints, the totals per enforcement action, and the
+    most violated constraints and namespaces, most violated first.
+    """
+    total = 0
+    count = 0
+    violated = 0
+    actions = Counter()
+    # min-heap of the most violated constraints seen so far
+    top = []
+    namespaces = Counter()
+    for collection in constraint_collections():
+        for constraint in constraints(collection, page_size):
+            count += 1
+            status = constraint.get("status") or {}
+            violations = status.get("totalViolations") or 0
+            if not violations:
+                continue
+            action = enforcement_action(constraint)
+            total += violations
+            violated += 1
+            actions[action] += violations
+            entry = (violations, constraint.get("kind"), constraint["metadata"]["name"])
+            if len(top) < top_constraints:
+                heapq.heappush(top, entry + (action,))
+            elif top_constraints and entry > top[0][:3]:
+                heapq.heapreplace(top, entry + (action,))
+            for violation in status.get("violations") or []:
+                # cluster-scoped objects have no namespace
+                if violation.get("namespace"):
+                    namespaces[violation["namespace"]] += 1
+    return {
+        "totalViolations": total,
+        "constraints": count,
+        "violatedConstraints": violated,
+        "enforcementActions": dict(sorted(actions.items())),
+        "topConstraints": [
+            {
+                "kind": kind,
+                "name": name,
+                "enforcementAction": action,
+                "violations": violations,
+            }
+            for violations, kind, name, action in sorted(
+                top, key=lambda c: (-c[0], c[1], c[2])
+            )
+        ],
+        "topNamespaces": [
+            {"namespace": namespace, "violations": violations}
+            for namespace, violations in heapq.nsmallest(
+                top_namespaces, namespaces.items(), key=lambda n: (-n[1], n[0])
+            )
+        ],
+    }
+
+
+def status_message(summary):
+    """One line summary for the unit status."""
+    total = summary["totalViolations"]
+    if not total:
+        return f"No violations of {summary['constraints']} constraints"
+    actions = ", ".join(
+        f"{action}: {violations}"
+        for action, violations in summary["enforcementActions"].items()
+    )
+    message = (
+        f"{total} violations of {summary['violatedConstraints']}"
+        f"/{summary['constraints']} constraints ({actions})"
+    )
+    if summary["topNamespaces"]:
+        top = summary["topNamespaces"][0]
+        message += f", most in {top['namespace']} ({top['violations']})"
+    return message
+
+
+def _split(value):
+    return {item.strip() for item in (value or "").split(",") if item.strip()}
+
+
+def export(
+    path,
+    export_format="jsonl",
+    page_size=PAGE_SIZE,
+    kinds=None,
+    namespaces=None,
+    actions=None,
+    label_selector=None,
+):
+    """Stream the recorded violations matching the filters into a gzip file.
+
+    kinds, namespaces and actions are comma separated lists, empty for all.
+    The file is written next to path and renamed into place once complete.
+    Returns the number of constraints read, of violations exported, and of
+    violations the constraints counted but did not record.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    namespaces = _split(namespaces)
+    actions = _split(actions)
+    counts = {"constraints": 0, "violations": 0, "unrecorded": 0}
+    partial = f"{path}.part"
+    try:
+        with gzip.open(
+            partial, "wt", compresslevel=EXPORT_COMPRESSLEVEL, newline=""
+        ) as fh:
+            if export_format == "csv":
+                writer = csv.DictWriter(fh, EXPORT_FIELDS, extrasaction="ignore")
+                writer.writeheader()
+                write = writer.writerow
+            else:
+
+                def write(row):
+                    fh.write(json.dumps(row, separators=(",", ":")) + "\n")
+
+            for collection in constraint_collections(_split(kinds)):
+                for constraint in constraints(collection, page_size, label_selector):
+                    counts["constraints"] += 1
+                    status = constraint.get("status") or {}
+                    recorded = status.get("violations") or []
+                    counts["unrecorded"] += max(
+                        (status.get("totalViolations") or 0) - len(recorded), 0
+                    )
+                    action = enforcement_action(constraint)
+                    for violation in recorded:
+                        row = {
+                            "constraintKind": constraint.get("kind"),
+                            "constraint": constraint["metadata"]["name"],
+                            "enforcementAction": violation.get("enforcementAction")
+                            or action,
+                            "kind": violation.get("kind"),
+                            "namespace": violation.get("namespace", ""),
+                            "name": violation.get("name"),
+                            "message": violation.get("message"),
+                        }
+                        if namespaces and row["namespace"] not in namespaces:
+                            continue
+                        if actions and row["enforcementAction"] not in actions:
+                            continue
+                        write(row)
+                        counts["violations"] += 1
+        os.replace(partial, path)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    return counts
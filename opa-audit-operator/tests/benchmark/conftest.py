@@ -0,0 +1,125 @@
+"""Shared helpers for the hook benchmarks.
+
+Measurements are collected during the session and written as JSON to
+BENCHMARK_RESULTS (default: benchmark-results.json) so that runs on
+different commits can be compared.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+RESULTS_FILE = os.environ.get("BENCHMARK_RESULTS", "benchmark-results.json")
+
+_results = {}
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _api_stats():
+    try:
+        import kubeapi
+    except ImportError:
+        return None
+    return kubeapi.api_stats
+
+
+def measure(harness, name, hook):
+    """Run hook() and record its wall time, peak memory, API calls and the
+    size of any pod spec it sets."""
+    pod = harness.charm.model.pod
+    api_stats = _api_stats()
+    if api_stats:
+        api_stats.reset()
+    with patch.object(pod, "set_spec", wraps=pod.set_spec) as set_spec:
+        tracemalloc.start()
+        started = time.perf_counter()
+        hook()
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    spec_bytes = [len(json.dumps(c[0][0])) for c in set_spec.call_args_list]
+    _results[name] = {
+        "wall_ms": round(wall * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "api_calls": api_stats.calls if api_stats else 0,
+        "set_spec_calls": len(spec_bytes),
+        "spec_bytes": sum(spec_bytes),
+    }
+    return _results[name]
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if not _results:
+        return
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "results": _results,
+    }
+    with open(RESULTS_FILE, "w") as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+    print(f"\nBenchmark results written to {RESULTS_FILE}")
+
+
+@pytest.fixture
+def fake_k8s_api():
+    """Serve API calls from an in-memory store instead of a cluster."""
+    from kubernetes.client.rest import ApiException
+    import kubeapi
+
+    objects = {}
+    versions = iter(range(1, 1000000))
+
+    def call_api(self, resource_path, method, *args, **kwargs):
+        if method == "GET":
+            if resource_path in objects:
+                return objects[resource_path]
+            items = [
+                obj
+                for path, obj in objects.items()
+                if path.rsplit("/", 1)[0] == resource_path
+            ]
+            if not items:
+                raise ApiException(status=404)
+            query = dict(kwargs.get("query_params") or [])
+            if "limit" not in query:
+                return {"items": items}
+            # a page is decoded from the response like any other
+            start = int(query.get("continue") or 0)
+            end = start + query["limit"]
+            page = {"items": items[start:end], "metadata": {}}
+            if end < len(items):
+                page["metadata"]["continue"] = str(end)
+            return json.loads(json.dumps(page))
+        if method == "PATCH":
+            obj = json.loads(kwargs["body"])
+            obj["metadata"]["resourceVersion"] = str(next(versions))
+            objects[resource_path] = obj
+            return obj
+        return {}
+
+    with patch("kubeapi._load_kube_config"), patch(
+        "kubernetes.client.ApiClient.call_api", call_api
+    ):
+        yield objects
+    # the next test's client loads its own configuration
+    kubeapi._api_client = None
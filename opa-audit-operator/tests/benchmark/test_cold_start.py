@@ -0,0 +1,63 @@
+"""Import-time and cold-start budget of a hook process.
+
+Every hook runs in a new Python process, so the cost of importing the charm
+is paid by every update-status and config-changed. Budgets can be raised on
+slow machines with HOOK_IMPORT_BUDGET_MS and HOOK_COLD_START_BUDGET_MS.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+IMPORT_BUDGET_MS = float(os.environ.get("HOOK_IMPORT_BUDGET_MS", 400))
+COLD_START_BUDGET_MS = float(os.environ.get("HOOK_COLD_START_BUDGET_MS", 1000))
+ROUNDS = 5
+
+# Modules only the hooks that talk to the Kubernetes API may import
+DEFERRED_MODULES = ["kubernetes", "charmhelpers", "jinja2"]
+
+
+def _python(*args):
+    env = dict(os.environ, PYTHONPATH="src")
+    return subprocess.run(
+        [sys.executable, *args],
+        env=env,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+
+
+def test_import_time():
+    timings = []
+    for _ in range(ROUNDS):
+        stderr = _python("-X", "importtime", "-c", "import charm").stderr
+        # the last line is the cumulative time of the charm module itself
+        cumulative_us = int(stderr.strip().splitlines()[-1].split("|")[1])
+        timings.append(cumulative_us / 1000)
+
+    print(f"import charm: {min(timings):.1f}ms (budget {IMPORT_BUDGET_MS}ms)")
+    assert min(timings) < IMPORT_BUDGET_MS
+
+
+def test_cold_start():
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        _python("-c", "import charm")
+        timings.append((time.perf_counter() - started) * 1000)
+
+    print(f"cold start: {min(timings):.1f}ms (budget {COLD_START_BUDGET_MS}ms)")
+    assert min(timings) < COLD_START_BUDGET_MS
+
+
+def test_heavy_modules_deferred():
+    stdout = _python(
+        "-c",
+        "import sys, charm; print(' '.join(sys.modules))",
+    ).stdout
+    loaded = {name.split(".")[0] for name in stdout.split()}
+
+    assert loaded.isdisjoint(DEFERRED_MODULES)
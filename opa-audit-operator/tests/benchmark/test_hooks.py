@@ -0,0 +1,157 @@
+"""Hook performance of the audit charm under ops.testing.Harness."""
+
+import os
+from unittest.mock import Mock
+import pytest
+from ops.testing import Harness
+from charm import OPAAuditCharm
+from conftest import measure
+import violations
+
+
+@pytest.fixture
+def harness():
+    os.environ["JUJU_MODEL_NAME"] = "benchmark-model"
+    harness = Harness(OPAAuditCharm)
+    harness.add_oci_resource("gatekeeper-image")
+    yield harness
+    harness.cleanup()
+
+
+def test_config_changed(harness):
+    harness.set_leader(True)
+    harness.begin()
+
+    cold = measure(
+        harness, "audit.config_changed.cold", harness.charm.on.config_changed.emit
+    )
+    cached = measure(
+        harness, "audit.config_changed.cached", harness.charm.on.config_changed.emit
+    )
+    changed = measure(
+        harness,
+        "audit.config_changed.changed",
+        lambda: harness.update_config({"imagePullPolicy": "IfNotPresent"}),
+    )
+
+    assert cold["set_spec_calls"] == 1
+    assert cached["set_spec_calls"] == 0
+    assert changed["set_spec_calls"] == 1
+
+
+def test_config_changed_crd_install(harness):
+    harness.set_leader(True)
+    harness.begin()
+
+    pod_spec = measure(
+        harness,
+        "audit.config_changed.crds_in_pod_spec",
+        harness.charm.on.config_changed.emit,
+    )
+    api = measure(
+        harness,
+        "audit.config_changed.crds_through_api",
+        lambda: harness.update_config({"crdInstall": "api"}),
+    )
+
+    assert api["spec_bytes"] * 2 < pod_spec["spec_bytes"]
+
+
+def test_leader_elected(harness):
+    harness.begin()
+    harness.charm.on.config_changed.emit()
+
+    elected = measure(harness, "audit.leader_elected", lambda: harness.set_leader(True))
+
+    assert elected["set_spec_calls"] == 1
+
+
+def _constraints(fake_k8s_api, count, recorded=20):
+    api = "/apis/constraints.gatekeeper.sh/v1beta1"
+    fake_k8s_api[api] = {
+        "resources": [
+            {
+                "name": "k8srequiredlabels",
+                "kind": "K8sRequiredLabels",
+                "verbs": ["create"],
+            }
+        ]
+    }
+    for i in range(count):
+        fake_k8s_api[f"{api}/k8srequiredlabels/owner-{i}"] = {
+            "kind": "K8sRequiredLabels",
+            "metadata": {"name": f"owner-{i}"},
+            "spec": {"enforcementAction": "dryrun" if i % 2 else "deny"},
+            "status": {
+                "totalViolations": 100,
+                "violations": [
+                    {
+                        "kind": "Pod",
+                        "name": f"pod-{v}",
+                        "namespace": f"namespace-{v % 10}",
+                        "message": "you must provide labels: {'owner'}",
+                        "enforcementAction": "deny",
+                    }
+                    for v in range(recorded)
+                ],
+            },
+        }
+
+
+def test_update_status_violations(harness, fake_k8s_api):
+    harness.set_leader(True)
+    harness.begin()
+    harness.charm.on.config_changed.emit()
+    # the first summary loads the Kubernetes client
+    harness.charm.on.update_status.emit()
+
+    peaks = {}
+    for count in (100, 1000):
+        _constraints(fake_k8s_api, count)
+        summary = measure(
+            harness,
+            f"audit.update_status.violations.{count}",
+            harness.charm.on.update_status.emit,
+        )
+        # discovery, then one list call per page of 100 constraints
+        assert summary["api_calls"] == 1 + count // 100
+        peaks[count] = summary["peak_kib"]
+        assert harness.charm.unit.status.message.startswith(f"{count * 100} violations")
+
+    # pages are dropped once counted: the memory is that of one page
+    assert peaks[1000] < 1.5 * peaks[100]
+
+
+def test_export_violations(harness, fake_k8s_api, tmp_path):
+    harness.begin()
+    # the first export loads the Kubernetes client
+    violations.export(str(tmp_path / "warm.gz"))
+
+    peaks = {}
+    for count in (100, 1000):
+        _constraints(fake_k8s_api, count)
+        path = tmp_path / f"violations-{count}.jsonl.gz"
+        event = Mock(
+            params={
+                "path": str(path),
+                "format": "jsonl",
+                "kinds": "",
+                "namespaces": "",
+                "enforcement-actions": "",
+                "selector": "",
+                "page-size": 0,
+            }
+        )
+        exported = measure(
+            harness,
+            f"audit.export_violations.{count}",
+            lambda: harness.charm._on_export_violations_action(event),
+        )
+        results = event.set_results.call_args[0][0]
+        assert results["violations"] == count * 20
+        assert exported["api_calls"] == 1 + count // 100
+        peaks[count] = exported["peak_kib"]
+
+    # rows are written as the pages are read: ten times the violations
+    # exported in the memory of one page
+    assert peaks[1000] < 1.5 * peaks[100]
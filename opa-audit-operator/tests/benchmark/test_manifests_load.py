@@ -0,0 +1,45 @@
+"""Hook-time parse cost of the bundled CRDs, before and after precompiling."""
+
+import time
+from pathlib import Path
+import yaml
+import manifests
+from charm import CRD_FILES
+
+ROUNDS = 20
+
+
+def _best_of(fn):
+    timings = []
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def test_bundle_load_cost(tmp_path):
+    bundle_path = tmp_path / "manifests.json"
+    manifests.build_bundle("files", bundle_path)
+
+    def python_loader():
+        return [yaml.load(Path(f).read_text(), yaml.Loader) for f in CRD_FILES]
+
+    def c_loader():
+        return [manifests.parse_yaml(Path(f).read_bytes()) for f in CRD_FILES]
+
+    def bundle():
+        # every hook is a new process, so include reading the bundle itself
+        manifests._bundle = None
+        return [manifests.load_yaml(f, bundle_path) for f in CRD_FILES]
+
+    assert bundle() == python_loader() == c_loader()
+    timings = {
+        "yaml.Loader": _best_of(python_loader),
+        "CSafeLoader": _best_of(c_loader),
+        "bundle": _best_of(bundle),
+    }
+    manifests._bundle = None
+    for name, seconds in timings.items():
+        print(f"{name:>12}: {seconds * 1000:.2f}ms")
+    assert timings["bundle"] < timings["yaml.Loader"]
@@ -1,7 +1,11 @@
 # Copyright {{ year }} {{ author }}
 # See LICENSE file for licensing details.
 
+import json
+import os
+import tempfile
 import unittest
+from unittest.mock import patch
 from ops.testing import Harness
 from charm import OPAAuditCharm
 
@@ -15,9 +19,40 @@ class TestCharm(unittest.TestCase):
             "--operation=audit",
             "--operation=status",
             "--logtostderr",
+            "--audit-interval=300",
+            "--constraint-violations-limit=20",
+            "--audit-chunk-size=500",
+            "--audit-from-cache=false",
+            "--audit-match-kind-only=true",
         ]
         assert args == harness.charm._audit_cli_args()
 
+    def test_cli_args_from_config(self):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        harness.update_config(
+            {"auditInterval": 0, "auditChunkSize": 0, "auditFromCache": True}
+        )
+
+        args = harness.charm._audit_cli_args()
+        assert "--audit-interval=0" in args
+        assert "--audit-chunk-size=0" in args
+        assert "--audit-from-cache=true" in args
+
+    def test_invalid_audit_config_blocks(self):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-audit-config"
+        harness.add_oci_resource("gatekeeper-image")
+        harness.set_leader(True)
+        harness.begin()
+
+        harness.update_config({"constraintViolationsLimit": -1})
+
+        assert harness.charm.unit.status.name == "blocked"
+        assert "constraintViolationsLimit" in harness.charm.unit.status.message
+
     def test_on_config_changed(self):
         harness = Harness(OPAAuditCharm)
         self.addCleanup(harness.cleanup)
@@ -45,3 +80,115 @@ class TestCharm(unittest.TestCase):
         harness.begin()
 
         assert harness.charm._configure_pod() is None
+
+    def test_configure_pod_spec_cache(self):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-spec-cache"
+        harness.add_oci_resource("gatekeeper-image")
+        harness.set_leader(True)
+        harness.begin()
+
+        with patch.object(harness.charm, "_build_pod_spec") as build:
+            build.return_value = {"version": 3, "containers": []}
+            harness.charm._configure_pod()
+            harness.charm._configure_pod()
+            harness.charm._stored.spec_fingerprint = None
+            harness.charm._configure_pod()
+
+        assert build.call_count == 2
+        assert harness.charm._stored.spec_cache_hits == 1
+        assert harness.charm._stored.spec_cache_misses == 2
+        spec, _ = harness.get_pod_spec()
+        assert spec == {"version": 3, "containers": []}
+
+    def test_scrape_job_published(self):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-metrics"
+        harness.set_leader(True)
+        harness.begin()
+        relation_id = harness.add_relation("metrics-endpoint", "prometheus")
+        harness.add_relation_unit(relation_id, "prometheus/0")
+
+        data = harness.get_relation_data(relation_id, harness.charm.app.name)
+        [job] = json.loads(data["scrape_jobs"])
+        assert job["static_configs"] == [
+            {"targets": [f"{harness.charm.app.name}.test-metrics.svc:8888"]}
+        ]
+        assert json.loads(data["scrape_metadata"])["application"] == (
+            harness.charm.app.name
+        )
+
+    def test_hook_metrics_written_on_commit(self):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        with tempfile.TemporaryDirectory() as directory:
+            harness.update_config({"metricsTextfileDirectory": directory})
+            with patch.dict(os.environ, {"JUJU_HOOK_NAME": "config-changed"}):
+                harness.charm.framework.on.commit.emit()
+
+            [name] = os.listdir(directory)
+            assert name.endswith("_config-changed.prom")
+
+    def test_trace_emitted_on_commit(self):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        harness.add_oci_resource("gatekeeper-image")
+        harness.set_leader(True)
+        harness.begin()
+        harness.update_config({"auditInterval": 60})
+        with self.assertLogs("charm", "INFO") as logs:
+            harness.charm.framework.on.commit.emit()
+
+        line = [o for o in logs.output if "Hook trace: " in o][0]
+        trace = json.loads(line.split("Hook trace: ", 1)[1])
+        build = [span for span in trace["spans"] if span["name"] == "build_pod_spec"]
+        assert build[0]["spans"][0]["name"] == "load_crds"
+
+    @patch("violations.summarize")
+    def test_violations_summarized_on_update_status(self, summarize):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-violations"
+        harness.add_oci_resource("gatekeeper-image")
+        harness.set_leader(True)
+        harness.begin()
+        harness.charm.on.config_changed.emit()
+        summary = {
+            "totalViolations": 3,
+            "constraints": 1,
+            "violatedConstraints": 1,
+            "enforcementActions": {"deny": 3},
+            "topConstraints": [
+                {
+                    "kind": "K8sRequiredLabels",
+                    "name": "owner",
+                    "enforcementAction": "deny",
+                    "violations": 3,
+                }
+            ],
+            "topNamespaces": [{"namespace": "default", "violations": 3}],
+        }
+        summarize.return_value = summary
+
+        harness.charm.on.update_status.emit()
+        relation_id = harness.add_relation("violations", "dashboard")
+        harness.add_relation_unit(relation_id, "dashboard/0")
+
+        assert harness.charm.unit.status.message == (
+            "3 violations of 1/1 constraints (deny: 3), most in default (3)"
+        )
+        data = harness.get_relation_data(relation_id, harness.charm.app.name)
+        assert json.loads(data["summary"]) == summary
+        # the pod spec status keeps the summary
+        harness.update_config({"auditInterval": 60})
+        assert harness.charm.unit.status.message.startswith("3 violations")
+
+        import kubeapi
+
+        summarize.side_effect = kubeapi.ApiException(status=500)
+        summarize.return_value = None
+        harness.charm.on.update_status.emit()
+        assert harness.charm.unit.status.message.startswith("3 violations")
@@ -0,0 +1,69 @@
+import ast
+import pathlib
+import unittest
+from unittest.mock import patch
+import kubeapi
+
+SRC = pathlib.Path(__file__).parents[2] / "src"
+
+
+class TestKubeApi(unittest.TestCase):
+    def setUp(self):
+        kubeapi.api_stats.reset()
+        patcher = patch("kubeapi._load_kube_config")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(setattr, kubeapi, "_api_client", None)
+
+    def test_charm_uses_only_the_read_only_surface(self):
+        self.assertEqual(
+            sorted(kubeapi.__all__),
+            ["ApiException", "api_resource_kinds", "api_stats", "list_page"],
+        )
+        self.assertFalse((SRC / "utils.py").exists())
+        for path in SRC.glob("*.py"):
+            for node in ast.walk(ast.parse(path.read_text())):
+                if (
+                    isinstance(node, ast.Attribute)
+                    and isinstance(node.value, ast.Name)
+                    and node.value.id == "kubeapi"
+                ):
+                    self.assertIn(node.attr, kubeapi.__all__, path.name)
+
+    @patch("kubernetes.client.ApiClient.call_api")
+    def test_list_page(self, call_api):
+        call_api.return_value = {"items": [], "metadata": {}}
+        page = kubeapi.list_page("/apis/g/v1/kinds", 100, "abc", label_selector="a=b")
+        self.assertEqual(page, {"items": [], "metadata": {}})
+        args, kwargs = call_api.call_args
+        self.assertEqual(args, ("/apis/g/v1/kinds", "GET"))
+        self.assertEqual(
+            kwargs["query_params"],
+            [("limit", 100), ("continue", "abc"), ("labelSelector", "a=b")],
+        )
+        self.assertEqual(kubeapi.api_stats.snapshot()["GET"]["calls"], 1)
+
+    @patch("kubernetes.client.ApiClient.call_api")
+    def test_api_resource_kinds(self, call_api):
+        call_api.return_value = {
+            "resources": [
+                {"kind": "K8sDenyAll", "name": "k8sdenyall"},
+                {"kind": "K8sDenyAll", "name": "k8sdenyall/status"},
+            ]
+        }
+        self.assertEqual(
+            kubeapi.api_resource_kinds("constraints.gatekeeper.sh/v1beta1"),
+            {"K8sDenyAll": "k8sdenyall"},
+        )
+        self.assertEqual(
+            call_api.call_args[0][0], "/apis/constraints.gatekeeper.sh/v1beta1"
+        )
+
+    @patch(
+        "kubernetes.client.ApiClient.call_api",
+        side_effect=kubeapi.ApiException(status=500),
+    )
+    def test_errors_counted(self, call_api):
+        with self.assertRaises(kubeapi.ApiException):
+            kubeapi.list_page("/api/v1/pods", 10)
+        self.assertEqual(kubeapi.api_stats.snapshot()["GET"]["errors"], 1)
@@ -0,0 +1,37 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest.mock import patch
+import manifests
+
+
+class TestManifests(unittest.TestCase):
+    def setUp(self):
+        tmp = TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.files = Path(tmp.name)
+        self.bundle_path = self.files / "manifests.json"
+        (self.files / "crd.yaml").write_text("kind: CustomResourceDefinition\n")
+        manifests._bundle = None
+        self.addCleanup(setattr, manifests, "_bundle", None)
+
+    def test_load_from_bundle(self):
+        bundle = manifests.build_bundle(self.files, self.bundle_path)
+
+        assert bundle["format"] == manifests.BUNDLE_FORMAT
+        with patch("manifests.parse_yaml") as parse_yaml:
+            document = manifests.load_yaml(self.files / "crd.yaml", self.bundle_path)
+        parse_yaml.assert_not_called()
+        assert document == {"kind": "CustomResourceDefinition"}
+
+    def test_stale_bundle_falls_back_to_yaml(self):
+        manifests.build_bundle(self.files, self.bundle_path)
+        (self.files / "crd.yaml").write_text("kind: PodSecurityPolicy\n")
+
+        document = manifests.load_yaml(self.files / "crd.yaml", self.bundle_path)
+        assert document == {"kind": "PodSecurityPolicy"}
+
+    def test_missing_bundle_falls_back_to_yaml(self):
+        document = manifests.load_yaml(self.files / "crd.yaml", self.bundle_path)
+
+        assert document == {"kind": "CustomResourceDefinition"}
@@ -0,0 +1,37 @@
+import json
+import os
+import unittest
+from pathlib import Path
+from ops.testing import Harness
+from charm import OPAAuditCharm
+
+IMAGE_DETAILS = {
+    "imagePath": "openpolicyagent/gatekeeper:v3.2.3",
+    "username": "",
+    "password": "",
+}
+
+
+class TestPodSpec(unittest.TestCase):
+    def test_pod_spec_matches_golden(self):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "golden-model"
+        harness.begin()
+
+        spec = harness.charm._build_pod_spec(IMAGE_DETAILS)
+
+        golden = Path("tests/unit/golden/pod-spec.json").read_text()
+        assert json.dumps(spec, indent=2, sort_keys=True) + "\n" == golden
+
+    def test_crds_left_to_manager(self):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "golden-model"
+        harness.begin()
+        harness.update_config({"crdInstall": "api"})
+
+        spec = harness.charm._build_pod_spec(IMAGE_DETAILS)
+
+        assert "kubernetesResources" not in spec
+        assert spec["containers"][0]["name"] == "audit"
@@ -0,0 +1,189 @@
+import csv
+import gzip
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+from ops.testing import Harness
+from charm import OPAAuditCharm
+import kubeapi
+import violations
+
+
+def constraint(kind, name, total, namespaces=(), action=None):
+    constraint = {
+        "kind": kind,
+        "metadata": {"name": name},
+        "spec": {},
+        "status": {
+            "totalViolations": total,
+            "violations": [{"name": "pod", "namespace": ns} for ns in namespaces],
+        },
+    }
+    if action:
+        constraint["spec"]["enforcementAction"] = action
+    return constraint
+
+
+API = "/apis/constraints.gatekeeper.sh/v1beta1"
+KINDS = {"K8sDenyAll": "k8sdenyall", "K8sRequiredLabels": "k8srequiredlabels"}
+PAGES = {
+    f"{API}/k8srequiredlabels": [
+        constraint("K8sRequiredLabels", "owner", 30, ["a", "b", "a"]),
+        constraint("K8sRequiredLabels", "team", 0),
+    ],
+    f"{API}/k8sdenyall": [
+        constraint("K8sDenyAll", "all", 2, ["b", "", "c"], action="dryrun"),
+    ],
+}
+
+
+def list_page(path, *args, **kwargs):
+    return {"items": PAGES[path]}
+
+
+class TestViolations(unittest.TestCase):
+    @patch("kubeapi.list_page")
+    def test_constraints_follow_continue(self, list_page):
+        list_page.side_effect = [
+            {"items": [1, 2], "metadata": {"continue": "c1"}},
+            {"items": [3], "metadata": {}},
+        ]
+
+        assert list(violations.constraints("/apis/c/v1/k", page_size=2)) == [1, 2, 3]
+        assert [c[0] for c in list_page.call_args_list] == [
+            ("/apis/c/v1/k", 2, None),
+            ("/apis/c/v1/k", 2, "c1"),
+        ]
+
+    @patch("kubeapi.api_resource_kinds", side_effect=kubeapi.ApiException(status=404))
+    def test_no_constraint_kinds(self, api_resources):
+        summary = violations.summarize()
+
+        assert summary["constraints"] == 0
+        assert violations.status_message(summary) == "No violations of 0 constraints"
+
+    @patch("kubeapi.list_page", side_effect=list_page)
+    @patch("kubeapi.api_resource_kinds", return_value=KINDS)
+    def test_summarize(self, api_resource_kinds, list_page):
+        summary = violations.summarize(top_constraints=1, top_namespaces=2)
+
+        assert summary["totalViolations"] == 32
+        assert summary["constraints"] == 3
+        assert summary["enforcementActions"] == {"deny": 30, "dryrun": 2}
+        assert summary["violatedConstraints"] == 2
+        assert summary["topConstraints"] == [
+            {
+                "kind": "K8sRequiredLabels",
+                "name": "owner",
+                "enforcementAction": "deny",
+                "violations": 30,
+            }
+        ]
+        assert summary["topNamespaces"] == [
+            {"namespace": "a", "violations": 2},
+            {"namespace": "b", "violations": 2},
+        ]
+        assert violations.status_message(summary) == (
+            "32 violations of 2/3 constraints (deny: 30, dryrun: 2), most in a (2)"
+        )
+
+
+@patch("kubeapi.list_page", side_effect=list_page)
+@patch("kubeapi.api_resource_kinds", return_value=KINDS)
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "violations.gz")
+
+    def test_jsonl(self, api_resource_kinds, list_page):
+        counts = violations.export(self.path, page_size=2)
+
+        with gzip.open(self.path, "rt") as fh:
+            rows = [json.loads(line) for line in fh]
+        assert [(r["constraint"], r["namespace"]) for r in rows] == [
+            ("all", "b"),
+            ("all", ""),
+            ("all", "c"),
+            ("owner", "a"),
+            ("owner", "b"),
+            ("owner", "a"),
+        ]
+        assert rows[0]["enforcementAction"] == "dryrun"
+        assert counts == {"constraints": 3, "violations": 6, "unrecorded": 27}
+        assert not os.path.exists(self.path + ".part")
+        assert list_page.call_args_list[0][0] == (f"{API}/k8sdenyall", 2, None)
+
+    def test_csv_filters(self, api_resource_kinds, list_page):
+        counts = violations.export(
+            self.path,
+            "csv",
+            kinds="K8sRequiredLabels, K8sMissing",
+            namespaces="a,c",
+            actions="deny",
+            label_selector="team=platform",
+        )
+
+        with gzip.open(self.path, "rt", newline="") as fh:
+            rows = list(csv.DictReader(fh))
+        assert [(r["constraintKind"], r["namespace"]) for r in rows] == [
+            ("K8sRequiredLabels", "a"),
+            ("K8sRequiredLabels", "a"),
+        ]
+        assert counts["violations"] == 2
+        # only the matching kind is listed, with the selector
+        [call] = list_page.call_args_list
+        assert call[0][0] == f"{API}/k8srequiredlabels"
+        assert call[1] == {"label_selector": "team=platform"}
+
+    def test_failed_export_leaves_no_file(self, api_resource_kinds, list_page):
+        list_page.side_effect = kubeapi.ApiException(status=500)
+
+        with self.assertRaises(kubeapi.ApiException):
+            violations.export(self.path)
+        assert not os.path.exists(self.path + ".part")
+        assert not os.path.exists(self.path)
+
+        with self.assertRaises(violations.ExportError):
+            violations.export(self.path, "xml")
+
+
+class TestExportAction(unittest.TestCase):
+    @patch("violations.export")
+    def test_action(self, export):
+        harness = Harness(OPAAuditCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        harness.update_config({"violationsPageSize": 50})
+        export.return_value = {"constraints": 3, "violations": 6, "unrecorded": 0}
+        params = {
+            "path": "",
+            "format": "csv",
+            "kinds": "",
+            "namespaces": "a",
+            "enforcement-actions": "",
+            "selector": "",
+            "page-size": 0,
+        }
+        event = Mock(params=params)
+
+        with patch("os.path.getsize", return_value=120):
+            harness.charm._on_export_violations_action(event)
+
+        export.assert_called_once_with(
+            "/tmp/violations.csv.gz",
+            "csv",
+            page_size=50,
+            kinds="",
+            namespaces="a",
+            actions="",
+            label_selector=None,
+        )
+        results = event.set_results.call_args[0][0]
+        assert results["violations"] == 6 and results["bytes"] == 120
+
+        export.side_effect = OSError("Permission denied")
+        harness.charm._on_export_violations_action(event)
+        event.fail.assert_called_once_with("/tmp/violations.csv.gz: Permission denied")
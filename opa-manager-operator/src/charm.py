@@ -1,37 +1,41 @@
 #!/usr/bin/env python3
 import os
+import sys
+import json
+import time
+import hashlib
 import logging
 import yaml
-import utils
+import manifests
+import metrics
+import podspec
+import scaling
+import sync
+import webhook
+import tracing
 from pathlib import Path
 from ops.charm import CharmBase
 from ops.main import main
 from ops.framework import StoredState
-from ops.model import ActiveStatus, MaintenanceStatus
+from ops.model import ActiveStatus, BlockedStatus, MaintenanceStatus
 from oci_image import OCIImageResource, OCIImageResourceError
 
-from charmhelpers.core.hookenv import (
-    log,
-)
-from jinja2 import Template
+# utils (and with it the kubernetes client), charmhelpers and jinja2 are
+# imported by the methods that use them: every hook runs in a new process
+# and most hooks never talk to the Kubernetes API.
 
 
 logger = logging.getLogger(__name__)
 
+CRD_FILES = [
+    "files/configs.config.gatekeeper.sh.yaml",
+    "files/constrainttemplates.templates.gatekeeper.sh.yaml",
+    "files/constraintpodstatuses.status.gatekeeper.sh.yaml",
+    "files/constrainttemplatepodstatuses.status.gatekeeper.sh.yaml",
+]
 
-class CustomResourceDefintion(object):
-    def __init__(self, name, spec):
-
-        self._name = name
-        self._spec = spec
-
-    @property
-    def spec(self):
-        return self._spec
-
-    @property
-    def name(self):
-        return self._name
+# Peer relation on which the leader publishes what it applied to the cluster
+PEER_RELATION = "cluster"
 
 
 class OPAManagerCharm(CharmBase):
@@ -43,114 +47,822 @@ class OPAManagerCharm(CharmBase):
 
     def __init__(self, *args):
         super().__init__(*args)
+        tracing.tracer.start(
+            self._hook_name(),
+            trace_allocations=self.model.config["traceAllocations"],
+        )
         self.framework.observe(self.on.config_changed, self._on_config_changed)
+        self.framework.observe(self.on.leader_elected, self._on_leader_elected)
         self.framework.observe(self.on.stop, self._on_stop)
+        self.framework.observe(self.on.remove, self._on_remove)
+        self.framework.observe(
+            self.on[PEER_RELATION].relation_broken, self._on_cluster_relation_broken
+        )
         self.framework.observe(self.on.install, self._on_install)
         self.framework.observe(self.on.start, self._on_start)
-        self._stored.set_default(things=[])
+        self.framework.observe(self.on.upgrade_charm, self._on_start)
+        self.framework.observe(self.on.update_status, self._on_update_status)
+        self.framework.observe(
+            self.on.estimate_sync_memory_action, self._on_estimate_sync_memory_action
+        )
+        self.framework.observe(
+            self.on.load_policies_action, self._on_load_policies_action
+        )
+        self.framework.observe(
+            self.on.metrics_endpoint_relation_joined, self._on_metrics_endpoint_joined
+        )
+        self.framework.observe(self.framework.on.commit, self._on_commit)
+        self._stored.set_default(
+            things=[],
+            spec_fingerprint=None,
+            spec_hash=None,
+            spec_cache_hits=0,
+            spec_cache_misses=0,
+            constraint_index={},
+            constraint_resources=None,
+            sync_warning=None,
+            policy_bundle="",
+            watched={},
+            crd_version=None,
+            sync_resources=None,
+            teardown_pending=False,
+        )
         self.image = OCIImageResource(self, "gatekeeper-image")
 
     def _on_config_changed(self, _):
         """
-        Set a new Juju pod specification
+        Set a new Juju pod specification, re-apply the cluster objects when
+        syncResources changed since they were applied and load a newly
+        configured policy bundle
         """
         self._configure_pod()
+        applied = self._stored.sync_resources
+        # until start applies them, there is nothing to re-apply
+        if (
+            self.unit.is_leader()
+            and applied is not None
+            and applied != self.model.config["syncResources"]
+        ):
+            self._apply_cluster_objects()
+        self._load_configured_bundle()
+
+    def _load_policies(self, location, batch_size=None):
+        """
+        Apply the policies in a bundle; returns the apply results, the
+        number of duplicates skipped and the seconds it took
+        """
+        import policies
+
+        self._configure_k8s_client()
+        started = time.monotonic()
+        with tracing.span("load_policies", bundle=location):
+            with policies.open_bundle(location) as stream:
+                results, duplicates = policies.load_bundle(
+                    stream,
+                    os.environ["JUJU_MODEL_NAME"],
+                    batch_size=batch_size or policies.BATCH_SIZE,
+                )
+        seconds = time.monotonic() - started
+        for result in results:
+            logger.info(
+                "%s %s/%s in %.3fs %s",
+                result.status,
+                result.kind,
+                result.name,
+                result.latency,
+                result.error or "",
+            )
+        return results, duplicates, seconds
+
+    def _load_configured_bundle(self):
+        """
+        Load the policyBundle once per value, retrying from update-status
+        until it loads
+        """
+        location = self.model.config["policyBundle"]
+        if (
+            not self.unit.is_leader()
+            or not location
+            or location == self._stored.policy_bundle
+        ):
+            return
+
+        import policies
+        import utils
+
+        try:
+            results, _, _ = self._load_policies(location)
+        except (
+            policies.PolicyBundleError,
+            yaml.YAMLError,
+            OSError,
+            utils.ApiException,
+        ) as e:
+            self.unit.status = BlockedStatus(f"policyBundle: {e}")
+            return
+        failed = [r for r in results if r.error]
+        if failed:
+            self.unit.status = BlockedStatus(
+                f"policyBundle: {len(failed)} of {len(results)} objects failed"
+            )
+            return
+        self._stored.policy_bundle = location
+        # a retry from update-status clears the failure of the last attempt
+        if self.unit.status.message.startswith("policyBundle: "):
+            self.unit.status = self._active_status()
+
+    def _on_load_policies_action(self, event):
+        """
+        Load a policy bundle, reporting the time taken by every object
+        """
+        import policies
+        import utils
+
+        location = event.params.get("bundle") or self.model.config["policyBundle"]
+        if not location:
+            event.fail("No bundle given and policyBundle is not set")
+            return
+
+        try:
+            results, duplicates, seconds = self._load_policies(
+                location, event.params["batch-size"]
+            )
+        except (
+            policies.PolicyBundleError,
+            yaml.YAMLError,
+            OSError,
+            utils.ApiException,
+        ) as e:
+            event.fail(f"{location}: {e}")
+            return
+        statuses = {}
+        for result in results:
+            statuses[result.status] = statuses.get(result.status, 0) + 1
+        event.set_results(
+            {
+                "objects": "\n".join(
+                    f"{r.kind}/{r.name} {r.status} {r.latency:.3f}s"
+                    + (f" {r.error}" if r.error else "")
+                    for r in results
+                ),
+                "statuses": ", ".join(
+                    f"{count} {status}" for status, count in sorted(statuses.items())
+                ),
+                "duplicates": duplicates,
+                "seconds": round(seconds, 3),
+            }
+        )
+        failed = statuses.get("failed", 0)
+        if failed:
+            event.fail(f"{failed} of {len(results)} objects failed")
+
+    def _on_metrics_endpoint_joined(self, _):
+        self._publish_scrape_jobs()
+
+    def _publish_scrape_jobs(self):
+        """
+        Publish scrape jobs for every webhook pod on the metrics-endpoint
+        relations, falling back to the application's service when the pods
+        cannot be listed
+        """
+        relations = self.model.relations["metrics-endpoint"]
+        if not self.unit.is_leader() or not relations:
+            return
+
+        import utils
+
+        namespace = os.environ["JUJU_MODEL_NAME"]
+        self._configure_k8s_client()
+        try:
+            pods = utils.pod_addresses(namespace, podspec.WEBHOOK_POD_LABELS)
+        except utils.ApiException as e:
+            logger.warning("Could not list the webhook pods: %s", e)
+            pods = None
+        jobs = json.dumps(metrics.scrape_jobs(self.app.name, namespace, pods))
+        metadata = json.dumps(
+            metrics.scrape_metadata(
+                self.model.name, self.model.uuid, self.app.name, self.meta.name
+            )
+        )
+        for relation in relations:
+            data = relation.data[self.app]
+            if data.get("scrape_jobs") != jobs:
+                data["scrape_jobs"] = jobs
+            if data.get("scrape_metadata") != metadata:
+                data["scrape_metadata"] = metadata
+
+    def _hook_name(self):
+        action = os.environ.get("JUJU_ACTION_NAME")
+        if action:
+            return f"{action}-action"
+        return os.environ.get("JUJU_HOOK_NAME") or os.path.basename(
+            os.environ.get("JUJU_DISPATCH_PATH", "unknown")
+        )
+
+    def _on_commit(self, _):
+        """
+        Emit the hook's trace and export its metrics
+        """
+        root = tracing.tracer.finish()
+        self._emit_trace()
+        self._export_hook_metrics(root.duration)
+
+    def _emit_trace(self):
+        """
+        Log the hook's spans as one JSON line, and append them to the OTLP
+        file when one is configured
+        """
+        trace = tracing.tracer.to_dict(application=self.app.name, unit=self.unit.name)
+        logger.info("Hook trace: %s", json.dumps(trace, separators=(",", ":")))
+        path = self.model.config["traceOTLPFile"]
+        if not path:
+            return
+
+        try:
+            tracing.append_json_line(
+                path,
+                tracing.tracer.otlp(
+                    self.app.name,
+                    **{"juju.model": self.model.name, "juju.unit": self.unit.name},
+                ),
+            )
+        except OSError as e:
+            logger.warning("Could not export the hook trace: %s", e)
+
+    def _export_hook_metrics(self, seconds):
+        """
+        Export how long the hook took, and the Kubernetes API calls it made,
+        for the textfile collector and/or a Pushgateway
+        """
+        directory = self.model.config["metricsTextfileDirectory"]
+        url = self.model.config["metricsPushgatewayURL"]
+        if not directory and not url:
+            return
+
+        hook = self._hook_name()
+        # the API stats only exist when the hook loaded utils
+        utils = sys.modules.get("utils")
+        text = metrics.hook_metrics(
+            {"application": self.app.name, "unit": self.unit.name, "hook": hook},
+            seconds,
+            time.time(),
+            utils.api_stats if utils else None,
+        )
+        try:
+            if directory:
+                metrics.write_textfile(
+                    directory, metrics.textfile_name(self.unit.name, hook), text
+                )
+            if url:
+                metrics.push(
+                    url,
+                    [("job", metrics.PREFIX), ("unit", self.unit.name), ("hook", hook)],
+                    text,
+                )
+        except OSError as e:
+            logger.warning("Could not export the hook metrics: %s", e)
 
     def _on_stop(self, _):
         """
-        Mark unit is inactive
+        Mark unit is inactive, and retry deleting what the teardown left
+        behind
         """
         self.unit.status = MaintenanceStatus("Pod is terminating.")
         logger.info("Pod is terminating.")
+        self._teardown()
+
+    def _on_remove(self, _):
+        """
+        Retry deleting what the teardown left behind
+        """
+        self._teardown()
+
+    def _on_cluster_relation_broken(self, _):
+        """
+        Delete the objects the charm manages when the application is removed
+        """
+        # the peer relation is only broken with the application, scaling to
+        # 0 units leaves it, and the policies in the CRDs, alone
+        if not self.unit.is_leader() or self.app.planned_units() > 0:
+            return
+        self._stored.teardown_pending = True
+        self._teardown()
+
+    def _teardown(self):
+        """
+        Delete the objects the charm manages once the application is being
+        removed, reporting those left behind
+        """
+        if not self.unit.is_leader() or not self._stored.teardown_pending:
+            return
+
+        import utils
+
+        self._configure_k8s_client()
+        groups = self._teardown_objects()
+        results = utils.delete_k8s_objects(
+            groups, deadline=self.model.config["teardownTimeout"]
+        )
+        k8s_objects = [o for group in groups for o in group]
+        self._stored.things = utils.drop_from_ledger(
+            self._stored.things,
+            [o for o, r in zip(k8s_objects, results) if not r.error],
+        )
+        for result in results:
+            logger.info(
+                "%s %s/%s in %.3fs %s",
+                result.status,
+                result.kind,
+                result.name,
+                result.latency,
+                result.error or "",
+            )
+        left = [r for r in results if r.status in ("failed", "skipped")]
+        self._stored.teardown_pending = bool(left)
+        if left:
+            message = "Left behind: " + ", ".join(f"{r.kind}/{r.name}" for r in left)
+            logger.warning(message)
+            self.unit.status = BlockedStatus(message)
+
+    def _teardown_objects(self):
+        """
+        The objects the charm manages, in the groups they are deleted in: the
+        validating webhook configuration first, so that admission requests
+        stop waiting on the webhook at once, then the namespaced objects, the
+        PSP and, if the charm installed them, the CRDs
+        """
+        namespace = os.environ["JUJU_MODEL_NAME"]
+        config = manifests.parse_yaml(
+            self._render_jinja_template(
+                "files/sync.yaml.jinja2", {"namespace": namespace, "sync_only": []}
+            )
+        )
+        groups = [
+            [webhook.configuration_reference(namespace)],
+            [config] + scaling.references(self.app.name, namespace),
+            self._load_yaml_objects(["files/psp.yaml"]),
+        ]
+        if self.model.config["crdInstall"] == "api":
+            groups.append(self._load_yaml_objects(CRD_FILES))
+        return groups
 
     def _load_yaml_objects(self, files_list):
         yaml_objects = []
-        try:
-            yaml_objects = [yaml.load(Path(f).read_text(), yaml.Loader) for f in files_list]
-        except yaml.YAMLError as exc:
-            print("Error in configuration file:", exc)
+        with tracing.span("load_yaml_objects", files=len(files_list)):
+            try:
+                yaml_objects = [manifests.load_yaml(f) for f in files_list]
+            except yaml.YAMLError as exc:
+                print("Error in configuration file:", exc)
 
         return yaml_objects
 
     def _on_install(self, event):
         logger.info("Congratulations, the charm was properly installed!")
 
-    def _build_pod_spec(self):
+    def _build_pod_spec(self, image_details, webhook_rules=None):
         """
         Construct a Juju pod specification for OPA
         """
         logger.debug("Building Pod Spec")
 
-        # Load Custom Resource Definitions
-        crd_objects = [
-            CustomResourceDefintion(crd["metadata"]["name"], yaml.dump(crd["spec"]))
-            for crd in self._load_yaml_objects(
-                [
-                    "files/configs.config.gatekeeper.sh.yaml",
-                    "files/constrainttemplates.templates.gatekeeper.sh.yaml",
-                    "files/constraintpodstatuses.status.gatekeeper.sh.yaml",
-                    "files/constrainttemplatepodstatuses.status.gatekeeper.sh.yaml",
-                ]
+        settings = webhook.settings_from_config(self.model.config)
+        if webhook_rules is None:
+            webhook_rules = self._webhook_rules(settings)
+        crds = []
+        if podspec.crds_in_pod_spec(self.model.config["crdInstall"]):
+            crds = self._load_yaml_objects(CRD_FILES)
+        return podspec.manager_pod_spec(
+            crds,
+            image_details,
+            self.model.config["imagePullPolicy"],
+            self._cli_args(),
+            os.environ["JUJU_MODEL_NAME"],
+            webhook.pod_spec_options(settings, webhook_rules),
+        )
+
+    def _webhook_rules(self, settings):
+        """
+        Resolve the validation webhook rules, asking the API server for its
+        groups and resources only when exclusions need them
+        """
+        if (
+            self.model.config["webhookMatchConstraints"]
+            and self._stored.constraint_resources is not None
+        ):
+            settings = webhook.match_resources(
+                settings, self._stored.constraint_resources
             )
-        ]
+        if not webhook.needs_discovery(settings):
+            return webhook.webhook_rules(settings)
 
-        config = self.model.config
+        import utils
 
-        try:
-            image_details = self.image.fetch()
-        except OCIImageResourceError as e:
-            self.model.unit.status = e.status
-            return
-        template_args = {
-            "crds": crd_objects,
+        self._configure_k8s_client()
+        versions = utils.api_groups()
+        return webhook.webhook_rules(
+            settings,
+            sorted(versions),
+            lambda group: utils.api_resources(versions[group]),
+        )
+
+    def _spec_fingerprint(self, image_details, webhook_rules):
+        """
+        Hash every input the pod specification is built from
+        """
+        digest = hashlib.sha256()
+        for f in [podspec.__file__, webhook.__file__] + CRD_FILES:
+            digest.update(hashlib.sha256(Path(f).read_bytes()).digest())
+        inputs = {
+            "config": dict(self.model.config),
             "image_details": image_details,
-            "imagePullPolicy": config["imagePullPolicy"],
             "app_name": self.app.name,
             "cli_args": self._cli_args(),
             "namespace": os.environ["JUJU_MODEL_NAME"],
+            "webhook_rules": webhook_rules,
         }
-
-        template = self._render_jinja_template(
-            "files/pod-spec.yaml.jinja2", template_args
-        )
-
-        spec = yaml.load(template, yaml.Loader)
-        return spec
+        digest.update(json.dumps(inputs, sort_keys=True).encode())
+        return digest.hexdigest()
 
     def _cli_args(self):
         """
         Construct command line arguments for OPA
         """
 
+        model_namespace = os.environ["JUJU_MODEL_NAME"]
+        exempt_namespaces = webhook.parse_namespaces(
+            self.model.config["exemptNamespaces"], "exemptNamespaces"
+        )
         args = [
             "--logtostderr",
             "--port=8443",
-            f"--exempt-namespace={os.environ['JUJU_MODEL_NAME']}",
-            "--operation=webhook",
+            f"--exempt-namespace={model_namespace}",
         ]
+        args += [
+            f"--exempt-namespace={namespace}"
+            for namespace in exempt_namespaces
+            if namespace != model_namespace
+        ]
+        args.append("--operation=webhook")
         return args
 
     def _render_jinja_template(self, template, ctx):
-        spec_template = {}
-        with open(template) as fh:
-            spec_template = Template(fh.read())
+        with tracing.span("render_jinja_template", template=template):
+            from jinja2 import Template
+
+            spec_template = {}
+            with open(template) as fh:
+                spec_template = Template(fh.read())
 
-        return spec_template.render(**ctx)
+            return spec_template.render(**ctx)
 
     def _on_start(self, event):
+        """
+        Apply the cluster objects on the leader; other units only check what
+        the leader published
+        """
+        import utils
+
+        if self.unit.is_leader():
+            self._apply_cluster_objects()
+            return
+
+        fingerprint = utils.manifests_fingerprint(self._cluster_objects()[0])
+        if fingerprint == self._published("fingerprint"):
+            logger.info("Cluster objects applied by the leader (%s)", fingerprint)
+        else:
+            logger.info("Leaving the cluster objects to the leader")
+
+    def _on_leader_elected(self, event):
+        """
+        Take over from the previous leader: set the pod spec, and apply the
+        cluster objects only if it did not apply the current ones
+        """
+        import utils
+
+        self._on_config_changed(event)
+        published = self._published("ledger")
+        if published:
+            self._stored.things = utils.merge_ledgers(
+                self._stored.things, json.loads(published)
+            )
+        elif self._stored.sync_resources is None:
+            # on a fresh deploy the Config CRD may only exist once Juju
+            # commits the pod spec set above, so start applies them
+            logger.info("Leaving the cluster objects to start")
+            return
+        fingerprint = utils.manifests_fingerprint(self._cluster_objects()[0])
+        if fingerprint == self._published("fingerprint"):
+            logger.info("Cluster objects are current (%s)", fingerprint)
+            return
+        self._apply_cluster_objects()
+
+    def _published(self, key):
+        """
+        What the leader published on the peer relation under key, if anything
+        """
+        relation = self.model.get_relation(PEER_RELATION)
+        if relation is None:
+            return None
+        return relation.data[self.app].get(key)
+
+    def _apply_cluster_objects(self):
+        """
+        Apply the PSP, gatekeeper Config and webhook scaling objects, and
+        publish their fingerprint and the ledger for the other units and the
+        next leader
+        """
+        from charmhelpers.core.hookenv import log
+        import utils
+
+        self._configure_k8s_client()
+        k8s_objects, sync_only = self._cluster_objects()
+        log(f"K8s objects: {k8s_objects}")
+        fingerprint = utils.manifests_fingerprint(k8s_objects)
+        if sync_only is not None:
+            self._check_sync_budget(sync_only)
+        scaling_objects, removed = self._scaling_objects()
+        self._apply_objects(k8s_objects + scaling_objects, removed)
+        self._stored.sync_resources = self.model.config["syncResources"]
+
+        relation = self.model.get_relation(PEER_RELATION)
+        if relation is not None:
+            relation.data[self.app]["fingerprint"] = fingerprint
+            relation.data[self.app]["ledger"] = json.dumps(
+                [dict(entry) for entry in self._stored.things],
+                sort_keys=True,
+                separators=(",", ":"),
+            )
+
+    def _cluster_objects(self):
+        """
+        The PSP and, unless syncResources is invalid, the gatekeeper Config,
+        with the kinds it syncs
+        """
         k8s_objects = self._load_yaml_objects(["files/psp.yaml"])
+        try:
+            sync_only = sync.parse_sync_resources(self.model.config["syncResources"])
+        except sync.SyncConfigError as e:
+            logger.warning("Not updating the gatekeeper Config: %s", e)
+            return k8s_objects, None
         k8s_objects.append(
-            yaml.load(
+            manifests.parse_yaml(
                 self._render_jinja_template(
                     "files/sync.yaml.jinja2",
-                    {"namespace": os.environ["JUJU_MODEL_NAME"]},
+                    {
+                        "namespace": os.environ["JUJU_MODEL_NAME"],
+                        "sync_only": sync_only,
+                    },
+                )
+            )
+        )
+        return k8s_objects, sync_only
+
+    def _reconcile_drift(self):
+        """
+        Re-apply the PSP, gatekeeper Config and, when the charm installs them,
+        the CRDs if they were changed or deleted since they were applied,
+        watching their collections for the changes since the last
+        update-status rather than reading each object
+        """
+        import utils
+
+        k8s_objects = self._cluster_objects()[0]
+        # CRDs in the pod spec are Juju's, applying them would fight it
+        if not podspec.crds_in_pod_spec(self.model.config["crdInstall"]):
+            k8s_objects = self._crd_objects() + k8s_objects
+        try:
+            with tracing.span("detect_drift", objects=len(k8s_objects)):
+                drifted, watched = utils.detect_drift(
+                    k8s_objects, self._stored.things, dict(self._stored.watched)
+                )
+            self._stored.watched = watched
+            if not drifted:
+                return
+
+            logger.info(
+                "Re-applying drifted objects: %s",
+                ", ".join(
+                    f"{utils.object_kind(o)}/{utils.object_name(o)}" for o in drifted
                 ),
-                yaml.Loader
             )
+            self._apply_objects(drifted, changed=True)
+        except utils.ApiException as e:
+            logger.warning("Could not repair the drifted objects: %s", e)
+
+    def _crd_objects(self):
+        """
+        The CRDs, labelled with their version when the charm installs them
+        """
+        crds = self._load_yaml_objects(CRD_FILES)
+        if podspec.crds_in_pod_spec(self.model.config["crdInstall"]):
+            return crds
+        import utils
+
+        return utils.versioned_crds(crds, utils.crd_bundle_version(CRD_FILES))
+
+    def _install_crds(self):
+        """
+        Install or upgrade the CRDs through the Kubernetes API, only when
+        the CRD files changed since they were last installed
+        """
+        import utils
+
+        version = utils.crd_bundle_version(CRD_FILES)
+        if version == self._stored.crd_version:
+            return
+
+        self._configure_k8s_client()
+        installed = utils.installed_crd_versions()
+        if list(installed.values()).count(version) < len(CRD_FILES):
+            logger.info("Installing the CRDs, version %s", version)
+            with tracing.span("install_crds", version=version):
+                self._apply_objects(self._crd_objects())
+        self._stored.crd_version = version
+
+    def _apply_objects(self, k8s_objects, removed=(), changed=False):
+        """
+        Converge k8s_objects and delete removed ones, skipping objects the
+        ledger shows are unchanged unless they are known to have changed
+        """
+        import utils
+
+        namespace = os.environ["JUJU_MODEL_NAME"]
+        if not changed:
+            k8s_objects = utils.changed_objects(k8s_objects, self._stored.things)
+        results = utils.apply_k8s_objects(namespace, k8s_objects, action="apply")
+        ledger = utils.update_ledger(self._stored.things, k8s_objects, results)
+        removed = [o for o in removed if utils.in_ledger(ledger, o)]
+        if removed:
+            deleted = utils.apply_k8s_objects(namespace, removed, action="delete")
+            ledger = utils.drop_from_ledger(
+                ledger, [o for o, r in zip(removed, deleted) if not r.error]
+            )
+            results += deleted
+        self._stored.things = ledger
+        for result in results:
+            logger.info(
+                "%s %s/%s in %.3fs %s",
+                result.status,
+                result.kind,
+                result.name,
+                result.latency,
+                result.error or "",
+            )
+        logger.info("Kubernetes API: %s", utils.api_stats.summary())
+        errors = [result.error for result in results if result.error]
+        if errors:
+            raise errors[0]
+
+    def _estimate_sync_memory(self, sync_only, page_size=sync.PAGE_SIZE):
+        """
+        Estimate the memory OPA needs to cache the synced objects, and the
+        status warning when it is over budget
+        """
+        estimate = sync.estimate(sync_only, page_size)
+        warning = sync.budget_warning(
+            estimate["estimated_bytes"], self.model.config["webhookMemoryLimit"]
+        )
+        return estimate, warning
+
+    def _check_sync_budget(self, sync_only):
+        """
+        Warn in the unit status, before the Config is applied, when the synced
+        objects will not fit in the webhook's memory limit
+        """
+        import utils
+
+        try:
+            estimate, warning = self._estimate_sync_memory(sync_only)
+        except (utils.ApiException, scaling.ScalingConfigError) as e:
+            logger.warning("Could not estimate the sync cache size: %s", e)
+            return
+        logger.info(
+            "Synced objects: ~%s in OPA",
+            sync.human_bytes(estimate["estimated_bytes"]),
+        )
+        self._stored.sync_warning = warning
+        if warning:
+            logger.warning(warning)
+            self.unit.status = ActiveStatus(warning)
+
+    def _on_estimate_sync_memory_action(self, event):
+        """
+        Count the objects of each synced kind and estimate their memory
+        """
+        try:
+            sync_only = sync.parse_sync_resources(self.model.config["syncResources"])
+        except sync.SyncConfigError as e:
+            event.fail(str(e))
+            return
+
+        self._configure_k8s_client()
+        estimate, warning = self._estimate_sync_memory(
+            sync_only, event.params["page-size"]
+        )
+        results = {}
+        for entry in estimate["kinds"]:
+            key = "-".join(
+                part.lower().replace(".", "-")
+                for part in [entry["group"], entry["version"], entry["kind"]]
+                if part
+            )
+            results[key] = (
+                f"{entry['count']} objects, ~{entry['average_bytes']}B each, "
+                f"~{sync.human_bytes(entry['estimated_bytes'])} in OPA "
+                f"({entry['list_calls']} list calls)"
+            )
+        results["estimated-memory"] = sync.human_bytes(estimate["estimated_bytes"])
+        results["memory-limit"] = self.model.config["webhookMemoryLimit"] or "none"
+        results["over-budget"] = bool(warning)
+        event.set_results(results)
+
+    def _scaling_objects(self):
+        """
+        Objects setting the webhook's replicas, placement, resources,
+        disruption budget and autoscaler, and the disabled ones to remove
+        """
+        import utils
+
+        try:
+            settings = scaling.settings_from_config(self.model.config)
+        except scaling.ScalingConfigError as e:
+            logger.warning("Not scaling the webhook: %s", e)
+            return [], []
+
+        namespace = os.environ["JUJU_MODEL_NAME"]
+        app_name = self.app.name
+        k8s_objects = []
+        deployment = scaling.deployment_patch(app_name, namespace, settings)
+        if deployment and utils.get_live_object(deployment) is None:
+            # Juju creates the Deployment once the pod spec is set
+            logger.info("Deployment %s not created yet", app_name)
+            deployment = None
+        if deployment:
+            k8s_objects.append(deployment)
+        budget_and_autoscaler, removed = scaling.budget_and_autoscaler(
+            app_name, namespace, settings
+        )
+        k8s_objects += budget_and_autoscaler
+        return k8s_objects, removed
+
+    def _on_update_status(self, _):
+        """
+        Re-converge the webhook scaling objects, which Juju overwrites when it
+        updates the Deployment, narrow the validation webhook to the kinds
+        installed constraints match, keep the scrape targets up to date,
+        repair drifted objects and retry loading the policy bundle
+        """
+        if not self.unit.is_leader():
+            return
+
+        import utils
+
+        self._configure_k8s_client()
+        try:
+            scaling_objects, removed = self._scaling_objects()
+            self._apply_objects(scaling_objects, removed)
+        except utils.ApiException as e:
+            logger.warning("Could not converge the webhook scaling objects: %s", e)
+        self._reconcile_drift()
+        if self.model.config["webhookMatchConstraints"]:
+            try:
+                self._refresh_constraint_index()
+            except utils.ApiException as e:
+                logger.warning("Could not refresh the constraint index: %s", e)
+        # webhook pods come and go as the Deployment scales or rolls
+        self._publish_scrape_jobs()
+        self._load_configured_bundle()
+        # the unit count changes without a config-changed
+        if self.unit.status.name == "active":
+            self.unit.status = self._active_status()
+
+    def _refresh_constraint_index(self):
+        """
+        Narrow the validation webhook to the kinds installed constraints match
+        """
+        import constraints
+
+        index, changes = constraints.refresh_index(self._stored.constraint_index)
+        if not changes and self._stored.constraint_resources is not None:
+            return
+        resources = constraints.resolve_resources(constraints.indexed_kinds(index))
+        logger.info("%d constraints match %d resources", len(index), len(resources))
+        self._stored.constraint_index = index
+        self._stored.constraint_resources = sorted(list(r) for r in resources)
+        self._configure_pod()
+
+    def _configure_k8s_client(self):
+        """
+        Apply the API client settings from the charm config
+        """
+        import utils
+
+        config = self.model.config
+        utils.configure_client(
+            pool_maxsize=config["apiConnectionPoolSize"],
+            qps=config["apiQPS"],
+            burst=config["apiBurst"],
         )
-        log(f"K8s objects: {k8s_objects}")
-        for k8s_object in k8s_objects:
-            utils.create_k8s_object(os.environ["JUJU_MODEL_NAME"], k8s_object)
 
     def _configure_pod(self):
         """
@@ -163,10 +875,73 @@ class OPAManagerCharm(CharmBase):
             return
 
         self.unit.status = MaintenanceStatus("Setting pod spec.")
-        pod_spec = self._build_pod_spec()
+        try:
+            with tracing.span("image_fetch"):
+                image_details = self.image.fetch()
+        except OCIImageResourceError as e:
+            self.model.unit.status = e.status
+            return
+
+        try:
+            webhook_rules = self._webhook_rules(
+                webhook.settings_from_config(self.model.config)
+            )
+            scaling.settings_from_config(self.model.config)
+            sync.parse_sync_resources(self.model.config["syncResources"])
+            crds_in_pod_spec = podspec.crds_in_pod_spec(self.model.config["crdInstall"])
+        except (
+            webhook.WebhookConfigError,
+            scaling.ScalingConfigError,
+            sync.SyncConfigError,
+            podspec.PodSpecConfigError,
+        ) as e:
+            self.unit.status = BlockedStatus(str(e))
+            return
 
-        self.model.pod.set_spec(pod_spec)
-        self.unit.status = ActiveStatus()
+        if not crds_in_pod_spec:
+            import utils
+
+            # before the pod spec stops holding them
+            try:
+                self._install_crds()
+            except (utils.ApiException, TimeoutError) as e:
+                self.unit.status = BlockedStatus(f"crdInstall: {e}")
+                return
+
+        fingerprint = self._spec_fingerprint(image_details, webhook_rules)
+        if fingerprint == self._stored.spec_fingerprint:
+            self._stored.spec_cache_hits += 1
+        else:
+            self._stored.spec_cache_misses += 1
+            with tracing.span("build_pod_spec"):
+                pod_spec = self._build_pod_spec(image_details, webhook_rules)
+            spec_hash = hashlib.sha256(
+                json.dumps(pod_spec, sort_keys=True).encode()
+            ).hexdigest()
+            if spec_hash != self._stored.spec_hash:
+                with tracing.span("set_spec"):
+                    self.model.pod.set_spec(pod_spec)
+                self._stored.spec_hash = spec_hash
+            self._stored.spec_fingerprint = fingerprint
+        logger.debug(
+            "Pod spec cache: %d hits, %d misses",
+            self._stored.spec_cache_hits,
+            self._stored.spec_cache_misses,
+        )
+        self.unit.status = self._active_status()
+
+    def _active_status(self):
+        """
+        Active status carrying the sync budget or replica count warning
+        """
+        try:
+            settings = scaling.settings_from_config(self.model.config)
+        except scaling.ScalingConfigError:
+            settings = None
+        warning = settings and scaling.replicas_warning(
+            self.app.name, settings, self.app.planned_units()
+        )
+        return ActiveStatus(self._stored.sync_warning or warning or "")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,122 @@
+"""Index of the kinds installed gatekeeper constraints match.
+
+Every ConstraintTemplate defines a constraint kind, served as a collection
+named after the template under constraints.gatekeeper.sh. The index maps each
+constraint to its resourceVersion and the (apiGroup, kind) pairs of its
+spec.match.kinds, and is refreshed incrementally: collections are listed for
+metadata only, and only collections holding a constraint whose
+resourceVersion changed are listed again in full.
+
+The index is a plain dict so that it can be kept in the charm's StoredState.
+"""
+
+import logging
+
+import utils
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_COLLECTION = "/apis/templates.gatekeeper.sh/v1beta1/constrainttemplates"
+CONSTRAINTS_API = "/apis/constraints.gatekeeper.sh/v1beta1"
+
+
+def match_kinds(constraint):
+    """(apiGroup, kind) pairs a constraint matches, "*" standing for any.
+
+    Constraints without spec.match.kinds, and kinds entries without
+    apiGroups or kinds, match everything in the missing dimension.
+    """
+    kinds = constraint.get("spec", {}).get("match", {}).get("kinds")
+    if not kinds:
+        return [["*", "*"]]
+    pairs = set()
+    for entry in kinds:
+        for group in entry.get("apiGroups") or ["*"]:
+            for kind in entry.get("kinds") or ["*"]:
+                pairs.add((group, kind))
+    return [list(pair) for pair in sorted(pairs)]
+
+
+def refresh_index(index):
+    """Bring an index up to date with the cluster.
+
+    Collections in which any constraint changed are listed in full, once.
+    Returns the new index and the number of constraints fetched or dropped;
+    when both are zero the index is returned unchanged.
+    """
+    updated = {}
+    fetched = 0
+    templates = utils.list_resource_versions(TEMPLATES_COLLECTION, "0")
+    for template in sorted(templates):
+        collection = f"{CONSTRAINTS_API}/{template}"
+        versions = utils.list_resource_versions(collection, "0")
+        stale = any(
+            index.get(f"{template}/{name}", {}).get("resourceVersion") != version
+            for name, version in versions.items()
+        )
+        if stale:
+            for constraint in utils.list_objects(collection, "0"):
+                metadata = constraint["metadata"]
+                updated[f"{template}/{metadata['name']}"] = {
+                    "resourceVersion": metadata.get("resourceVersion"),
+                    "kinds": match_kinds(constraint),
+                }
+                fetched += 1
+            continue
+        for name in versions:
+            entry = index[f"{template}/{name}"]
+            updated[f"{template}/{name}"] = {
+                "resourceVersion": entry["resourceVersion"],
+                "kinds": [list(pair) for pair in entry["kinds"]],
+            }
+    dropped = len(set(index) - set(updated))
+    logger.debug(
+        "Constraint index: %d constraints, %d fetched, %d dropped",
+        len(updated),
+        fetched,
+        dropped,
+    )
+    if not fetched and not dropped:
+        return index, 0
+    return updated, fetched + dropped
+
+
+def indexed_kinds(index):
+    """Every (apiGroup, kind) pair matched by an indexed constraint."""
+    return {tuple(pair) for entry in index.values() for pair in entry["kinds"]}
+
+
+def resolve_resources(kinds, api_groups=None, api_resource_kinds=None):
+    """Map (apiGroup, kind) pairs to the (apiGroup, resource) pairs admission
+    rules are written in.
+
+    Kinds are looked up with discovery; when a group or kind is not served
+    (yet), the whole group is kept so that nothing a constraint matches is
+    left out. Discovery defaults to utils.api_groups and
+    utils.api_resource_kinds and is done at most once per group.
+    """
+    if ("*", "*") in kinds:
+        return {("*", "*")}
+    api_groups = api_groups or utils.api_groups
+    api_resource_kinds = api_resource_kinds or utils.api_resource_kinds
+    versions = api_groups()
+    discovered = {}
+
+    resources = set()
+    for group, kind in sorted(kinds):
+        found = False
+        for name in sorted(versions) if group == "*" else [group]:
+            if kind == "*" or name not in versions:
+                resources.add((name, "*"))
+                found = True
+                continue
+            if name not in discovered:
+                discovered[name] = api_resource_kinds(versions[name])
+            resource = discovered[name].get(kind)
+            if resource:
+                resources.add((name, resource))
+                found = True
+        if not found:
+            # a kind nothing serves yet could come from any group
+            resources.add(("*", "*") if group == "*" else (group, "*"))
+    return resources
@@ -0,0 +1,168 @@
+"""Prometheus metrics of the gatekeeper charms.
+
+This module is shared by the manager and audit charms. It builds the scrape
+jobs published on the metrics-endpoint relation (the prometheus_scrape
+interface), and renders the charm's own hook metrics in the Prometheus text
+format, for node-exporter's textfile collector or a Pushgateway.
+
+Every hook runs in a new process, so hook metrics are gauges describing the
+last run of each hook rather than counters.
+"""
+
+import os
+import re
+import tempfile
+import urllib.request
+from urllib.parse import quote
+
+METRICS_PORT = 8888
+METRICS_PATH = "/metrics"
+PREFIX = "gatekeeper_charm"
+PUSH_TIMEOUT = 5.0
+
+LABEL_VALUE_ESCAPES = {"\\": "\\\\", '"': '\\"', "\n": "\\n"}
+
+
+def scrape_jobs(app_name, namespace, pods=None, port=METRICS_PORT):
+    """Scrape jobs for the gatekeeper pods of an application.
+
+    pods maps pod names to their IPs; each pod is then scraped directly, as
+    gatekeeper's counters are per pod. Without pods the application's
+    service is scraped, which is only right for a single pod.
+    """
+    if pods:
+        static_configs = [
+            {"targets": [f"{ip}:{port}"], "labels": {"pod": name}}
+            for name, ip in sorted(pods.items())
+        ]
+    else:
+        static_configs = [{"targets": [f"{app_name}.{namespace}.svc:{port}"]}]
+    return [
+        {
+            "job_name": f"{app_name}-gatekeeper",
+            "metrics_path": METRICS_PATH,
+            "static_configs": static_configs,
+        }
+    ]
+
+
+def scrape_metadata(model, model_uuid, app_name, charm_name):
+    """Topology Prometheus labels the scraped series with."""
+    return {
+        "model": model,
+        "model_uuid": model_uuid,
+        "application": app_name,
+        "charm_name": charm_name,
+    }
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    pairs = []
+    for name, value in sorted(labels.items()):
+        for char, escape in LABEL_VALUE_ESCAPES.items():
+            value = str(value).replace(char, escape)
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+def hook_metrics(labels, seconds, finished, api_stats=None):
+    """Prometheus text exposition of one hook run.
+
+    labels identify the run (application, unit, hook); api_stats is the
+    ApiCallStats of the Kubernetes API calls the hook made, if any.
+    """
+    samples = [
+        (
+            "hook_duration_seconds",
+            "Wall time of the last run of the hook.",
+            {},
+            seconds,
+        ),
+        (
+            "hook_last_run_timestamp_seconds",
+            "When the last run of the hook finished.",
+            {},
+            finished,
+        ),
+    ]
+    if api_stats is not None:
+        for method, stats in sorted(api_stats.snapshot().items()):
+            method_labels = {"method": method}
+            samples += [
+                (
+                    "hook_api_calls",
+                    "Kubernetes API calls made by the last run of the hook.",
+                    method_labels,
+                    stats["calls"],
+                ),
+                (
+                    "hook_api_errors",
+                    "Kubernetes API calls that failed in the last run of the hook.",
+                    method_labels,
+                    stats["errors"],
+                ),
+                (
+                    "hook_api_seconds",
+                    "Time spent in Kubernetes API calls by the last run of the hook.",
+                    method_labels,
+                    stats["seconds"],
+                ),
+            ]
+        samples += [
+            (
+                "hook_api_retries",
+                "Kubernetes API calls retried by the last run of the hook.",
+                {},
+                api_stats.retries,
+            ),
+            (
+                "hook_api_throttled_seconds",
+                "Time the last run of the hook was throttled for.",
+                {},
+                api_stats.throttled_seconds,
+            ),
+        ]
+    lines = []
+    described = set()
+    for name, help_text, sample_labels, value in samples:
+        name = f"{PREFIX}_{name}"
+        if name not in described:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            described.add(name)
+        lines.append(f"{name}{_labels(dict(labels, **sample_labels))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def textfile_name(unit_name, hook):
+    """File a unit writes the metrics of a hook to; one per hook, so that
+    the textfile collector exposes the last run of every hook."""
+    return re.sub(r"[^A-Za-z0-9_-]", "_", f"{PREFIX}_{unit_name}_{hook}") + ".prom"
+
+
+def write_textfile(directory, name, text):
+    """Write metrics for the textfile collector, atomically so that it never
+    reads a partial file."""
+    fd, path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fh:
+            fh.write(text)
+        os.chmod(path, 0o644)
+        os.replace(path, os.path.join(directory, name))
+    except BaseException:
+        os.unlink(path)
+        raise
+
+
+def push(url, grouping, text, timeout=PUSH_TIMEOUT):
+    """Replace a group of metrics on a Pushgateway."""
+    path = "/".join(f"{quote(k, safe='')}/{quote(v, safe='')}" for k, v in grouping)
+    request = urllib.request.Request(
+        f"{url.rstrip('/')}/metrics/{path}",
+        data=text.encode(),
+        method="PUT",
+        headers={"Content-Type": "text/plain; version=0.0.4"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout):
+        pass
@@ -0,0 +1,303 @@
+"""Juju pod specifications for the gatekeeper charms.
+
+This module is shared by the manager and audit charms. Specs are assembled
+as plain data, with the CRD specs inserted by reference, instead of being
+rendered into YAML text and parsed back.
+
+With crdInstall set to "api" the CRDs are left out of the specs: the manager
+charm installs them through the Kubernetes API, so the spec sent to Juju on
+every change only holds the workload.
+"""
+
+ALL_VERBS = ["create", "delete", "get", "list", "patch", "update", "watch"]
+
+SYSTEM_LABELS = {"gatekeeper.sh/system": "yes"}
+WEBHOOK_POD_LABELS = {
+    "control-plane": "controller-manager",
+    "gatekeeper.sh/operation": "webhook",
+    "gatekeeper.sh/system": "yes",
+}
+WEBHOOK_SERVICE = "gatekeeper-webhook-service"
+WEBHOOK_CERT_SECRET = "gatekeeper-webhook-server-cert"
+WEBHOOK_CONFIGURATION = "gatekeeper-validating-webhook-configuration"
+
+# Whether Juju installs the CRDs from the pod spec or the manager charm does
+# through the Kubernetes API
+CRD_INSTALL_MODES = ["pod-spec", "api"]
+
+
+class PodSpecConfigError(Exception):
+    """The pod spec options in the charm config are invalid."""
+
+
+def crds_in_pod_spec(crd_install):
+    """Whether the CRDs go in the pod spec for a crdInstall value."""
+    if crd_install not in CRD_INSTALL_MODES:
+        raise PodSpecConfigError(
+            f"crdInstall must be one of {', '.join(CRD_INSTALL_MODES)}"
+        )
+    return crd_install == "pod-spec"
+
+
+def _rule(api_groups, resources, verbs, resource_names=None):
+    rule = {"apiGroups": api_groups}
+    if resource_names:
+        rule["resourceNames"] = resource_names
+    rule["resources"] = resources
+    rule["verbs"] = verbs
+    return rule
+
+
+def _port(number, name):
+    return {"containerPort": number, "name": name, "protocol": "TCP"}
+
+
+def service_account():
+    """Service account and RBAC rules gatekeeper needs."""
+    return {
+        "automountServiceAccountToken": True,
+        "roles": [
+            {
+                "global": False,
+                "rules": [
+                    _rule([""], ["events"], ["create", "patch"]),
+                    _rule([""], ["secrets"], list(ALL_VERBS)),
+                ],
+            },
+            {
+                "global": True,
+                "rules": [
+                    _rule(["*"], ["*"], ["get", "list", "watch"]),
+                    _rule(
+                        ["apiextensions.k8s.io"],
+                        ["customresourcedefinitions"],
+                        list(ALL_VERBS),
+                    ),
+                    _rule(["config.gatekeeper.sh"], ["configs"], list(ALL_VERBS)),
+                    _rule(
+                        ["config.gatekeeper.sh"],
+                        ["configs/status"],
+                        ["get", "patch", "update"],
+                    ),
+                    _rule(["constraints.gatekeeper.sh"], ["*"], list(ALL_VERBS)),
+                    _rule(
+                        ["policy"],
+                        ["podsecuritypolicies"],
+                        ["use"],
+                        resource_names=["gatekeeper-admin"],
+                    ),
+                    _rule(["status.gatekeeper.sh"], ["*"], list(ALL_VERBS)),
+                    _rule(
+                        ["templates.gatekeeper.sh"],
+                        ["constrainttemplates"],
+                        list(ALL_VERBS),
+                    ),
+                    _rule(
+                        ["templates.gatekeeper.sh"],
+                        ["constrainttemplates/finalizers"],
+                        ["delete", "get", "patch", "update"],
+                    ),
+                    _rule(
+                        ["templates.gatekeeper.sh"],
+                        ["constrainttemplates/status"],
+                        ["get", "patch", "update"],
+                    ),
+                    _rule(
+                        ["admissionregistration.k8s.io"],
+                        ["validatingwebhookconfigurations"],
+                        list(ALL_VERBS),
+                        resource_names=[WEBHOOK_CONFIGURATION],
+                    ),
+                ],
+            },
+        ],
+    }
+
+
+def crd_resources(crds):
+    """customResourceDefinitions entries for CRD manifests."""
+    return [{"name": crd["metadata"]["name"], "spec": crd["spec"]} for crd in crds]
+
+
+def container(name, image_details, image_pull_policy, args, ports):
+    """A gatekeeper container running /manager with the given arguments."""
+    return {
+        "envConfig": {
+            "POD_NAMESPACE": {
+                "field": {"path": "metadata.namespace", "api-version": "v1"}
+            },
+            "POD_NAME": {"field": {"path": "metadata.name", "api-version": "v1"}},
+        },
+        "imageDetails": image_details,
+        "ports": ports,
+        "imagePullPolicy": image_pull_policy,
+        "name": name,
+        "args": args,
+        "command": ["/manager"],
+        "kubernetes": {
+            "livenessProbe": {"httpGet": {"path": "/healthz", "port": 9090}},
+            "readinessProbe": {"httpGet": {"path": "/readyz", "port": 9090}},
+            "securityContext": {
+                "allowPrivilegeEscalation": False,
+                "capabilities": {"drop": ["all"]},
+                "runAsGroup": 999,
+                "runAsNonRoot": True,
+                "runAsUser": 1000,
+            },
+        },
+    }
+
+
+def _webhook(namespace, name, path, failure_policy, rules, timeout_seconds):
+    return {
+        "clientConfig": {
+            "caBundle": "Cg==",
+            "service": {
+                "name": WEBHOOK_SERVICE,
+                "namespace": namespace,
+                "path": path,
+            },
+        },
+        "failurePolicy": failure_policy,
+        "name": name,
+        "rules": rules,
+        "sideEffects": "None",
+        "timeoutSeconds": timeout_seconds,
+    }
+
+
+def validating_webhook_configuration(
+    namespace,
+    rules=None,
+    exempt_namespaces=(),
+    timeout_seconds=3,
+    failure_policy="Ignore",
+    ignore_label_timeout_seconds=3,
+    ignore_label_failure_policy="Fail",
+):
+    """The admission webhooks served by the manager.
+
+    rules replace the validation webhook's default of every resource on
+    CREATE and UPDATE, and requests from exempt_namespaces never reach it.
+    They are selected by the kubernetes.io/metadata.name label, which
+    Kubernetes only sets from 1.21; on older clusters the selector matches
+    every namespace.
+    """
+    if rules is None:
+        rules = [
+            {
+                "apiGroups": ["*"],
+                "apiVersions": ["*"],
+                "operations": ["CREATE", "UPDATE"],
+                "resources": ["*"],
+            }
+        ]
+    validation = _webhook(
+        namespace,
+        "validation.gatekeeper.sh",
+        "/v1/admit",
+        failure_policy,
+        rules,
+        timeout_seconds,
+    )
+    match_expressions = [
+        {"key": "admission.gatekeeper.sh/ignore", "operator": "DoesNotExist"}
+    ]
+    if exempt_namespaces:
+        match_expressions.append(
+            {
+                "key": "kubernetes.io/metadata.name",
+                "operator": "NotIn",
+                "values": list(exempt_namespaces),
+            }
+        )
+    validation["namespaceSelector"] = {"matchExpressions": match_expressions}
+    check_ignore_label = _webhook(
+        namespace,
+        "check-ignore-label.gatekeeper.sh",
+        "/v1/admitlabel",
+        ignore_label_failure_policy,
+        [
+            {
+                "apiGroups": [""],
+                "apiVersions": ["*"],
+                "operations": ["CREATE", "UPDATE"],
+                "resources": ["namespaces"],
+            }
+        ],
+        ignore_label_timeout_seconds,
+    )
+    return {
+        "name": WEBHOOK_CONFIGURATION,
+        "labels": dict(SYSTEM_LABELS),
+        "webhooks": [validation, check_ignore_label],
+    }
+
+
+def manager_pod_spec(
+    crds, image_details, image_pull_policy, cli_args, namespace, webhook_options=None
+):
+    """Pod spec of the gatekeeper controller manager (admission webhook).
+
+    webhook_options are passed on to validating_webhook_configuration. Without
+    crds the spec has no customResourceDefinitions.
+    """
+    manager = container(
+        "manager",
+        image_details,
+        image_pull_policy,
+        cli_args,
+        [_port(8443, "webhook-server"), _port(8888, "metrics"), _port(9090, "healthz")],
+    )
+    manager["volumeConfig"] = [
+        {
+            "name": "cert",
+            "mountPath": "/certs",
+            "secret": {"name": WEBHOOK_CERT_SECRET},
+        }
+    ]
+    spec = {
+        "version": 3,
+        "kubernetesResources": {
+            "services": [
+                {
+                    "name": WEBHOOK_SERVICE,
+                    "labels": dict(SYSTEM_LABELS),
+                    "spec": {
+                        "ports": [{"port": 443, "targetPort": 8443}],
+                        "selector": dict(WEBHOOK_POD_LABELS),
+                    },
+                }
+            ],
+            "pod": {"labels": dict(WEBHOOK_POD_LABELS)},
+            "validatingWebhookConfigurations": [
+                validating_webhook_configuration(namespace, **(webhook_options or {}))
+            ],
+            "secrets": [{"name": WEBHOOK_CERT_SECRET, "type": "Opaque"}],
+        },
+        "serviceAccount": service_account(),
+        "containers": [manager],
+    }
+    if crds:
+        spec["kubernetesResources"]["customResourceDefinitions"] = crd_resources(crds)
+    return spec
+
+
+def audit_pod_spec(crds, image_details, image_pull_policy, audit_cli_args):
+    """Pod spec of the gatekeeper audit controller, without
+    kubernetesResources when there are no crds."""
+    audit = container(
+        "audit",
+        image_details,
+        image_pull_policy,
+        audit_cli_args,
+        [_port(8888, "metrics"), _port(9090, "healthz")],
+    )
+    spec = {
+        "version": 3,
+        "serviceAccount": service_account(),
+        "containers": [audit],
+    }
+    if crds:
+        spec["kubernetesResources"] = {"customResourceDefinitions": crd_resources(crds)}
+    return spec
@@ -0,0 +1,169 @@
+"""Load bundles of gatekeeper policies.
+
+A bundle is a multi-document YAML stream of ConstraintTemplates and
+constraints, read from a file or an http(s) URL. Documents are parsed one at
+a time, so memory stays flat however many policies a bundle holds:
+
+* documents whose normalized content was already seen are skipped;
+* objects are applied with server-side apply in parallel batches;
+* before the first constraint of a kind is applied, the batch holding its
+  template is flushed and the CRD gatekeeper generates from the template is
+  waited for, as the constraint cannot be created before it is served.
+"""
+
+import logging
+import time
+import urllib.request
+
+import yaml
+
+import manifests
+import tracing
+import utils
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_GROUP = "templates.gatekeeper.sh"
+CONSTRAINTS_GROUP = "constraints.gatekeeper.sh"
+BATCH_SIZE = 20
+CRD_TIMEOUT = 60
+CRD_INTERVAL = 1
+URL_TIMEOUT = 30
+
+
+class PolicyBundleError(Exception):
+    """A bundle document is not a gatekeeper policy."""
+
+
+def open_bundle(location):
+    """Open a bundle file or http(s) URL as a binary stream."""
+    if location.startswith(("http://", "https://")):
+        return urllib.request.urlopen(location, timeout=URL_TIMEOUT)
+    return open(location, "rb")
+
+
+def documents(stream):
+    """Parse the documents of a YAML stream one by one, skipping empty ones.
+
+    This is yaml.safe_load_all with the C loader when available."""
+    for document in yaml.load_all(stream, manifests.SafeLoader):
+        if document:
+            yield document
+
+
+def policy_object(document):
+    """The utils custom object of a ConstraintTemplate or constraint."""
+    group, _, version = document.get("apiVersion", "").partition("/")
+    kind = document.get("kind")
+    name = document.get("metadata", {}).get("name")
+    if not version or not kind or not name:
+        raise PolicyBundleError(f"not a Kubernetes object: {document!r:.80}")
+    if group == TEMPLATES_GROUP and kind == "ConstraintTemplate":
+        plural = "constrainttemplates"
+    elif group == CONSTRAINTS_GROUP:
+        plural = kind.lower()
+    else:
+        raise PolicyBundleError(
+            f"{kind}/{name}: only ConstraintTemplates and constraints are loaded"
+        )
+    return {"group": group, "version": version, "plural": plural, "body": document}
+
+
+def constraint_crd(kind):
+    """Name of the CRD gatekeeper generates for a constraint kind."""
+    return f"{kind.lower()}.{CONSTRAINTS_GROUP}"
+
+
+def crd_established(name):
+    """Whether a CRD exists and reports the Established condition."""
+    path = f"{utils.RESOURCE_PATHS['CustomResourceDefinition']}/{name}"
+    try:
+        crd = utils.read_object(path)
+    except utils.ApiException as err:
+        if err.status == 404:
+            return False
+        raise
+    conditions = (crd.get("status") or {}).get("conditions") or []
+    return any(
+        c.get("type") == "Established" and c.get("status") == "True" for c in conditions
+    )
+
+
+def wait_for_crd(name, timeout=CRD_TIMEOUT, interval=CRD_INTERVAL):
+    """Wait for a CRD gatekeeper creates asynchronously; False on timeout."""
+    deadline = time.monotonic() + timeout
+    while not crd_established(name):
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(interval)
+    return True
+
+
+def _failed(k8s_object, message):
+    return utils.ApplyResult(
+        utils.object_kind(k8s_object),
+        utils.object_name(k8s_object),
+        None,
+        utils.object_tier(k8s_object),
+        "failed",
+        0.0,
+        RuntimeError(message),
+        None,
+    )
+
+
+def load_bundle(
+    stream,
+    namespace,
+    batch_size=BATCH_SIZE,
+    max_workers=utils.DEFAULT_APPLY_WORKERS,
+    crd_timeout=CRD_TIMEOUT,
+):
+    """Apply the policies in a YAML stream.
+
+    Returns one ApplyResult per distinct object, in the order they were
+    applied, and the number of duplicate documents skipped.
+    """
+    results = []
+    seen = set()
+    ready = {}
+    duplicates = 0
+    batch = []
+
+    def flush():
+        nonlocal batch
+        if batch:
+            with tracing.span("apply_batch", objects=len(batch)):
+                results.extend(
+                    utils.apply_k8s_objects(
+                        namespace, batch, action="apply", max_workers=max_workers
+                    )
+                )
+            batch = []
+
+    for document in documents(stream):
+        k8s_object = policy_object(document)
+        digest = utils.normalized_hash(utils.object_manifest(k8s_object))
+        if digest in seen:
+            duplicates += 1
+            continue
+        seen.add(digest)
+
+        if k8s_object["group"] == CONSTRAINTS_GROUP:
+            kind = document["kind"]
+            if kind not in ready:
+                # the template may be in the pending batch
+                flush()
+                with tracing.span("wait_for_crd", kind=kind):
+                    ready[kind] = wait_for_crd(constraint_crd(kind), crd_timeout)
+            if not ready[kind]:
+                results.append(
+                    _failed(k8s_object, f"CRD {constraint_crd(kind)} not established")
+                )
+                continue
+
+        batch.append(k8s_object)
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    return results, duplicates
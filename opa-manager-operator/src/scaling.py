@@ -0,0 +1,335 @@
+"""Replicas, placement, resources and disruption budget of the webhook pods.
+
+Juju pod specs (version 3) cannot express pod affinity, container resources,
+PodDisruptionBudgets or HorizontalPodAutoscalers, so these are applied with
+the Kubernetes API instead: the Deployment Juju creates for the application
+is patched with server-side apply, and the budget and autoscaler are created
+next to it. Objects are given in the group/version/plural/body form utils
+uses for namespaced objects.
+
+The Deployment's replicas are left alone: Juju runs one pod per unit and
+sets them to the unit count whenever it updates the Deployment, and with
+autoscaling the HorizontalPodAutoscaler sets them too, so a third writer
+would only fight both. A webhookReplicas different from the unit count is
+reported instead, to be fixed with juju scale-application.
+
+Juju also rewrites the pod template whenever it updates the Deployment,
+dropping the patched affinity and resources until update-status restores
+them, and each rewrite rolls the webhook pods. Both are unset by default,
+so the Deployment is only patched when they are asked for.
+"""
+
+import re
+from collections import namedtuple
+
+import podspec
+
+ANTI_AFFINITY = ("none", "preferred", "required")
+AUTOSCALING = ("none", "cpu", "metrics")
+QUANTITY = re.compile(r"^[0-9]+(\.[0-9]+)?(m|k|M|G|T|Ki|Mi|Gi|Ti)?$")
+TOPOLOGY_KEY = "kubernetes.io/hostname"
+CONTAINER = "manager"
+
+QUANTITY_SUFFIXES = {
+    "": 1,
+    "m": 0.001,
+    "k": 1000,
+    "M": 1e6,
+    "G": 1e9,
+    "T": 1e12,
+    "Ki": 1024,
+    "Mi": 1024 * 1024,
+    "Gi": 1024 * 1024 * 1024,
+    "Ti": 1024 * 1024 * 1024 * 1024,
+}
+
+ScalingSettings = namedtuple(
+    "ScalingSettings",
+    [
+        "replicas",
+        "anti_affinity",
+        "max_unavailable",
+        "requests",
+        "limits",
+        "autoscaling",
+        "min_replicas",
+        "max_replicas",
+        "target_cpu",
+        "metric",
+        "metric_target",
+    ],
+)
+
+
+class ScalingConfigError(Exception):
+    """The scaling options in the charm config are invalid."""
+
+
+def _choice(config, option, choices):
+    value = config[option]
+    if value not in choices:
+        raise ScalingConfigError(f"{option} must be one of {', '.join(choices)}")
+    return value
+
+
+def _at_least(config, option, minimum):
+    value = config[option]
+    if value < minimum:
+        raise ScalingConfigError(f"{option} must be at least {minimum}")
+    return value
+
+
+def _quantities(config, options):
+    quantities = {}
+    for resource, option in options.items():
+        value = config[option].strip()
+        if not value:
+            continue
+        if not QUANTITY.match(value):
+            raise ScalingConfigError(f"{option}: invalid quantity {value!r}")
+        quantities[resource] = value
+    return quantities
+
+
+def settings_from_config(config):
+    """Validate the scaling options, raising ScalingConfigError."""
+    requests = _quantities(
+        config, {"cpu": "webhookCPURequest", "memory": "webhookMemoryRequest"}
+    )
+    autoscaling = _choice(config, "webhookAutoscaling", AUTOSCALING)
+    min_replicas = _at_least(config, "webhookAutoscalingMinReplicas", 1)
+    max_replicas = _at_least(config, "webhookAutoscalingMaxReplicas", min_replicas)
+    if autoscaling == "cpu" and "cpu" not in requests:
+        raise ScalingConfigError("CPU autoscaling needs webhookCPURequest")
+    metric_target = config["webhookAutoscalingMetricTarget"].strip()
+    if not QUANTITY.match(metric_target):
+        raise ScalingConfigError(
+            f"webhookAutoscalingMetricTarget: invalid quantity {metric_target!r}"
+        )
+    return ScalingSettings(
+        replicas=_at_least(config, "webhookReplicas", 0),
+        anti_affinity=_choice(config, "webhookAntiAffinity", ANTI_AFFINITY),
+        max_unavailable=_at_least(config, "webhookMaxUnavailable", 0),
+        requests=requests,
+        limits=_quantities(
+            config, {"cpu": "webhookCPULimit", "memory": "webhookMemoryLimit"}
+        ),
+        autoscaling=autoscaling,
+        min_replicas=min_replicas,
+        max_replicas=max_replicas,
+        target_cpu=_at_least(config, "webhookAutoscalingTargetCPU", 1),
+        metric=config["webhookAutoscalingMetric"],
+        metric_target=metric_target,
+    )
+
+
+def quantity_value(quantity):
+    """Numeric value of a Kubernetes quantity, e.g. bytes for "512Mi"."""
+    match = QUANTITY.match(quantity)
+    if not match:
+        raise ScalingConfigError(f"invalid quantity {quantity!r}")
+    suffix = match.group(2) or ""
+    number = quantity.rstrip(suffix) if suffix else quantity
+    return float(number) * QUANTITY_SUFFIXES[suffix]
+
+
+def _namespaced(group, version, plural, namespace, body):
+    body["metadata"]["namespace"] = namespace
+    return {
+        "group": group,
+        "version": version,
+        "namespace": namespace,
+        "plural": plural,
+        "body": body,
+    }
+
+
+def _selector():
+    return {"matchLabels": dict(podspec.WEBHOOK_POD_LABELS)}
+
+
+def _affinity(anti_affinity):
+    term = {"labelSelector": _selector(), "topologyKey": TOPOLOGY_KEY}
+    if anti_affinity == "required":
+        rules = {"requiredDuringSchedulingIgnoredDuringExecution": [term]}
+    else:
+        rules = {
+            "preferredDuringSchedulingIgnoredDuringExecution": [
+                {"weight": 100, "podAffinityTerm": term}
+            ]
+        }
+    return {"podAntiAffinity": rules}
+
+
+def replicas_warning(app_name, settings, units):
+    """Warning when webhookReplicas differs from Juju's unit count, which
+    sets the Deployment's replicas, or None."""
+    if not settings.replicas or settings.autoscaling != "none":
+        return None
+    if settings.replicas == units:
+        return None
+    return (
+        f"webhookReplicas is {settings.replicas} but there are {units} units: "
+        f"run juju scale-application {app_name} {settings.replicas}"
+    )
+
+
+def deployment_patch(app_name, namespace, settings):
+    """Server-side apply patch of the application's Deployment, or None when
+    there is nothing to set."""
+    spec = {}
+    pod = {}
+    if settings.anti_affinity != "none":
+        pod["affinity"] = _affinity(settings.anti_affinity)
+    resources = {}
+    if settings.requests:
+        resources["requests"] = dict(settings.requests)
+    if settings.limits:
+        resources["limits"] = dict(settings.limits)
+    if resources:
+        pod["containers"] = [{"name": CONTAINER, "resources": resources}]
+    if pod:
+        spec["template"] = {"spec": pod}
+    if not spec:
+        return None
+    return _namespaced(
+        "apps",
+        "v1",
+        "deployments",
+        namespace,
+        {
+            "apiVersion": "apps/v1",
+            "kind": "Deployment",
+            "metadata": {"name": app_name},
+            "spec": spec,
+        },
+    )
+
+
+def pod_disruption_budget(app_name, namespace, settings):
+    """PodDisruptionBudget of the webhook pods, or None when disabled."""
+    if not settings.max_unavailable:
+        return None
+    return _namespaced(
+        "policy",
+        "v1beta1",
+        "poddisruptionbudgets",
+        namespace,
+        {
+            "apiVersion": "policy/v1beta1",
+            "kind": "PodDisruptionBudget",
+            "metadata": {"name": app_name, "labels": dict(podspec.SYSTEM_LABELS)},
+            "spec": {
+                "maxUnavailable": settings.max_unavailable,
+                "selector": _selector(),
+            },
+        },
+    )
+
+
+def horizontal_pod_autoscaler(app_name, namespace, settings):
+    """HorizontalPodAutoscaler of the application's Deployment, or None when
+    autoscaling is off.
+
+    Metrics autoscaling reads the per-pod metric from the custom metrics API,
+    which needs an adapter (such as prometheus-adapter) scraping the webhook's
+    metrics port.
+    """
+    if settings.autoscaling == "none":
+        return None
+    if settings.autoscaling == "cpu":
+        metric = {
+            "type": "Resource",
+            "resource": {
+                "name": "cpu",
+                "target": {
+                    "type": "Utilization",
+                    "averageUtilization": settings.target_cpu,
+                },
+            },
+        }
+    else:
+        metric = {
+            "type": "Pods",
+            "pods": {
+                "metric": {"name": settings.metric},
+                "target": {
+                    "type": "AverageValue",
+                    "averageValue": settings.metric_target,
+                },
+            },
+        }
+    return _namespaced(
+        "autoscaling",
+        "v2beta2",
+        "horizontalpodautoscalers",
+        namespace,
+        {
+            "apiVersion": "autoscaling/v2beta2",
+            "kind": "HorizontalPodAutoscaler",
+            "metadata": {"name": app_name, "labels": dict(podspec.SYSTEM_LABELS)},
+            "spec": {
+                "scaleTargetRef": {
+                    "apiVersion": "apps/v1",
+                    "kind": "Deployment",
+                    "name": app_name,
+                },
+                "minReplicas": settings.min_replicas,
+                "maxReplicas": settings.max_replicas,
+                "metrics": [metric],
+            },
+        },
+    )
+
+
+# Builders of the objects scaling the webhook beside its Deployment, with
+# the group, version, plural and kind of what they build
+BUDGET_AND_AUTOSCALER = [
+    (
+        pod_disruption_budget,
+        "policy",
+        "v1beta1",
+        "poddisruptionbudgets",
+        "PodDisruptionBudget",
+    ),
+    (
+        horizontal_pod_autoscaler,
+        "autoscaling",
+        "v2beta2",
+        "horizontalpodautoscalers",
+        "HorizontalPodAutoscaler",
+    ),
+]
+
+
+def _reference(group, version, plural, kind, app_name, namespace):
+    body = {
+        "apiVersion": f"{group}/{version}",
+        "kind": kind,
+        "metadata": {"name": app_name},
+    }
+    return _namespaced(group, version, plural, namespace, body)
+
+
+def budget_and_autoscaler(app_name, namespace, settings):
+    """The PodDisruptionBudget and HorizontalPodAutoscaler to apply, and
+    references to the disabled ones, which are to be deleted."""
+    k8s_objects, removed = [], []
+    for build, group, version, plural, kind in BUDGET_AND_AUTOSCALER:
+        k8s_object = build(app_name, namespace, settings)
+        if k8s_object:
+            k8s_objects.append(k8s_object)
+        else:
+            removed.append(
+                _reference(group, version, plural, kind, app_name, namespace)
+            )
+    return k8s_objects, removed
+
+
+def references(app_name, namespace):
+    """References to the PodDisruptionBudget and HorizontalPodAutoscaler,
+    enabled or not, such as to delete them."""
+    return [
+        _reference(group, version, plural, kind, app_name, namespace)
+        for _, group, version, plural, kind in BUDGET_AND_AUTOSCALER
+    ]
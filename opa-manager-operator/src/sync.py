@@ -0,0 +1,151 @@
+"""Objects replicated into OPA's cache, and the memory that cache needs.
+
+Gatekeeper keeps a copy of every object of the synced kinds (the Config's
+syncOnly list) in OPA, so its memory use grows with the number and size of
+those objects. The estimate counts the live objects of each kind with
+paginated lists, measures the average encoded size of a sample, and scales
+it by how much larger OPA's in-memory representation is than JSON.
+
+utils is imported by the functions that list objects, so that the charm can
+validate syncResources without loading the Kubernetes client.
+"""
+
+import json
+import logging
+import re
+
+import scaling
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 500
+SAMPLE_SIZE = 50
+# OPA's in-memory form of a document is several times its JSON encoding
+OPA_MEMORY_FACTOR = 5
+# Share of the container's memory limit the cache may use, leaving the rest
+# to gatekeeper itself and to compiled policies
+CACHE_SHARE = 0.5
+
+VERSION = re.compile(r"^v[0-9]+((alpha|beta)[0-9]+)?$")
+KIND = re.compile(r"^[A-Z][A-Za-z0-9]*$")
+
+
+class SyncConfigError(Exception):
+    """The syncResources option is invalid."""
+
+
+def parse_sync_resources(value):
+    """Parse comma separated [group/]version/Kind entries into syncOnly
+    entries."""
+    resources = []
+    for item in [item.strip() for item in (value or "").split(",")]:
+        if not item:
+            continue
+        parts = item.split("/")
+        if len(parts) == 2:
+            parts.insert(0, "")
+        if len(parts) != 3 or not VERSION.match(parts[1]) or not KIND.match(parts[2]):
+            raise SyncConfigError(f"syncResources: invalid resource {item!r}")
+        group, version, kind = parts
+        resources.append({"group": group, "version": version, "kind": kind})
+    return resources
+
+
+def _group_version(resource):
+    if resource["group"]:
+        return f"{resource['group']}/{resource['version']}"
+    return resource["version"]
+
+
+def collection(resource, plural):
+    """API path listing a resource across all namespaces."""
+    prefix = "/apis" if resource["group"] else "/api"
+    return f"{prefix}/{_group_version(resource)}/{plural}"
+
+
+def count_objects(path, page_size=PAGE_SIZE, sample_size=SAMPLE_SIZE):
+    """Count the objects in a collection and measure their average size.
+
+    The first page carries the sample; the rest are counted from metadata
+    only pages, unless the server already told how many items remain.
+    Returns (count, average encoded bytes, list calls made).
+    """
+    import utils
+
+    page = utils.list_page(path, min(sample_size, page_size))
+    items = page.get("items", [])
+    sample_bytes = sum(len(json.dumps(item, separators=(",", ":"))) for item in items)
+    count, calls = len(items), 1
+    metadata = page.get("metadata", {})
+    continue_token = metadata.get("continue")
+    if metadata.get("remainingItemCount") is not None:
+        count += metadata["remainingItemCount"]
+        continue_token = None
+    while continue_token:
+        page = utils.list_page(path, page_size, continue_token, metadata_only=True)
+        count += len(page.get("items", []))
+        calls += 1
+        continue_token = page.get("metadata", {}).get("continue")
+    average = sample_bytes / len(items) if items else 0
+    return count, average, calls
+
+
+def estimate(resources, page_size=PAGE_SIZE):
+    """Estimate the cache memory needed to sync resources.
+
+    Returns a dict with one entry per resource under "kinds" and the total
+    under "estimated_bytes".
+    """
+    import utils
+
+    kinds = []
+    plurals = {}
+    for resource in resources:
+        group_version = _group_version(resource)
+        if group_version not in plurals:
+            plurals[group_version] = utils.api_resource_kinds(group_version)
+        plural = plurals[group_version].get(resource["kind"])
+        entry = dict(
+            resource, count=0, average_bytes=0, estimated_bytes=0, list_calls=0
+        )
+        if plural is None:
+            logger.warning("%s/%s is not served", group_version, resource["kind"])
+        else:
+            count, average, calls = count_objects(
+                collection(resource, plural), page_size
+            )
+            entry.update(
+                count=count,
+                average_bytes=int(average),
+                estimated_bytes=int(count * average * OPA_MEMORY_FACTOR),
+                list_calls=calls,
+            )
+        kinds.append(entry)
+    return {
+        "kinds": kinds,
+        "estimated_bytes": sum(entry["estimated_bytes"] for entry in kinds),
+    }
+
+
+def budget_warning(estimated_bytes, memory_limit):
+    """Status message when the estimate exceeds the cache's share of the
+    container's memory limit (a quantity), None when it fits or there is no
+    limit."""
+    if not memory_limit:
+        return None
+    budget = scaling.quantity_value(memory_limit) * CACHE_SHARE
+    if estimated_bytes <= budget:
+        return None
+    return (
+        f"Synced objects need ~{human_bytes(estimated_bytes)}, "
+        f"over the {human_bytes(budget)} cache budget"
+    )
+
+
+def human_bytes(value):
+    """Format a byte count with a binary unit."""
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if value < 1024:
+            return f"{value:.0f}{unit}" if unit == "B" else f"{value:.1f}{unit}"
+        value /= 1024
+    return f"{value:.1f}TiB"
@@ -0,0 +1,226 @@
+"""Phase-level tracing of the charm hooks.
+
+This module is shared by the manager and audit charms. A span is a context
+manager timing a phase of a hook with the monotonic clock and, when
+allocation tracing is on, the change in memory traced by tracemalloc. Spans
+nest: a span opened inside another becomes its child, and a span opened on a
+worker thread becomes a child of the span open on the hook's thread, such as
+the apply that submitted it.
+
+The tracer's root span covers the whole hook. When the hook ends the tree is
+emitted as one JSON line in the log and can also be appended, in the OTLP
+JSON format, to a file read by an OpenTelemetry collector (otlpjsonfile
+receiver) or other OTLP tooling, without depending on the OpenTelemetry SDK.
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+SCOPE = "gatekeeper-charm"
+SPAN_KIND_INTERNAL = 1
+STATUS_CODE_ERROR = 2
+
+
+class Span(object):
+    """A timed phase of a hook."""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.error = None
+        self.span_id = os.urandom(8).hex()
+        self.start = time.monotonic()
+        self.end = None
+        self._allocated = _traced_memory()
+        self.allocated = None
+
+    def set(self, **attributes):
+        """Add attributes known only once the phase has run."""
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.end = time.monotonic()
+        allocated = _traced_memory()
+        if allocated is not None and self._allocated is not None:
+            self.allocated = allocated - self._allocated
+
+    @property
+    def duration(self):
+        return (self.end or time.monotonic()) - self.start
+
+    def to_dict(self, origin=None):
+        """The span and its children, with times in milliseconds relative
+        to origin (the root span's start)."""
+        origin = self.start if origin is None else origin
+        span = {
+            "name": self.name,
+            "start_ms": round((self.start - origin) * 1000, 3),
+            "duration_ms": round(self.duration * 1000, 3),
+        }
+        if self.allocated is not None:
+            span["alloc_kib"] = round(self.allocated / 1024, 1)
+        if self.attributes:
+            span["attributes"] = self.attributes
+        if self.error:
+            span["error"] = self.error
+        if self.children:
+            span["spans"] = [child.to_dict(origin) for child in self.children]
+        return span
+
+
+def _traced_memory():
+    if not tracemalloc.is_tracing():
+        return None
+    return tracemalloc.get_traced_memory()[0]
+
+
+class Tracer(object):
+    """Collect the spans of one hook under a root span."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._root_stack = []
+        self._started_tracemalloc = False
+        self.root = None
+        self.trace_id = None
+        self.started_ns = None
+
+    def _stack(self):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def start(self, name, /, trace_allocations=False, **attributes):
+        """Start the root span of a hook, dropping any previous trace."""
+        if trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.trace_id = os.urandom(16).hex()
+        self.started_ns = time.time_ns()
+        self.root = Span(name, attributes=attributes)
+        self._local = threading.local()
+        self._root_stack = self._stack()
+        self._root_stack.append(self.root)
+        return self.root
+
+    def finish(self):
+        """End the root span; returns it."""
+        root = self.root
+        if root is not None and root.end is None:
+            root.finish()
+        # later spans are no longer part of this hook
+        self._root_stack.clear()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        return root
+
+    @contextmanager
+    def span(self, name, /, **attributes):
+        """Time the enclosed block as a child of the current span.
+
+        Outside a trace (no root started) spans are timed but not kept.
+        """
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        if parent is None and self._root_stack:
+            # worker threads attach to whatever the hook's thread has open
+            parent = self._root_stack[-1]
+        span = Span(name, parent, attributes)
+        if parent is not None:
+            with self._lock:
+                parent.children.append(span)
+        stack.append(span)
+        try:
+            yield span
+        except BaseException as err:
+            span.error = f"{type(err).__name__}: {err}"
+            raise
+        finally:
+            stack.pop()
+            span.finish()
+
+    def to_dict(self, **resource):
+        """The trace as one JSON-serializable record."""
+        record = dict(resource)
+        record["trace_id"] = self.trace_id
+        record.update(self.root.to_dict())
+        return record
+
+    def otlp(self, service_name, **resource):
+        """The trace in the OTLP JSON format (ExportTraceServiceRequest)."""
+        spans = []
+        origin = self.root.start
+
+        def walk(span, parent_id):
+            start_ns = self.started_ns + int((span.start - origin) * 1e9)
+            attributes = dict(span.attributes)
+            if span.allocated is not None:
+                attributes["alloc.bytes"] = span.allocated
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": parent_id,
+                "name": span.name,
+                "kind": SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(start_ns),
+                "endTimeUnixNano": str(start_ns + int(span.duration * 1e9)),
+                "attributes": _otlp_attributes(attributes),
+            }
+            if span.error:
+                otlp_span["status"] = {
+                    "code": STATUS_CODE_ERROR,
+                    "message": span.error,
+                }
+            spans.append(otlp_span)
+            for child in span.children:
+                walk(child, span.span_id)
+
+        walk(self.root, "")
+        resource["service.name"] = service_name
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {"attributes": _otlp_attributes(resource)},
+                    "scopeSpans": [{"scope": {"name": SCOPE}, "spans": spans}],
+                }
+            ]
+        }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [
+        {"key": key, "value": _otlp_value(value)}
+        for key, value in sorted(attributes.items())
+    ]
+
+
+def append_json_line(path, record):
+    """Append a record to a JSON lines file."""
+    with open(path, "a") as fh:
+        fh.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+
+tracer = Tracer()
+
+
+def span(name, /, **attributes):
+    """Open a span in the hook's trace."""
+    return tracer.span(name, **attributes)
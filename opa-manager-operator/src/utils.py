@@ -1,87 +1,365 @@
 """Kubernetes utils library."""
 
+import hashlib
+import json
 import logging
 import os
+import random
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
 from kubernetes import client, config
 from kubernetes.client.rest import ApiException
+from urllib3.util.retry import Retry
 
+import tracing
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_POOL_MAXSIZE = 4
+
+# Client-side rate limit, matching client-go's defaults
+DEFAULT_QPS = 5.0
+DEFAULT_BURST = 10
+
+# Retries of throttled (429) and failed (5xx) requests
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE = 0.2
+BACKOFF_CAP = 30.0
+
+
+class ApiCallStats(object):
+    """Count and time the Kubernetes API calls made by this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._methods = {}
+            self.retries = 0
+            self.throttled = 0
+            self.throttled_seconds = 0.0
+
+    def record(self, method, seconds, failed):
+        with self._lock:
+            stats = self._methods.setdefault(
+                method, {"calls": 0, "errors": 0, "seconds": 0.0}
+            )
+            stats["calls"] += 1
+            stats["errors"] += int(failed)
+            stats["seconds"] += seconds
+
+    def record_retry(self, delay, throttled):
+        with self._lock:
+            self.retries += 1
+            if throttled:
+                self.throttled += 1
+                self.throttled_seconds += delay
+
+    def record_wait(self, seconds):
+        """Time spent waiting for the client-side rate limiter."""
+        if seconds:
+            with self._lock:
+                self.throttled_seconds += seconds
+
+    @property
+    def calls(self):
+        with self._lock:
+            return sum(stats["calls"] for stats in self._methods.values())
+
+    def snapshot(self):
+        """Per HTTP method call counts, error counts and total seconds."""
+        with self._lock:
+            return {method: dict(stats) for method, stats in self._methods.items()}
+
+    def summary(self):
+        """One line summary for the hook log."""
+        return (
+            f"{self.calls} calls, {self.retries} retries, {self.throttled} "
+            f"throttled, {self.throttled_seconds:.2f}s spent throttled"
+        )
+
+
+api_stats = ApiCallStats()
+
+
+class TokenBucket(object):
+    """Client-side rate limiter: bursts of up to `burst` requests, refilled
+    at `qps` tokens per second. A qps of 0 disables limiting."""
+
+    def __init__(self, qps=DEFAULT_QPS, burst=DEFAULT_BURST):
+        self.qps = qps
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take a token, sleeping until one is available. Returns the wait."""
+        if not self.qps:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.qps
+            )
+            self._updated = now
+            self._tokens -= 1
+            # a negative balance is the debt this caller waits out
+            wait = -self._tokens / self.qps if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+def _retry_delay(err, attempt):
+    """Jittered exponential backoff, never shorter than Retry-After."""
+    delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+    retry_after = (err.headers or {}).get("Retry-After")
+    if retry_after:
+        try:
+            delay = max(delay, min(BACKOFF_CAP, float(retry_after)))
+        except ValueError:
+            pass
+    return delay
+
+
+class InstrumentedApiClient(client.ApiClient):
+    """ApiClient through which every request, typed or raw, is rate limited,
+    retried when throttled or failing server-side, and recorded in
+    api_stats."""
+
+    def __init__(self, configuration=None, limiter=None, max_retries=0, **kwargs):
+        super().__init__(configuration, **kwargs)
+        self.limiter = limiter
+        self.max_retries = max_retries
+
+    def call_api(self, resource_path, method, *args, _deadline=None, **kwargs):
+        """With _deadline, a time.monotonic() value, every attempt times out
+        by it and no retry is made that would start after it."""
+        attempt = 0
+        while True:
+            if self.limiter:
+                api_stats.record_wait(self.limiter.acquire())
+            if _deadline is not None:
+                kwargs["_request_timeout"] = max(_deadline - time.monotonic(), 0.001)
+            started = time.monotonic()
+            try:
+                response = super().call_api(resource_path, method, *args, **kwargs)
+            except ApiException as err:
+                api_stats.record(method, time.monotonic() - started, True)
+                retriable = err.status == 429 or (err.status or 0) >= 500
+                if not retriable or attempt >= self.max_retries:
+                    raise
+                delay = _retry_delay(err, attempt)
+                if _deadline is not None and time.monotonic() + delay >= _deadline:
+                    raise
+                api_stats.record_retry(delay, throttled=err.status == 429)
+                logger.debug(
+                    "%s %s returned %s, retrying in %.2fs",
+                    method,
+                    resource_path,
+                    err.status,
+                    delay,
+                )
+                time.sleep(delay)
+                attempt += 1
+                continue
+            api_stats.record(method, time.monotonic() - started, False)
+            return response
+
+
+class KubeClientManager(object):
+    """Share one keep-alive API client between all calls made by a hook.
+
+    Every charm hook is a separate process, so the kube config is loaded and
+    the connection pool is created at most once per hook, on first use.
+    """
+
+    def __init__(
+        self,
+        pool_maxsize=DEFAULT_POOL_MAXSIZE,
+        qps=DEFAULT_QPS,
+        burst=DEFAULT_BURST,
+        max_retries=DEFAULT_MAX_RETRIES,
+    ):
+        self._pool_maxsize = pool_maxsize
+        self._qps = qps
+        self._burst = burst
+        self._max_retries = max_retries
+        self._configuration = None
+        self._api_client = None
+        self._apis = {}
+        self._lock = threading.RLock()
+
+    def configure(
+        self,
+        pool_maxsize=None,
+        configuration=None,
+        qps=None,
+        burst=None,
+        max_retries=None,
+    ):
+        """Change the client settings, dropping any client already created."""
+        with self._lock:
+            self.close()
+            if pool_maxsize is not None:
+                self._pool_maxsize = pool_maxsize
+            if configuration is not None:
+                self._configuration = configuration
+            if qps is not None:
+                self._qps = qps
+            if burst is not None:
+                self._burst = burst
+            if max_retries is not None:
+                self._max_retries = max_retries
+
+    @property
+    def api_client(self):
+        with self._lock:
+            if self._api_client is None:
+                configuration = self._configuration
+                if configuration is None:
+                    _load_kube_config()
+                    configuration = client.Configuration.get_default_copy()
+                configuration.connection_pool_maxsize = self._pool_maxsize
+                # urllib3 only retries connection errors, throttling and
+                # server errors are retried by InstrumentedApiClient
+                configuration.retries = Retry(3, respect_retry_after_header=False)
+                self._api_client = InstrumentedApiClient(
+                    configuration,
+                    limiter=TokenBucket(self._qps, self._burst),
+                    max_retries=self._max_retries,
+                )
+            return self._api_client
+
+    def api(self, api_cls):
+        """Return the shared instance of a typed API class, e.g. CoreV1Api."""
+        with self._lock:
+            if api_cls not in self._apis:
+                self._apis[api_cls] = api_cls(self.api_client)
+            return self._apis[api_cls]
+
+    def close(self):
+        with self._lock:
+            if self._api_client is not None:
+                self._api_client.close()
+            self._api_client = None
+            self._apis = {}
+
+
+_clients = KubeClientManager()
+
+
+def configure_client(
+    pool_maxsize=None, configuration=None, qps=None, burst=None, max_retries=None
+):
+    """Configure the shared API client used by this module."""
+    _clients.configure(
+        pool_maxsize=pool_maxsize,
+        configuration=configuration,
+        qps=qps,
+        burst=burst,
+        max_retries=max_retries,
+    )
+
+
+def get_api(api_cls):
+    """Return a typed API instance bound to the shared API client."""
+    return _clients.api(api_cls)
+
 
 def crud_pod_security_policy_with_api(namespace, psp, action):
     """Create pod security policy."""
     # Using the API because of LP:1886694
     logging.info("Creating pod security policy with K8s API")
-    _load_kube_config()
 
-    body = client.ExtensionsV1beta1PodSecurityPolicy(**psp)
-
-    with client.ApiClient() as api_client:
-        api_instance = client.PolicyV1beta1Api(api_client)
-        try:
-            if action.lower() == "create":
-                api_instance.create_pod_security_policy(body, pretty=True)
-            elif action.lower() == "delete":
-                api_instance.delete_pod_security_policy(
-                    name=psp["metadata"]["name"], pretty=True
-                )
-        except ApiException as err:
-            if err.status == 409:
-                # ignore "already exists" errors so that we can recover from
-                # partially failed setups
-                return
-            else:
-                raise
+    api_instance = get_api(client.PolicyV1beta1Api)
+    try:
+        if action.lower() == "create":
+            api_instance.create_pod_security_policy(psp, pretty=True)
+        elif action.lower() == "delete":
+            api_instance.delete_pod_security_policy(
+                name=psp["metadata"]["name"], pretty=True
+            )
+    except ApiException as err:
+        if err.status == 409:
+            # ignore "already exists" errors so that we can recover from
+            # partially failed setups
+            return
+        else:
+            raise
 
 
 def crud_custom_object(namespace, obj, action):
     """Create custom object using the k8s generic API"""
     # Using the API because of LP:1886694
     logging.info("Creating CRD object with K8s API")
-    _load_kube_config()
 
-    with client.ApiClient() as api_client:
-        api_instance = client.CustomObjectsApi(api_client)
-        try:
+    api_instance = get_api(client.CustomObjectsApi)
+    try:
+        if "namespace" not in obj:
+            # cluster-scoped, such as gatekeeper templates and constraints
             if action.lower() == "create":
-                api_instance.create_namespaced_custom_object(**obj)
-        except ApiException as err:
-            if err.status == 409:
-                # ignore "already exists" errors so that we can recover from
-                # partially failed setups
-                return
-            else:
-                raise
+                api_instance.create_cluster_custom_object(**obj)
+            elif action.lower() == "delete":
+                api_instance.delete_cluster_custom_object(
+                    obj["group"], obj["version"], obj["plural"], object_name(obj)
+                )
+        elif action.lower() == "create":
+            api_instance.create_namespaced_custom_object(**obj)
+        elif action.lower() == "delete":
+            api_instance.delete_namespaced_custom_object(
+                obj["group"],
+                obj["version"],
+                obj["namespace"],
+                obj["plural"],
+                object_name(obj),
+            )
+    except ApiException as err:
+        if err.status == 409:
+            # ignore "already exists" errors so that we can recover from
+            # partially failed setups
+            return
+        elif err.status == 404 and action.lower() == "delete":
+            return
+        else:
+            raise
 
 
 def crud_crd_object(namespace, obj, action):
     """Create Custom Resource Definitino object"""
     # Using the API because of LP:1886694
     logging.info("Creating CRD object with K8s API")
-    _load_kube_config()
 
-    body = client.V1beta1CustomResourceDefinition(**obj)
+    api_instance = get_api(client.ApiextensionsV1beta1Api)
+    try:
+        if action.lower() == "create":
+            api_instance.create_custom_resource_definition(obj, pretty=True)
+        elif action.lower() == "delete":
+            api_instance.delete_custom_resource_definition(
+                name=obj["metadata"]["name"], pretty=True
+            )
+    except ApiException as err:
+        if err.status == 409:
+            # ignore "already exists" errors so that we can recover from
+            # partially failed setups
+            return
+        else:
+            raise
 
-    with client.ApiClient() as api_client:
-        api_instance = client.ApiextensionsV1beta1Api(api_client)
-        try:
-            if action.lower() == "create":
-                api_instance.create_custom_resource_definition(body, pretty=True)
-            elif action.lower() == "delete":
-                api_instance.delete_custom_resource_definition(
-                    name=obj["metadata"]["name"], pretty=True
-                )
-        except ApiException as err:
-            if err.status == 409:
-                # ignore "already exists" errors so that we can recover from
-                # partially failed setups
-                return
-            else:
-                raise
+
+_kube_config_loaded = False
 
 
 def _load_kube_config():
+    global _kube_config_loaded
+    if _kube_config_loaded:
+        return
+
     # TODO: Remove this workaround when bug LP:1892255 is fixed
     from pathlib import Path
 
@@ -94,23 +372,841 @@ def _load_kube_config():
     )
     # end workaround
     config.load_incluster_config()
+    _kube_config_loaded = True
+
+
+# Objects are applied in tiers so that everything an object depends on
+# already exists: CRDs first, then cluster-scoped objects, then namespaced
+# custom resources whose kinds the CRDs define.
+TIER_CRD = 0
+TIER_CLUSTER = 1
+TIER_NAMESPACED = 2
+
+DEFAULT_APPLY_WORKERS = 4
+
+# Seconds a teardown may take, and how the objects it deletes are deleted
+DELETE_DEADLINE = 30
+DELETE_OPTIONS = {
+    "apiVersion": "v1",
+    "kind": "DeleteOptions",
+    "propagationPolicy": "Background",
+}
+
+# Field manager recorded by server-side apply for everything the charm owns
+FIELD_MANAGER = "juju-gatekeeper-charm"
+
+# Collection paths of the built-in kinds the charm manages
+RESOURCE_PATHS = {
+    "CustomResourceDefinition": (
+        "/apis/apiextensions.k8s.io/v1beta1/customresourcedefinitions"
+    ),
+    "PodSecurityPolicy": "/apis/policy/v1beta1/podsecuritypolicies",
+}
+
+# How long a watch waits for changes before the server ends it, and how much
+# longer the client waits for the response, in seconds
+WATCH_TIMEOUT = 1
+WATCH_GRACE = 5
+
+# Label recording the version, a hash of the files they come from, of the
+# CRDs the charm installs through the API
+CRD_VERSION_LABEL = "gatekeeper.juju.is/crd-version"
+
+# Accept header asking the API server for object metadata only
+PARTIAL_METADATA_LIST = (
+    "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1"
+)
+
+# Metadata the API server sets, which never takes part in a comparison
+SERVER_METADATA = [
+    "creationTimestamp",
+    "generation",
+    "managedFields",
+    "resourceVersion",
+    "selfLink",
+    "uid",
+]
+
+ACTION_MAP = {
+    "CustomResourceDefinition": crud_crd_object,
+    "PodSecurityPolicy": crud_pod_security_policy_with_api,
+}
+
+
+# Outcome of applying a single object: status is "ok", "failed", "skipped" or
+# one of the server_side_apply statuses, latency is the wall time of the call
+# in seconds and resource_version is only known for server-side applies.
+ApplyResult = namedtuple(
+    "ApplyResult",
+    [
+        "kind",
+        "name",
+        "namespace",
+        "tier",
+        "status",
+        "latency",
+        "error",
+        "resource_version",
+    ],
+)
+
+
+def object_kind(k8s_object):
+    """Kind of a manifest or of a custom object's body."""
+    return k8s_object.get("kind") or k8s_object.get("body", {}).get("kind")
+
+
+def object_name(k8s_object):
+    """Name of a manifest or of a custom object's body."""
+    metadata = k8s_object.get("metadata") or k8s_object.get("body", {}).get(
+        "metadata", {}
+    )
+    return metadata.get("name")
+
+
+def object_tier(k8s_object):
+    """Dependency tier an object is applied in."""
+    if object_kind(k8s_object) == "CustomResourceDefinition":
+        return TIER_CRD
+    if "body" in k8s_object:
+        return TIER_NAMESPACED
+    return TIER_CLUSTER
+
+
+def _handler_for(k8s_object):
+    kind = object_kind(k8s_object)
+    if kind in ACTION_MAP:
+        return ACTION_MAP[kind]
+    if "body" in k8s_object:
+        # custom objects are given as CustomObjectsApi arguments
+        return crud_custom_object
+    raise ValueError(f"Unsupported Kubernetes object kind: {kind}")
+
+
+def object_manifest(k8s_object):
+    """Manifest of an object as sent to the API server, without status and
+    server-populated metadata."""
+    manifest = dict(k8s_object.get("body", k8s_object))
+    manifest.pop("status", None)
+    manifest["metadata"] = {
+        key: value
+        for key, value in manifest.get("metadata", {}).items()
+        if key not in SERVER_METADATA
+    }
+    return manifest
+
+
+def collection_path(k8s_object):
+    """API path of the collection an object belongs to."""
+    kind = object_kind(k8s_object)
+    if kind in RESOURCE_PATHS:
+        return RESOURCE_PATHS[kind]
+    if "body" in k8s_object and "namespace" in k8s_object:
+        return "/apis/{group}/{version}/namespaces/{namespace}/{plural}".format(
+            **k8s_object
+        )
+    if "body" in k8s_object:
+        return "/apis/{group}/{version}/{plural}".format(**k8s_object)
+    raise ValueError(f"Unsupported Kubernetes object kind: {kind}")
+
+
+def object_path(k8s_object):
+    """API path of a single object."""
+    return f"{collection_path(k8s_object)}/{object_name(k8s_object)}"
+
+
+def _request(
+    method,
+    path,
+    query_params=None,
+    body=None,
+    content_type=None,
+    accept=None,
+    timeout=None,
+    deadline=None,
+):
+    """Call the API server directly, returning the decoded JSON response.
+
+    timeout bounds each attempt; deadline, a time.monotonic() value, bounds
+    the call, retries included."""
+    return _clients.api_client.call_api(
+        path,
+        method,
+        query_params=query_params or [],
+        header_params={
+            "Accept": accept or "application/json",
+            "Content-Type": content_type or "application/json",
+        },
+        body=body,
+        response_type="object",
+        auth_settings=["BearerToken"],
+        _return_http_data_only=True,
+        _request_timeout=timeout,
+        _deadline=deadline,
+    )
+
+
+WRITE_VERBS = {"create", "update", "patch"}
+
+
+def api_groups():
+    """Map every API group the server serves, "" for the core group, to its
+    preferred groupVersion."""
+    groups = {"": "v1"}
+    for group in _request("GET", "/apis").get("groups", []):
+        groups[group["name"]] = group["preferredVersion"]["groupVersion"]
+    return groups
+
 
+def _writable_resources(group_version):
+    path = "/api/v1" if group_version == "v1" else f"/apis/{group_version}"
+    return [
+        resource
+        for resource in _request("GET", path).get("resources", [])
+        if "/" not in resource["name"] and WRITE_VERBS & set(resource["verbs"])
+    ]
 
-ACTION_MAP = {"PodSecurityPolicy": crud_pod_security_policy_with_api}
 
+def api_resources(group_version):
+    """Names of the writable resources, without subresources, served in a
+    groupVersion."""
+    return sorted(resource["name"] for resource in _writable_resources(group_version))
 
-def try_crd(ns, obj, action):
+
+def api_resource_kinds(group_version):
+    """Map the kinds of the writable resources served in a groupVersion to
+    their resource names."""
+    return {
+        resource["kind"]: resource["name"]
+        for resource in _writable_resources(group_version)
+    }
+
+
+def _project(live, desired):
+    """Reduce a live object to the fields present in the desired one, so that
+    server-side defaults don't show up as differences."""
+    if isinstance(desired, dict) and isinstance(live, dict):
+        return {key: _project(live.get(key), value) for key, value in desired.items()}
+    if (
+        isinstance(desired, list)
+        and isinstance(live, list)
+        and len(desired) == len(live)
+    ):
+        return [_project(item, value) for item, value in zip(live, desired)]
+    return live
+
+
+def normalized_hash(manifest):
+    """Stable hash of a manifest's content."""
+    return hashlib.sha256(
+        json.dumps(manifest, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+
+
+def read_object(path):
+    """Fetch an object by its API path."""
+    return _request("GET", path)
+
+
+def get_live_object(k8s_object):
+    """Fetch the live version of an object, or None if it does not exist."""
+    try:
+        return _request("GET", object_path(k8s_object))
+    except ApiException as err:
+        if err.status == 404:
+            return None
+        raise
+
+
+def server_side_apply(namespace, k8s_object, dry_run=False):
+    """Converge an object with server-side apply, skipping unchanged ones.
+
+    The live object is fetched first and only patched when its normalized
+    hash differs from the desired manifest's. With dry_run the patch is sent
+    with dryRun=All, so the server validates it without persisting anything.
+    Returns the status, one of "unchanged", "applied" or, for dry runs,
+    "would-apply", and the resourceVersion the object has afterwards.
+    """
+    manifest = object_manifest(k8s_object)
+    live = get_live_object(k8s_object)
+    live_version = live and live.get("metadata", {}).get("resourceVersion")
+    if live is not None and normalized_hash(
+        _project(object_manifest(live), manifest)
+    ) == normalized_hash(manifest):
+        return "unchanged", live_version
+
+    query_params = [("fieldManager", FIELD_MANAGER), ("force", "true")]
+    if dry_run:
+        query_params.append(("dryRun", "All"))
+    applied = _request(
+        "PATCH",
+        object_path(k8s_object),
+        query_params=query_params,
+        # JSON is valid YAML, so the manifest is sent as an apply patch as is
+        body=json.dumps(manifest),
+        content_type="application/apply-patch+yaml",
+    )
+    if dry_run:
+        return "would-apply", live_version
+    return "applied", (applied or {}).get("metadata", {}).get("resourceVersion")
+
+
+def list_collection_versions(collection, resource_version=None):
+    """Map object names in a collection to their resourceVersion, asking the
+    server for metadata only so that large objects such as CRDs stay cheap,
+    and return the collection's resourceVersion, from which a watch picks up
+    later changes (None if the collection is not served).
+
+    With resource_version "0" the server may answer from its watch cache
+    instead of doing a quorum read of etcd.
+    """
+    query_params = []
+    if resource_version is not None:
+        query_params.append(("resourceVersion", resource_version))
+    try:
+        listing = _request(
+            "GET", collection, query_params=query_params, accept=PARTIAL_METADATA_LIST
+        )
+    except ApiException as err:
+        if err.status == 404:
+            return {}, None
+        raise
+    versions = {
+        item["metadata"]["name"]: item["metadata"].get("resourceVersion")
+        for item in listing.get("items", [])
+    }
+    return versions, listing.get("metadata", {}).get("resourceVersion")
+
+
+def list_resource_versions(collection, resource_version=None):
+    """Map object names in a collection to their resourceVersion."""
+    return list_collection_versions(collection, resource_version)[0]
+
+
+def _watch_events(collection, resource_version, timeout):
+    """The events a watch of a collection from resource_version receives
+    before the server ends it after timeout seconds."""
+    response = _clients.api_client.call_api(
+        collection,
+        "GET",
+        query_params=[
+            ("watch", "true"),
+            ("resourceVersion", resource_version),
+            ("allowWatchBookmarks", "true"),
+            ("timeoutSeconds", timeout),
+        ],
+        header_params={"Accept": "application/json"},
+        auth_settings=["BearerToken"],
+        _return_http_data_only=True,
+        _preload_content=False,
+        _request_timeout=timeout + WATCH_GRACE,
+    )
+    try:
+        return [json.loads(line) for line in response.data.splitlines() if line]
+    finally:
+        response.release_conn()
+
+
+def watch_changes(collection, resource_version, timeout=WATCH_TIMEOUT):
+    """Changes to a collection since resource_version.
+
+    Returns a map of the names of the objects added, modified or deleted to
+    their latest resourceVersion, None once deleted, and the resourceVersion
+    to resume from. The map is None when resource_version is older than the
+    events the server keeps (410 Gone), and the collection must be listed.
+    """
+    try:
+        events = _watch_events(collection, resource_version, timeout)
+    except ApiException as err:
+        if err.status in (404, 410):
+            return None, resource_version
+        raise
+
+    changes = {}
+    for event in events:
+        obj = event.get("object") or {}
+        if event.get("type") == "ERROR":
+            if obj.get("code") == 410:
+                return None, resource_version
+            raise ApiException(status=obj.get("code"), reason=obj.get("message"))
+        metadata = obj.get("metadata", {})
+        resource_version = metadata.get("resourceVersion") or resource_version
+        if event.get("type") == "DELETED":
+            changes[metadata["name"]] = None
+        elif event.get("type") != "BOOKMARK":
+            changes[metadata["name"]] = metadata.get("resourceVersion")
+    return changes, resource_version
+
+
+def list_objects(collection, resource_version=None):
+    """List the objects in a collection, an empty list if it is not served."""
+    query_params = []
+    if resource_version is not None:
+        query_params.append(("resourceVersion", resource_version))
     try:
-        crud_crd_object(ns, obj, action)
-    except TypeError:
-        crud_custom_object(ns, obj, action)
+        listing = _request("GET", collection, query_params=query_params)
+    except ApiException as err:
+        if err.status == 404:
+            return []
+        raise
+    return listing.get("items", [])
+
+
+def list_page(collection, limit, continue_token=None, metadata_only=False):
+    """One page of a paginated list, the raw List with its metadata.continue
+    and, when the server provides it, metadata.remainingItemCount."""
+    query_params = [("limit", limit)]
+    if continue_token:
+        query_params.append(("continue", continue_token))
+    return _request(
+        "GET",
+        collection,
+        query_params=query_params,
+        accept=PARTIAL_METADATA_LIST if metadata_only else None,
+    )
+
+
+def pod_addresses(namespace, labels):
+    """Map the names of the running pods with labels to their IPs."""
+    selector = ",".join(f"{key}={value}" for key, value in sorted(labels.items()))
+    listing = _request(
+        "GET",
+        f"/api/v1/namespaces/{namespace}/pods",
+        query_params=[("labelSelector", selector)],
+    )
+    return {
+        pod["metadata"]["name"]: pod["status"]["podIP"]
+        for pod in listing.get("items", [])
+        if pod.get("status", {}).get("phase") == "Running"
+        and pod["status"].get("podIP")
+    }
+
+
+def ledger_entry(k8s_object, resource_version):
+    """Ledger record of an applied object."""
+    return {
+        "kind": object_kind(k8s_object),
+        "name": object_name(k8s_object),
+        "namespace": k8s_object.get("namespace"),
+        "hash": normalized_hash(object_manifest(k8s_object)),
+        "resourceVersion": resource_version,
+    }
+
+
+def _ledger_key(entry):
+    return (entry["kind"], entry["name"], entry["namespace"])
+
+
+def changed_objects(k8s_objects, ledger):
+    """Filter out objects that are unchanged since they were last applied.
+
+    An object is unchanged when its rendered content hashes the same as in
+    the ledger and the server still has the resourceVersion recorded there.
+    Costs at most one metadata list call per collection, and none when no
+    object matches its ledger entry anyway.
+    """
+    recorded = {_ledger_key(entry): entry for entry in ledger}
+    candidates = {}
+    pending = []
+    for k8s_object in k8s_objects:
+        entry = ledger_entry(k8s_object, None)
+        previous = recorded.get(_ledger_key(entry))
+        if previous and previous["hash"] == entry["hash"]:
+            candidates.setdefault(collection_path(k8s_object), []).append(
+                (k8s_object, previous["resourceVersion"])
+            )
+        else:
+            pending.append(k8s_object)
+
+    for collection, objects in candidates.items():
+        versions = list_resource_versions(collection)
+        for k8s_object, resource_version in objects:
+            if versions.get(object_name(k8s_object)) != resource_version:
+                pending.append(k8s_object)
+
+    logger.debug(
+        "Ledger: %d tracked, %d unchanged, %d to apply, %d list calls",
+        len(recorded),
+        len(k8s_objects) - len(pending),
+        len(pending),
+        len(candidates),
+    )
+    return pending
+
+
+def update_ledger(ledger, k8s_objects, results):
+    """Return the ledger with the outcome of applying k8s_objects merged in.
+
+    Objects that failed, were skipped or were only dry-run applied are
+    dropped so that the next hook applies them again.
+    """
+    updated = {_ledger_key(entry): dict(entry) for entry in ledger}
+    for k8s_object, result in zip(k8s_objects, results):
+        entry = ledger_entry(k8s_object, result.resource_version)
+        if result.error or result.status in ("skipped", "would-apply"):
+            updated.pop(_ledger_key(entry), None)
+        else:
+            updated[_ledger_key(entry)] = entry
+    return list(updated.values())
+
+
+def in_ledger(ledger, k8s_object):
+    """Whether the ledger records k8s_object as applied."""
+    key = _ledger_key(ledger_entry(k8s_object, None))
+    return any(_ledger_key(entry) == key for entry in ledger)
+
+
+def drop_from_ledger(ledger, k8s_objects):
+    """Return the ledger without the entries of k8s_objects, e.g. once they
+    have been deleted."""
+    keys = {_ledger_key(ledger_entry(o, None)) for o in k8s_objects}
+    return [dict(entry) for entry in ledger if _ledger_key(entry) not in keys]
+
+
+def merge_ledgers(ledger, newer):
+    """Return the ledger with the entries of a newer one, such as the ledger
+    the previous leader published, taking precedence."""
+    merged = {_ledger_key(entry): dict(entry) for entry in ledger}
+    merged.update((_ledger_key(entry), dict(entry)) for entry in newer)
+    return list(merged.values())
+
+
+def manifests_fingerprint(k8s_objects):
+    """Hash of the manifests of k8s_objects, whatever their order."""
+    return normalized_hash(
+        sorted(normalized_hash(object_manifest(o)) for o in k8s_objects)
+    )
+
+
+def _collection_changes(collection, resource_version, timeout):
+    if resource_version is not None:
+        changes, resource_version = watch_changes(collection, resource_version, timeout)
+        if changes is not None:
+            return changes, resource_version, False
+    versions, resource_version = list_collection_versions(collection)
+    return versions, resource_version, True
+
+
+def detect_drift(k8s_objects, ledger, watched, timeout=WATCH_TIMEOUT):
+    """Objects changed or deleted behind the charm's back since they were
+    applied.
+
+    watched maps collection paths to the resourceVersion they were last
+    watched up to. Each collection is watched from there, concurrently, so
+    only the events since the last run are transferred, whatever the number
+    of objects; a collection not watched yet, or whose resourceVersion the
+    server no longer keeps events for, is listed for metadata once instead.
+    An object has drifted when its latest resourceVersion is not the one in
+    the ledger, or when it is not in the ledger with its current content.
+    Returns the drifted objects and the updated watched map.
+    """
+    recorded = {_ledger_key(entry): entry for entry in ledger}
+    collections = {}
+    for k8s_object in k8s_objects:
+        collections.setdefault(collection_path(k8s_object), []).append(k8s_object)
+
+    with ThreadPoolExecutor(max_workers=DEFAULT_APPLY_WORKERS) as executor:
+        futures = {
+            collection: executor.submit(
+                _collection_changes, collection, watched.get(collection), timeout
+            )
+            for collection in collections
+        }
+        changes = {collection: f.result() for collection, f in futures.items()}
+
+    drifted = []
+    updated = dict(watched)
+    for collection, objects in collections.items():
+        versions, resource_version, listed = changes[collection]
+        if resource_version is None:
+            updated.pop(collection, None)
+        else:
+            updated[collection] = resource_version
+        for k8s_object in objects:
+            entry = ledger_entry(k8s_object, None)
+            previous = recorded.get(_ledger_key(entry))
+            name = object_name(k8s_object)
+            if (
+                previous is None
+                or previous["hash"] != entry["hash"]
+                or (
+                    (listed or name in versions)
+                    and versions.get(name) != previous["resourceVersion"]
+                )
+            ):
+                drifted.append(k8s_object)
+
+    logger.debug(
+        "Drift: %d objects in %d collections, %d listed, %d drifted",
+        len(k8s_objects),
+        len(collections),
+        sum(1 for change in changes.values() if change[2]),
+        len(drifted),
+    )
+    return drifted, updated
+
+
+def wait_for_crds_established(names, timeout=60, interval=1):
+    """Block until every named CRD reports the Established condition."""
+    api_instance = get_api(client.ApiextensionsV1beta1Api)
+    pending = set(names)
+    deadline = time.monotonic() + timeout
+    while pending:
+        for name in sorted(pending):
+            crd = api_instance.read_custom_resource_definition(name)
+            conditions = (crd.status and crd.status.conditions) or []
+            if any(c.type == "Established" and c.status == "True" for c in conditions):
+                pending.discard(name)
+        if not pending:
+            break
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"CRDs not established: {', '.join(sorted(pending))}")
+        time.sleep(interval)
+
+
+def crd_bundle_version(paths):
+    """Version of a set of CRD files: a short hash of their content, valid
+    as a label value."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, "rb") as fh:
+            digest.update(hashlib.sha256(fh.read()).digest())
+    return digest.hexdigest()[:16]
+
+
+def versioned_crds(crds, version):
+    """Copies of CRD manifests labelled with the version of their bundle."""
+    labelled = []
+    for crd in crds:
+        metadata = dict(crd.get("metadata", {}))
+        metadata["labels"] = dict(metadata.get("labels") or {})
+        metadata["labels"][CRD_VERSION_LABEL] = version
+        labelled.append(dict(crd, metadata=metadata))
+    return labelled
+
+
+def installed_crd_versions():
+    """Map the names of the CRDs installed with a version label to their
+    version, listing CRD metadata only."""
+    listing = _request(
+        "GET",
+        RESOURCE_PATHS["CustomResourceDefinition"],
+        query_params=[("labelSelector", CRD_VERSION_LABEL)],
+        accept=PARTIAL_METADATA_LIST,
+    )
+    versions = {}
+    for item in listing.get("items", []):
+        labels = item["metadata"].get("labels") or {}
+        if CRD_VERSION_LABEL in labels:
+            versions[item["metadata"]["name"]] = labels[CRD_VERSION_LABEL]
+    return versions
+
+
+def _apply_one(namespace, k8s_object, action, dry_run):
+    handler = _handler_for(k8s_object)
+    started = time.monotonic()
+    status, error, resource_version = "ok", None, None
+    with tracing.span(
+        f"{action}_object",
+        kind=object_kind(k8s_object),
+        name=object_name(k8s_object),
+    ) as span:
+        try:
+            if action == "apply":
+                status, resource_version = server_side_apply(
+                    namespace, k8s_object, dry_run=dry_run
+                )
+            else:
+                handler(namespace, k8s_object, action)
+        except Exception as err:
+            status, error = "failed", err
+        span.set(status=status)
+    return ApplyResult(
+        object_kind(k8s_object),
+        object_name(k8s_object),
+        k8s_object.get("namespace"),
+        object_tier(k8s_object),
+        status,
+        time.monotonic() - started,
+        error,
+        resource_version,
+    )
+
+
+def apply_k8s_objects(
+    namespace,
+    k8s_objects,
+    action="create",
+    max_workers=DEFAULT_APPLY_WORKERS,
+    crd_timeout=60,
+    dry_run=False,
+):
+    """Apply objects tier by tier, running each tier on a bounded thread pool.
+
+    action is "create", "delete" or "apply"; the latter converges objects
+    with server_side_apply and honours dry_run. Returns one ApplyResult per
+    object, in input order. Once a tier has a failure the remaining tiers are
+    reported as skipped rather than applied.
+    """
+    tiers = {}
+    for index, k8s_object in enumerate(k8s_objects):
+        _handler_for(k8s_object)  # reject unsupported kinds before any call
+        tiers.setdefault(object_tier(k8s_object), []).append((index, k8s_object))
+
+    results = [None] * len(k8s_objects)
+    failed = False
+    with tracing.span(
+        "apply_k8s_objects", action=action, objects=len(k8s_objects)
+    ), ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for tier in sorted(tiers):
+            if failed:
+                for index, k8s_object in tiers[tier]:
+                    results[index] = ApplyResult(
+                        object_kind(k8s_object),
+                        object_name(k8s_object),
+                        k8s_object.get("namespace"),
+                        tier,
+                        "skipped",
+                        0.0,
+                        None,
+                        None,
+                    )
+                continue
+
+            futures = {
+                executor.submit(
+                    _apply_one, namespace, k8s_object, action, dry_run
+                ): index
+                for index, k8s_object in tiers[tier]
+            }
+            for future, index in futures.items():
+                results[index] = future.result()
+            failed = any(results[index].error for index in futures.values())
+
+            if (
+                tier == TIER_CRD
+                and action in ("create", "apply")
+                and not dry_run
+                and not failed
+            ):
+                with tracing.span("wait_for_crds_established"):
+                    wait_for_crds_established(
+                        [object_name(o) for _, o in tiers[tier]], timeout=crd_timeout
+                    )
+    return results
+
+
+def _delete_one(k8s_object, tier, deadline):
+    started = time.monotonic()
+    status, error = "deleted", None
+    with tracing.span(
+        "delete_object", kind=object_kind(k8s_object), name=object_name(k8s_object)
+    ) as span:
+        try:
+            deleted = _request(
+                "DELETE",
+                object_path(k8s_object),
+                body=DELETE_OPTIONS,
+                deadline=deadline,
+            )
+            if (deleted or {}).get("metadata", {}).get("deletionTimestamp"):
+                status = "deleting"
+        except ApiException as err:
+            if err.status == 404:
+                status = "absent"
+            else:
+                status, error = "failed", err
+        except Exception as err:
+            status, error = "failed", err
+        span.set(status=status)
+    return ApplyResult(
+        object_kind(k8s_object),
+        object_name(k8s_object),
+        k8s_object.get("namespace"),
+        tier,
+        status,
+        time.monotonic() - started,
+        error,
+        None,
+    )
+
+
+def delete_k8s_objects(
+    groups, deadline=DELETE_DEADLINE, max_workers=DEFAULT_APPLY_WORKERS
+):
+    """Delete groups of objects, one group after the other and the objects
+    of a group concurrently.
+
+    Deletes propagate in the background, so the API server answers as soon
+    as an object is marked for deletion and garbage collects its dependents
+    afterwards. The whole teardown is bounded by deadline seconds: requests
+    time out, and throttled or failing ones are only retried, within the
+    time left. Objects whose delete has not returned by then are reported
+    as "failed" and those of groups not started as "skipped".
+
+    Returns one ApplyResult per object, in order, with status "deleted",
+    "deleting" (finalizers pending), "absent" (not found), "failed" or
+    "skipped"; the tier is the index of the group.
+    """
+    end = time.monotonic() + deadline
+    results = []
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    with tracing.span(
+        "delete_k8s_objects", objects=sum(len(group) for group in groups)
+    ):
+        for tier, group in enumerate(groups):
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                results += [
+                    ApplyResult(
+                        object_kind(o),
+                        object_name(o),
+                        o.get("namespace"),
+                        tier,
+                        "skipped",
+                        0.0,
+                        None,
+                        None,
+                    )
+                    for o in group
+                ]
+                continue
+
+            futures = [executor.submit(_delete_one, o, tier, end) for o in group]
+            wait(futures, timeout=remaining)
+            for k8s_object, future in zip(group, futures):
+                if future.done():
+                    results.append(future.result())
+                    continue
+                future.cancel()
+                results.append(
+                    ApplyResult(
+                        object_kind(k8s_object),
+                        object_name(k8s_object),
+                        k8s_object.get("namespace"),
+                        tier,
+                        "failed",
+                        remaining,
+                        TimeoutError(f"not deleted within {deadline}s"),
+                        None,
+                    )
+                )
+    # requests still running end with their timeout
+    executor.shutdown(wait=False)
+    return results
 
 
 def create_k8s_object(namespace, k8s_object):
     """Create all supplementary K8s objects."""
-    ACTION_MAP.get(k8s_object.get("kind"), try_crd)(namespace, k8s_object, "create")
+    with tracing.span(
+        "create_object", kind=object_kind(k8s_object), name=object_name(k8s_object)
+    ):
+        _handler_for(k8s_object)(namespace, k8s_object, "create")
 
 
 def remove_k8s_object(namespace, k8s_object):
-    """Remove all supplementary K8s objects."""
-    ACTION_MAP.get(k8s_object.get("kind"), try_crd)(namespace, k8s_object, "delete")
+    """Remove a supplementary K8s object, in the background; one that is
+    already gone is ignored."""
+    result = _delete_one(k8s_object, object_tier(k8s_object), None)
+    if result.error:
+        raise result.error
@@ -0,0 +1,230 @@
+"""Admission webhook tuning from the charm config.
+
+The resource lists use kubectl's resource.group notation: "pods" is a core
+resource, "deployments.apps" a resource in the apps group, "*.apps" every
+resource in the apps group and "*" every resource in every group. Core
+group resources can also be selected as a whole with "*.core".
+
+Admission rules can only include resources, so exclusions from wildcards
+are resolved against the API groups and resources the cluster serves.
+"""
+
+import re
+from collections import namedtuple
+
+import podspec
+
+FAILURE_POLICIES = ("Ignore", "Fail")
+MIN_TIMEOUT_SECONDS = 1
+MAX_TIMEOUT_SECONDS = 30
+CORE_GROUP = "core"
+
+# Gatekeeper validates its own templates and constraints in the webhook, so
+# they are admitted whatever the installed constraints match.
+GATEKEEPER_RESOURCES = {
+    ("templates.gatekeeper.sh", "constrainttemplates"),
+    ("constraints.gatekeeper.sh", "*"),
+}
+
+DNS_LABEL = re.compile(r"^[a-z0-9]([-a-z0-9]*[a-z0-9])?$")
+DNS_SUBDOMAIN = re.compile(
+    r"^[a-z0-9]([-a-z0-9]*[a-z0-9])?(\.[a-z0-9]([-a-z0-9]*[a-z0-9])?)*$"
+)
+
+WebhookSettings = namedtuple(
+    "WebhookSettings",
+    [
+        "include",
+        "exclude",
+        "operations",
+        "exempt_namespaces",
+        "timeout_seconds",
+        "failure_policy",
+        "ignore_label_timeout_seconds",
+        "ignore_label_failure_policy",
+    ],
+)
+
+
+class WebhookConfigError(Exception):
+    """The webhook options in the charm config are invalid."""
+
+
+def _split(value):
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def parse_resources(value, option):
+    """Parse a comma separated resource list into (group, resource) pairs.
+
+    The core group is "" as in admission rules, and ("*", "*") stands for
+    every resource.
+    """
+    resources = set()
+    for item in _split(value):
+        if item == "*":
+            resources.add(("*", "*"))
+            continue
+        resource, _, group = item.partition(".")
+        if group == CORE_GROUP:
+            group = ""
+        if (resource != "*" and not DNS_LABEL.match(resource)) or (
+            group and not DNS_SUBDOMAIN.match(group)
+        ):
+            raise WebhookConfigError(f"{option}: invalid resource {item!r}")
+        resources.add((group, resource))
+    return resources
+
+
+def parse_namespaces(value, option):
+    """Parse a comma separated list of namespace names."""
+    namespaces = _split(value)
+    for namespace in namespaces:
+        if len(namespace) > 63 or not DNS_LABEL.match(namespace):
+            raise WebhookConfigError(f"{option}: invalid namespace {namespace!r}")
+    return sorted(set(namespaces))
+
+
+def _timeout(config, option):
+    timeout = config[option]
+    if not MIN_TIMEOUT_SECONDS <= timeout <= MAX_TIMEOUT_SECONDS:
+        raise WebhookConfigError(
+            f"{option} must be between {MIN_TIMEOUT_SECONDS} and "
+            f"{MAX_TIMEOUT_SECONDS}"
+        )
+    return timeout
+
+
+def _failure_policy(config, option):
+    policy = config[option]
+    if policy not in FAILURE_POLICIES:
+        raise WebhookConfigError(
+            f"{option} must be one of {', '.join(FAILURE_POLICIES)}"
+        )
+    return policy
+
+
+def settings_from_config(config):
+    """Validate the webhook options, raising WebhookConfigError."""
+    include = parse_resources(config["webhookResources"], "webhookResources")
+    if not include:
+        raise WebhookConfigError("webhookResources selects no resources")
+    exclude = parse_resources(
+        config["webhookExcludeResources"], "webhookExcludeResources"
+    )
+    if ("*", "*") in exclude:
+        raise WebhookConfigError("webhookExcludeResources excludes every resource")
+    operations = (
+        ["CREATE", "UPDATE"] if config["webhookValidateUpdates"] else ["CREATE"]
+    )
+    return WebhookSettings(
+        include=include,
+        exclude=exclude,
+        operations=operations,
+        exempt_namespaces=parse_namespaces(
+            config["exemptNamespaces"], "exemptNamespaces"
+        ),
+        timeout_seconds=_timeout(config, "webhookTimeoutSeconds"),
+        failure_policy=_failure_policy(config, "webhookFailurePolicy"),
+        ignore_label_timeout_seconds=_timeout(
+            config, "ignoreLabelWebhookTimeoutSeconds"
+        ),
+        ignore_label_failure_policy=_failure_policy(
+            config, "ignoreLabelWebhookFailurePolicy"
+        ),
+    )
+
+
+def match_resources(settings, resources):
+    """Settings that send the validation webhook only the given (apiGroup,
+    resource) pairs, plus gatekeeper's own resources, instead of the
+    configured webhookResources. Exclusions still apply."""
+    return settings._replace(
+        include={tuple(resource) for resource in resources} | GATEKEEPER_RESOURCES
+    )
+
+
+def needs_discovery(settings):
+    """Whether resolving the rules needs the cluster's API groups."""
+    if not settings.exclude:
+        return False
+    partly_excluded = {group for group, resource in settings.exclude if resource != "*"}
+    return any(
+        group == "*" or (resource == "*" and group in partly_excluded)
+        for group, resource in settings.include
+    )
+
+
+def webhook_rules(settings, api_groups=(), api_resources=None):
+    """Narrowest admission rules covering the included resources.
+
+    api_groups lists the groups the cluster serves and api_resources(group)
+    the resources of one group; both are only used when exclusions have to
+    be carved out of wildcards (see needs_discovery).
+    """
+    if ("*", "*") in settings.include and not settings.exclude:
+        return [_rule(["*"], ["*"], settings.operations)]
+
+    excluded_groups = {group for group, resource in settings.exclude if resource == "*"}
+    selected = {}
+    for group, resource in settings.include:
+        for name in api_groups if group == "*" else [group]:
+            selected.setdefault(name, set()).add(resource)
+
+    groups_by_resources = {}
+    for group, resources in selected.items():
+        if group in excluded_groups:
+            continue
+        excluded = {resource for name, resource in settings.exclude if name == group}
+        if "*" in resources:
+            resources = set(api_resources(group)) - excluded if excluded else {"*"}
+        else:
+            resources = resources - excluded
+        if resources:
+            key = tuple(sorted(resources))
+            groups_by_resources.setdefault(key, []).append(group)
+
+    if not groups_by_resources:
+        raise WebhookConfigError("webhookExcludeResources excludes every resource")
+    return [
+        _rule(sorted(groups), list(resources), settings.operations)
+        for resources, groups in sorted(
+            groups_by_resources.items(), key=lambda item: sorted(item[1])
+        )
+    ]
+
+
+def _rule(api_groups, resources, operations):
+    return {
+        "apiGroups": api_groups,
+        "apiVersions": ["*"],
+        "operations": list(operations),
+        "resources": resources,
+    }
+
+
+def pod_spec_options(settings, rules):
+    """Keyword arguments for podspec.validating_webhook_configuration."""
+    return {
+        "rules": rules,
+        "exempt_namespaces": settings.exempt_namespaces,
+        "timeout_seconds": settings.timeout_seconds,
+        "failure_policy": settings.failure_policy,
+        "ignore_label_timeout_seconds": settings.ignore_label_timeout_seconds,
+        "ignore_label_failure_policy": settings.ignore_label_failure_policy,
+    }
+
+
+def configuration_reference(namespace):
+    """Reference, as a utils custom object, to the validating webhook
+    configuration Juju creates from the pod spec, named after the model."""
+    return {
+        "group": "admissionregistration.k8s.io",
+        "version": "v1",
+        "plural": "validatingwebhookconfigurations",
+        "body": {
+            "apiVersion": "admissionregistration.k8s.io/v1",
+            "kind": "ValidatingWebhookConfiguration",
+            "metadata": {"name": f"{namespace}-{podspec.WEBHOOK_CONFIGURATION}"},
+        },
+    }
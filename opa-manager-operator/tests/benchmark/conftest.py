@@ -0,0 +1,105 @@
+"""Shared helpers for the hook benchmarks.
+
+Measurements are collected during the session and written as JSON to
+BENCHMARK_RESULTS (default: benchmark-results.json) so that runs on
+different commits can be compared.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+RESULTS_FILE = os.environ.get("BENCHMARK_RESULTS", "benchmark-results.json")
+
+_results = {}
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _api_stats():
+    try:
+        import utils
+    except ImportError:
+        return None
+    return utils.api_stats
+
+
+def measure(harness, name, hook):
+    """Run hook() and record its wall time, peak memory, API calls and the
+    size of any pod spec it sets."""
+    pod = harness.charm.model.pod
+    api_stats = _api_stats()
+    if api_stats:
+        api_stats.reset()
+    with patch.object(pod, "set_spec", wraps=pod.set_spec) as set_spec:
+        tracemalloc.start()
+        started = time.perf_counter()
+        hook()
+        wall = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    spec_bytes = [len(json.dumps(c[0][0])) for c in set_spec.call_args_list]
+    _results[name] = {
+        "wall_ms": round(wall * 1000, 3),
+        "peak_kib": round(peak / 1024, 1),
+        "api_calls": api_stats.calls if api_stats else 0,
+        "set_spec_calls": len(spec_bytes),
+        "spec_bytes": sum(spec_bytes),
+    }
+    return _results[name]
+
+
+def record(name, **values):
+    """Record measurements that don't come from a single hook run."""
+    _results[name] = values
+    return values
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if not _results:
+        return
+    report = {
+        "commit": _commit(),
+        "python": platform.python_version(),
+        "results": _results,
+    }
+    with open(RESULTS_FILE, "w") as fh:
+        json.dump(report, fh, indent=2, sort_keys=True)
+    print(f"\nBenchmark results written to {RESULTS_FILE}")
+
+
+@pytest.fixture
+def fake_apiserver():
+    """Point utils at an in-process fake API server."""
+    from kubernetes import client
+    from tests.fake_apiserver import FakeApiServer
+    import utils
+
+    with FakeApiServer() as server:
+
+        def load_kube_config():
+            client.Configuration.set_default(server.configuration())
+
+        with patch("utils._load_kube_config", load_kube_config):
+            # scenarios measure the server, unless they opt into rate limiting
+            utils.configure_client(qps=0)
+            yield server
+        utils.configure_client(qps=utils.DEFAULT_QPS, burst=utils.DEFAULT_BURST)
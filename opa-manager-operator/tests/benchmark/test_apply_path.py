@@ -0,0 +1,128 @@
+"""Throughput and latency of the start-hook apply path against a fake API
+server with injected latency, conflicts, throttling and errors."""
+
+import os
+import time
+import pytest
+from ops.testing import Harness
+from charm import OPAManagerCharm
+from conftest import measure, record
+from tests.fake_apiserver import Faults
+import utils
+
+OBJECTS = 40
+
+
+def _configs(count):
+    return [
+        {
+            "group": "config.gatekeeper.sh",
+            "version": "v1alpha1",
+            "plural": "configs",
+            "namespace": "benchmark-model",
+            "body": {
+                "apiVersion": "config.gatekeeper.sh/v1alpha1",
+                "kind": "Config",
+                "metadata": {"name": f"config-{i}"},
+                "spec": {"sync": {"syncOnly": []}},
+            },
+        }
+        for i in range(count)
+    ]
+
+
+def _apply(name, k8s_objects, **kwargs):
+    utils.api_stats.reset()
+    started = time.perf_counter()
+    results = utils.apply_k8s_objects("benchmark-model", k8s_objects, **kwargs)
+    wall = time.perf_counter() - started
+    latencies = sorted(r.latency for r in results)
+    record(
+        name,
+        objects=len(results),
+        failed=sum(1 for r in results if r.status == "failed"),
+        wall_ms=round(wall * 1000, 3),
+        objects_per_second=round(len(results) / wall, 1),
+        p50_ms=round(latencies[len(latencies) // 2] * 1000, 3),
+        p95_ms=round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+        api_calls=utils.api_stats.calls,
+        retries=utils.api_stats.retries,
+        throttled_s=round(utils.api_stats.throttled_seconds, 3),
+    )
+    return results
+
+
+@pytest.mark.parametrize("workers", [1, 8])
+def test_apply_throughput(fake_apiserver, workers):
+    fake_apiserver.faults = Faults(latency=0.01)
+
+    results = _apply(
+        f"apply.latency_10ms.workers_{workers}",
+        _configs(OBJECTS),
+        action="apply",
+        max_workers=workers,
+    )
+
+    assert all(r.status == "applied" for r in results)
+    assert len(fake_apiserver.objects) == OBJECTS
+
+
+def test_apply_unchanged(fake_apiserver):
+    fake_apiserver.faults = Faults(latency=0.01)
+    utils.apply_k8s_objects("benchmark-model", _configs(OBJECTS), action="apply")
+    writes = fake_apiserver.requests.get("PATCH", 0)
+
+    results = _apply("apply.unchanged", _configs(OBJECTS), action="apply")
+
+    assert all(r.status == "unchanged" for r in results)
+    assert fake_apiserver.requests["PATCH"] == writes
+
+
+def test_create_conflicts(fake_apiserver):
+    fake_apiserver.faults = Faults(conflict_rate=1.0)
+
+    results = _apply("create.conflict_100pct", _configs(OBJECTS), action="create")
+
+    # "already exists" is how create recovers from partially failed setups
+    assert all(r.status == "ok" for r in results)
+
+
+def test_apply_throttled(fake_apiserver):
+    fake_apiserver.faults = Faults(throttle_rate=0.1, retry_after=1)
+
+    results = _apply("apply.throttle_10pct", _configs(OBJECTS), action="apply")
+
+    assert fake_apiserver.throttled > 0
+    assert all(r.status == "applied" for r in results)
+    assert utils.api_stats.throttled == fake_apiserver.throttled
+
+
+def test_apply_rate_limited(fake_apiserver):
+    utils.configure_client(qps=50, burst=5)
+
+    _apply("apply.client_qps_50", _configs(OBJECTS), action="apply")
+
+    # two calls per object, all but the burst paced at 50 per second
+    assert utils.api_stats.throttled_seconds > (2 * OBJECTS - 5) / 50 * 0.9
+
+
+def test_apply_errors(fake_apiserver):
+    fake_apiserver.faults = Faults(error_rate=0.1)
+
+    results = _apply("apply.error_10pct", _configs(OBJECTS), action="apply")
+
+    assert all(r.status == "applied" for r in results)
+    assert utils.api_stats.retries > 0
+
+
+def test_start_hook_slow_apiserver(fake_apiserver):
+    os.environ["JUJU_MODEL_NAME"] = "benchmark-model"
+    fake_apiserver.faults = Faults(latency=0.05)
+    harness = Harness(OPAManagerCharm)
+    harness.set_leader(True)
+    harness.begin()
+
+    result = measure(harness, "start.latency_50ms", harness.charm.on.start.emit)
+    harness.cleanup()
+
+    assert result["api_calls"] == fake_apiserver.request_count
@@ -0,0 +1,246 @@
+"""Hook performance of the manager charm under ops.testing.Harness."""
+
+import os
+import pytest
+from ops.testing import Harness
+from charm import OPAManagerCharm
+from conftest import measure
+from constraints import CONSTRAINTS_API, TEMPLATES_COLLECTION as TEMPLATES
+from tests.fake_apiserver import Faults
+
+LATENCY = 0.05
+
+
+@pytest.fixture
+def harness():
+    os.environ["JUJU_MODEL_NAME"] = "benchmark-model"
+    harness = Harness(OPAManagerCharm)
+    harness.add_oci_resource("gatekeeper-image")
+    yield harness
+    harness.cleanup()
+
+
+def test_config_changed(harness):
+    harness.set_leader(True)
+    harness.begin()
+
+    cold = measure(
+        harness, "manager.config_changed.cold", harness.charm.on.config_changed.emit
+    )
+    cached = measure(
+        harness, "manager.config_changed.cached", harness.charm.on.config_changed.emit
+    )
+    changed = measure(
+        harness,
+        "manager.config_changed.changed",
+        lambda: harness.update_config({"imagePullPolicy": "IfNotPresent"}),
+    )
+
+    assert cold["set_spec_calls"] == 1
+    assert cached["set_spec_calls"] == 0
+    assert changed["set_spec_calls"] == 1
+
+
+def test_config_changed_crd_install(harness, fake_apiserver):
+    harness.set_leader(True)
+    harness.begin()
+    harness.update_config({"apiQPS": 0.0})
+
+    pod_spec = measure(
+        harness,
+        "manager.config_changed.crds_in_pod_spec",
+        lambda: harness.update_config({"imagePullPolicy": "IfNotPresent"}),
+    )
+    install = measure(
+        harness,
+        "manager.config_changed.crds_installed",
+        lambda: harness.update_config({"crdInstall": "api"}),
+    )
+    api = measure(
+        harness,
+        "manager.config_changed.crds_through_api",
+        lambda: harness.update_config({"imagePullPolicy": "Always"}),
+    )
+
+    crds = [p for p in fake_apiserver.objects if "customresourcedefinitions" in p]
+    assert len(crds) == 4
+    assert api["api_calls"] == 0 < install["api_calls"]
+    assert api["spec_bytes"] * 2 < pod_spec["spec_bytes"]
+
+
+def test_leader_elected(harness, fake_apiserver):
+    harness.begin()
+    harness.charm.on.config_changed.emit()
+
+    elected = measure(
+        harness, "manager.leader_elected", lambda: harness.set_leader(True)
+    )
+
+    assert elected["set_spec_calls"] == 1
+
+
+def test_start(harness, fake_apiserver):
+    relation_id = harness.add_relation("cluster", harness.model.app.name)
+    harness.update_config({"webhookMaxUnavailable": 1})
+    harness.set_leader(True)
+    harness.begin()
+
+    cold = measure(harness, "manager.start.cold", harness.charm.on.start.emit)
+    warm = measure(harness, "manager.start.warm", harness.charm.on.start.emit)
+
+    # the PSP, the gatekeeper Config and the webhook's PodDisruptionBudget
+    assert len(fake_apiserver.objects) == 3
+    assert warm["api_calls"] < cold["api_calls"]
+
+    harness.set_leader(False)
+    follower = measure(harness, "manager.start.follower", harness.charm.on.start.emit)
+    assert follower["api_calls"] == 0
+
+    # a unit that never applied anything takes over from the leader
+    harness.charm._stored.things = []
+    handover = measure(
+        harness, "manager.leader_elected.handover", lambda: harness.set_leader(True)
+    )
+    assert handover["api_calls"] == 0
+    assert len(harness.charm._stored.things) == 3
+
+    harness.update_relation_data(
+        relation_id, harness.model.app.name, {"fingerprint": "", "ledger": ""}
+    )
+    harness.set_leader(False)
+    harness.charm._stored.things = []
+    takeover = measure(
+        harness, "manager.leader_elected.takeover", lambda: harness.set_leader(True)
+    )
+    assert takeover["api_calls"] > handover["api_calls"]
+
+
+def _install_constraints(server, templates, per_template):
+    for t in range(templates):
+        template = f"policy{t}"
+        server.objects[f"{TEMPLATES}/{template}"] = {
+            "kind": "ConstraintTemplate",
+            "metadata": {"name": template, "resourceVersion": "1"},
+        }
+        for c in range(per_template):
+            name = f"{template}-{c}"
+            server.objects[f"{CONSTRAINTS_API}/{template}/{name}"] = {
+                "kind": f"Policy{t}",
+                "metadata": {"name": name, "resourceVersion": "1"},
+                "spec": {"match": {"kinds": [{"apiGroups": [""], "kinds": ["Pod"]}]}},
+            }
+
+
+def test_update_status(harness, fake_apiserver):
+    harness.set_leader(True)
+    harness.begin()
+    harness.update_config(
+        {
+            "webhookMatchConstraints": True,
+            "webhookAntiAffinity": "preferred",
+            "webhookMaxUnavailable": 1,
+        }
+    )
+    app_name = harness.charm.app.name
+    deployment = f"/apis/apps/v1/namespaces/benchmark-model/deployments/{app_name}"
+    fake_apiserver.objects[deployment] = {
+        "kind": "Deployment",
+        "metadata": {"name": app_name, "resourceVersion": "1"},
+        "spec": {"template": {"spec": {"containers": [{"name": "manager"}]}}},
+    }
+    _install_constraints(fake_apiserver, templates=5, per_template=10)
+
+    cold = measure(
+        harness, "manager.update_status.cold", harness.charm.on.update_status.emit
+    )
+    warm = measure(
+        harness, "manager.update_status.warm", harness.charm.on.update_status.emit
+    )
+
+    rules = harness.get_pod_spec()[0]["kubernetesResources"][
+        "validatingWebhookConfigurations"
+    ][0]["webhooks"][0]["rules"]
+    assert ([""], ["pods"]) in [(r["apiGroups"], r["resources"]) for r in rules]
+    template = fake_apiserver.objects[deployment]["spec"]["template"]["spec"]
+    assert "podAntiAffinity" in template["affinity"]
+    assert cold["set_spec_calls"] == 1
+    assert warm["set_spec_calls"] == 0
+    # warm: one GET of the Deployment, one metadata list per constraint
+    # collection and one watch per collection of PSPs and Configs; the CRDs
+    # are in the pod spec, so Juju's to repair
+    assert warm["api_calls"] == 11
+
+
+def test_update_status_drift(harness, fake_apiserver):
+    harness.set_leader(True)
+    harness.begin()
+    harness.update_config({"apiQPS": 0.0})
+    harness.charm.on.start.emit()
+    harness.charm.on.update_status.emit()
+    psp = "/apis/policy/v1beta1/podsecuritypolicies/gatekeeper-admin"
+    assert psp in fake_apiserver.objects
+
+    runs = {}
+    for others in (10, 1000):
+        for i in range(len(fake_apiserver.objects), others):
+            fake_apiserver.handle(
+                "POST",
+                "/apis/policy/v1beta1/podsecuritypolicies",
+                {},
+                "application/json",
+                {"kind": "PodSecurityPolicy", "metadata": {"name": f"other-{i}"}},
+            )
+        harness.charm.on.update_status.emit()
+        runs[others] = measure(
+            harness,
+            f"manager.update_status.drift_check.{others}",
+            harness.charm.on.update_status.emit,
+        )
+    # only the events since the last update-status are transferred
+    assert runs[1000]["api_calls"] == runs[10]["api_calls"]
+
+    fake_apiserver.handle(
+        "PATCH",
+        psp,
+        {},
+        "application/merge-patch+json",
+        {"spec": {"allowPrivilegeEscalation": True}},
+    )
+    repaired = measure(
+        harness,
+        "manager.update_status.drift_repair",
+        harness.charm.on.update_status.emit,
+    )
+    assert fake_apiserver.objects[psp]["spec"]["allowPrivilegeEscalation"] is False
+    assert repaired["api_calls"] > runs[1000]["api_calls"]
+
+
+def test_stop_teardown(harness, fake_apiserver):
+    relation_id = harness.add_relation("cluster", harness.model.app.name)
+    harness.set_leader(True)
+    harness.begin()
+    harness.update_config({"apiQPS": 0.0, "crdInstall": "api"})
+    harness.charm.on.start.emit()
+    webhook_configuration = (
+        "/apis/admissionregistration.k8s.io/v1/validatingwebhookconfigurations/"
+        "benchmark-model-gatekeeper-validating-webhook-configuration"
+    )
+    fake_apiserver.objects[webhook_configuration] = {
+        "kind": "ValidatingWebhookConfiguration",
+        "metadata": {"name": webhook_configuration.rsplit("/", 1)[1]},
+    }
+    objects = sum(len(group) for group in harness.charm._teardown_objects())
+    fake_apiserver.faults = Faults(latency=LATENCY)
+
+    harness.set_planned_units(0)
+    teardown = measure(
+        harness,
+        "manager.stop.teardown",
+        lambda: harness.remove_relation(relation_id),
+    )
+
+    assert fake_apiserver.objects == {}
+    # one delete per object, absent ones included, in four concurrent rounds:
+    # the webhook configuration, the namespaced objects, the PSP, the CRDs
+    assert teardown["api_calls"] == objects
+    assert teardown["wall_ms"] < objects * LATENCY * 1000
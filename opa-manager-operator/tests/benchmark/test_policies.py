@@ -0,0 +1,101 @@
+"""Loading policy bundles through the load-policies action."""
+
+import os
+import tracemalloc
+from unittest.mock import Mock
+
+import pytest
+import yaml
+from ops.testing import Harness
+from charm import OPAManagerCharm
+from conftest import measure, record
+import policies
+
+TEMPLATE = """\
+apiVersion: templates.gatekeeper.sh/v1beta1
+kind: ConstraintTemplate
+metadata:
+  name: {name}
+spec:
+  crd:
+    spec:
+      names:
+        kind: {kind}
+  targets:
+    - target: admission.k8s.gatekeeper.sh
+      rego: |
+        package {name}
+        violation[{{"msg": msg}}] {{
+          not input.review.object.metadata.labels[input.parameters.label]
+          msg := sprintf("missing label %v", [input.parameters.label])
+        }}
+"""
+
+
+def _write_bundle(path, templates, per_template):
+    with open(path, "w") as fh:
+        for t in range(templates):
+            kind = f"RequiredLabel{t}"
+            fh.write("---\n" + TEMPLATE.format(name=kind.lower(), kind=kind))
+            for c in range(per_template):
+                constraint = {
+                    "apiVersion": "constraints.gatekeeper.sh/v1beta1",
+                    "kind": kind,
+                    "metadata": {"name": f"{kind.lower()}-{c}"},
+                    "spec": {
+                        "match": {"kinds": [{"apiGroups": [""], "kinds": ["Pod"]}]},
+                        "parameters": {"label": f"label-{c}"},
+                    },
+                }
+                fh.write("---\n" + yaml.safe_dump(constraint))
+            # bundles assembled from several sources repeat policies
+            fh.write("---\n" + TEMPLATE.format(name=kind.lower(), kind=kind))
+
+
+@pytest.fixture
+def harness():
+    os.environ["JUJU_MODEL_NAME"] = "benchmark-model"
+    harness = Harness(OPAManagerCharm)
+    harness.add_oci_resource("gatekeeper-image")
+    harness.set_leader(True)
+    harness.begin()
+    # measure the server, not the charm's client-side rate limit
+    harness.update_config({"apiQPS": 0.0})
+    yield harness
+    harness.cleanup()
+
+
+def test_load_policies(harness, fake_apiserver, tmp_path):
+    bundle = tmp_path / "bundle.yaml"
+    _write_bundle(bundle, templates=100, per_template=5)
+    event = Mock(params={"bundle": str(bundle), "batch-size": 20})
+
+    measure(
+        harness,
+        "manager.load_policies.600",
+        lambda: harness.charm._on_load_policies_action(event),
+    )
+
+    results = event.set_results.call_args[0][0]
+    assert results["statuses"] == "600 applied"
+    assert results["duplicates"] == 100
+    event.fail.assert_not_called()
+
+
+def test_bundle_parsing_memory(tmp_path):
+    peaks = {}
+    for templates in (10, 100):
+        bundle = tmp_path / f"bundle-{templates}.yaml"
+        _write_bundle(bundle, templates, per_template=5)
+        tracemalloc.start()
+        with open(bundle, "rb") as stream:
+            count = sum(1 for _ in policies.documents(stream))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert count == templates * 7
+        peaks[templates] = record(
+            f"manager.parse_bundle.{count}", peak_kib=round(peak / 1024, 1)
+        )["peak_kib"]
+
+    # parsing streams: ten times the policies, not ten times the memory
+    assert peaks[100] < 1.5 * peaks[10]
@@ -0,0 +1,355 @@
+"""In-process fake Kubernetes API server.
+
+Serves the endpoints the charms use (CRDs, custom objects, PSPs, RBAC and
+any other /api or /apis resource, plus discovery of a few core and apps
+resources) from memory, with injectable latency, throttling, conflicts and
+errors, so that the apply path can be measured without a cluster. Like
+gatekeeper, it creates the constraint CRD of every ConstraintTemplate stored.
+
+Watches are answered from a log of the last event_window events at once,
+rather than held open for timeoutSeconds; a watch from a resourceVersion
+older than the log gets the 410 Gone error event of a real server.
+"""
+
+import copy
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from kubernetes import client
+
+CRD_COLLECTION = "/apis/apiextensions.k8s.io/v1beta1/customresourcedefinitions"
+
+
+class Faults(object):
+    """Faults injected into requests.
+
+    latency is added to every request (seconds). throttle_rate, conflict_rate
+    and error_rate are the probabilities of answering 429 (with Retry-After),
+    409 (writes only) or error_code (500 by default) instead of serving the
+    request.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        throttle_rate=0.0,
+        retry_after=1,
+        conflict_rate=0.0,
+        error_rate=0.0,
+        error_code=500,
+        seed=0,
+    ):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.conflict_rate = conflict_rate
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def roll(self, rate):
+        with self._lock:
+            return rate > 0 and self._random.random() < rate
+
+
+ALL_VERBS = ["create", "delete", "get", "list", "patch", "update", "watch"]
+
+# Discovery documents served for the core and apps groups
+DISCOVERY = {
+    "v1": [
+        ("configmaps", "ConfigMap"),
+        ("events", "Event"),
+        ("namespaces", "Namespace"),
+        ("pods", "Pod"),
+        ("secrets", "Secret"),
+        ("services", "Service"),
+    ],
+    "apps/v1": [("deployments", "Deployment"), ("statefulsets", "StatefulSet")],
+}
+
+
+def _discovery():
+    documents = {
+        "/apis": {
+            "kind": "APIGroupList",
+            "groups": [
+                {
+                    "name": "apps",
+                    "preferredVersion": {"groupVersion": "apps/v1", "version": "v1"},
+                }
+            ],
+        }
+    }
+    for group_version, resources in DISCOVERY.items():
+        path = "/api/v1" if group_version == "v1" else f"/apis/{group_version}"
+        documents[path] = {
+            "kind": "APIResourceList",
+            "groupVersion": group_version,
+            "resources": [
+                {"name": name, "kind": kind, "namespaced": True, "verbs": ALL_VERBS}
+                for name, kind in resources
+            ],
+        }
+    return documents
+
+
+def _now():
+    return datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _merge(live, patch):
+    for key, value in patch.items():
+        if isinstance(value, dict) and isinstance(live.get(key), dict):
+            _merge(live[key], value)
+        elif value is None:
+            live.pop(key, None)
+        else:
+            live[key] = value
+    return live
+
+
+def _status(code, reason, message=""):
+    return code, {
+        "kind": "Status",
+        "apiVersion": "v1",
+        "status": "Failure",
+        "reason": reason,
+        "message": message,
+        "code": code,
+    }
+
+
+class FakeApiServer(object):
+    """A threaded HTTP server holding objects keyed by their API path."""
+
+    def __init__(self, faults=None, event_window=1000):
+        self.faults = faults or Faults()
+        self.objects = {}
+        self.events = deque()
+        self.event_window = event_window
+        self.compacted = 0
+        self.discovery = _discovery()
+        self.requests = {}
+        self.throttled = 0
+        self._version = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address
+        return f"http://{host}:{port}"
+
+    def configuration(self):
+        """Client configuration pointing at this server."""
+        configuration = client.Configuration()
+        configuration.host = self.url
+        return configuration
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    @property
+    def request_count(self):
+        return sum(self.requests.values())
+
+    @staticmethod
+    def _split(path):
+        """Return (collection, name) for an API path."""
+        parts = path.strip("/").split("/")
+        prefix = 2 if parts[0] == "api" else 3
+        rest = parts[prefix:]
+        if rest[:1] == ["namespaces"] and len(rest) >= 3:
+            head, rest = parts[: prefix + 2], rest[2:]
+        else:
+            head = parts[:prefix]
+        if len(rest) == 1:
+            return "/" + "/".join(head + rest), None
+        return "/" + "/".join(head + rest[:1]), rest[1]
+
+    def _next_version(self):
+        self._version += 1
+        return str(self._version)
+
+    def _store(self, path, obj, created):
+        metadata = obj.setdefault("metadata", {})
+        metadata["resourceVersion"] = self._next_version()
+        if created:
+            metadata.setdefault("uid", f"uid-{metadata['resourceVersion']}")
+            metadata["creationTimestamp"] = _now()
+        if obj.get("kind") == "CustomResourceDefinition":
+            spec = obj.get("spec", {})
+            obj["status"] = {
+                "acceptedNames": spec.get("names", {}),
+                "storedVersions": [spec.get("version", "v1")],
+                "conditions": [{"type": "Established", "status": "True"}],
+            }
+        self.objects[path] = obj
+        self._record("ADDED" if created else "MODIFIED", path, obj)
+        if obj.get("kind") == "ConstraintTemplate":
+            self._generate_constraint_crd(obj)
+        return obj
+
+    def _record(self, event_type, path, obj):
+        version = int(obj["metadata"]["resourceVersion"])
+        self.events.append((version, event_type, path, copy.deepcopy(obj)))
+        while len(self.events) > self.event_window:
+            self.compacted = self.events.popleft()[0]
+
+    def _watch(self, collection, query):
+        since = int(query.get("resourceVersion", ["0"])[0] or 0)
+        if since < self.compacted:
+            _, status = _status(410, "Expired", f"too old resource version: {since}")
+            events = [{"type": "ERROR", "object": status}]
+        else:
+            events = [
+                {"type": event_type, "object": obj}
+                for version, event_type, path, obj in self.events
+                if version > since and path.rsplit("/", 1)[0] == collection
+            ]
+        return 200, "".join(json.dumps(event) + "\n" for event in events)
+
+    def _generate_constraint_crd(self, template):
+        """Create the constraint CRD of a template, as gatekeeper does."""
+        kind = template["spec"]["crd"]["spec"]["names"]["kind"]
+        name = f"{kind.lower()}.constraints.gatekeeper.sh"
+        crd = {
+            "apiVersion": "apiextensions.k8s.io/v1beta1",
+            "kind": "CustomResourceDefinition",
+            "metadata": {"name": name},
+            "spec": {"names": {"kind": kind}, "version": "v1beta1"},
+        }
+        self._store(f"{CRD_COLLECTION}/{name}", crd, created=True)
+
+    def handle(self, method, path, query, content_type, body):
+        """Serve one request, returning (status code, JSON body, headers)."""
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+        if self.faults.latency:
+            time.sleep(self.faults.latency)
+        if self.faults.roll(self.faults.throttle_rate):
+            with self._lock:
+                self.throttled += 1
+            code, payload = _status(429, "TooManyRequests", "throttled")
+            return code, payload, {"Retry-After": str(self.faults.retry_after)}
+        if self.faults.roll(self.faults.error_rate):
+            code, payload = _status(
+                self.faults.error_code, "InternalError", "injected error"
+            )
+        elif method != "GET" and self.faults.roll(self.faults.conflict_rate):
+            code, payload = _status(409, "Conflict", "injected conflict")
+        elif method == "GET" and path in self.discovery:
+            code, payload = 200, self.discovery[path]
+        else:
+            collection, name = self._split(path)
+            with self._lock:
+                if name is None:
+                    code, payload = self._collection(method, collection, query, body)
+                else:
+                    code, payload = self._object(
+                        method, f"{collection}/{name}", content_type, body
+                    )
+        return code, payload, {}
+
+    def _collection(self, method, collection, query, body):
+        if method == "POST":
+            path = f"{collection}/{body['metadata']['name']}"
+            if path in self.objects:
+                return _status(409, "AlreadyExists", path)
+            return 201, self._store(path, body, created=True)
+        if method != "GET":
+            return _status(405, "MethodNotAllowed", method)
+        if query.get("watch") == ["true"]:
+            return self._watch(collection, query)
+
+        names = sorted(
+            path for path in self.objects if path.rsplit("/", 1)[0] == collection
+        )
+        start = int(query.get("continue", ["0"])[0] or 0)
+        limit = int(query.get("limit", ["0"])[0] or 0) or len(names)
+        page = names[start:][:limit]
+        metadata = {"resourceVersion": str(self._version)}
+        if start + limit < len(names):
+            metadata["continue"] = str(start + limit)
+        items = [self.objects[path] for path in page]
+        return 200, {"kind": "List", "metadata": metadata, "items": items}
+
+    def _object(self, method, path, content_type, body):
+        live = self.objects.get(path)
+        if method == "GET":
+            return (200, live) if live else _status(404, "NotFound", path)
+        if method == "DELETE":
+            if not live:
+                return _status(404, "NotFound", path)
+            del self.objects[path]
+            live["metadata"]["resourceVersion"] = self._next_version()
+            self._record("DELETED", path, live)
+            return 200, {"kind": "Status", "status": "Success"}
+        if method == "PUT":
+            if not live:
+                return _status(404, "NotFound", path)
+            return 200, self._store(path, body, created=False)
+        if method == "PATCH":
+            if content_type.startswith("application/apply-patch"):
+                if not live:
+                    return 201, self._store(path, body, created=True)
+            elif not live:
+                return _status(404, "NotFound", path)
+            if isinstance(body, list):
+                # JSON patches are accepted but not interpreted
+                return 200, live
+            return 200, self._store(path, _merge(copy.deepcopy(live), body), False)
+        return _status(405, "MethodNotAllowed", method)
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _serve(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                body = json.loads(raw) if raw else None
+                code, payload, headers = server.handle(
+                    self.command,
+                    url.path,
+                    parse_qs(url.query),
+                    self.headers.get("Content-Type", ""),
+                    body,
+                )
+                if isinstance(payload, str):
+                    # watch events, one JSON document per line
+                    data = payload.encode()
+                else:
+                    data = json.dumps(payload).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
+
+        return Handler
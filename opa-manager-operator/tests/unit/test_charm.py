@@ -1,9 +1,11 @@
+import json
 import unittest
 import os
 from unittest.mock import patch
 from ops.testing import Harness
 from pathlib import Path
 from charm import OPAManagerCharm
+import utils
 
 
 class TestCharm(unittest.TestCase):
@@ -59,3 +61,302 @@ class TestCharm(unittest.TestCase):
         harness.begin()
 
         assert harness.charm._configure_pod() is None
+
+    def test_configure_pod_spec_cache(self):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-spec-cache"
+        harness.add_oci_resource("gatekeeper-image")
+        harness.set_leader(True)
+        harness.begin()
+
+        harness.charm._configure_pod()
+        spec, _ = harness.get_pod_spec()
+        assert spec["containers"][0]["name"] == "manager"
+
+        with patch.object(harness.charm, "_build_pod_spec") as build:
+            harness.charm._configure_pod()
+        build.assert_not_called()
+        assert harness.charm._stored.spec_cache_hits == 1
+        assert harness.charm._stored.spec_cache_misses == 1
+
+    def test_configure_pod_skips_identical_spec(self):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-spec-cache"
+        harness.add_oci_resource("gatekeeper-image")
+        harness.set_leader(True)
+        harness.begin()
+
+        harness.charm._configure_pod()
+        harness.charm._stored.spec_fingerprint = None
+        with patch.object(harness.charm.model.pod, "set_spec") as set_spec:
+            harness.charm._configure_pod()
+        set_spec.assert_not_called()
+        assert harness.charm._stored.spec_cache_misses == 2
+
+    @patch.object(OPAManagerCharm, "_check_sync_budget")
+    @patch.object(OPAManagerCharm, "_scaling_objects", return_value=([], []))
+    @patch("utils.apply_k8s_objects")
+    def test_on_start(self, apply_k8s_objects, *_):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-on-start"
+        harness.set_leader(True)
+        harness.begin()
+        apply_k8s_objects.return_value = []
+
+        assert harness.charm._on_start({}) is None
+        namespace, k8s_objects = apply_k8s_objects.call_args[0]
+        assert namespace == "test-on-start"
+        assert [o.get("kind") or o["body"]["kind"] for o in k8s_objects] == [
+            "PodSecurityPolicy",
+            "Config",
+        ]
+
+    @patch.object(OPAManagerCharm, "_check_sync_budget")
+    @patch.object(OPAManagerCharm, "_scaling_objects", return_value=([], []))
+    @patch("utils.apply_k8s_objects")
+    def test_leader_publishes_applied_objects(self, apply_k8s_objects, *_):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-peers"
+        relation_id = harness.add_relation("cluster", harness.model.app.name)
+        harness.add_relation_unit(relation_id, f"{harness.model.app.name}/1")
+        harness.set_leader(True)
+        harness.begin()
+        apply_k8s_objects.side_effect = lambda namespace, objects, action: [
+            utils.ApplyResult(
+                utils.object_kind(o),
+                utils.object_name(o),
+                None,
+                1,
+                "applied",
+                0.1,
+                None,
+                "1",
+            )
+            for o in objects
+        ]
+
+        harness.charm.on.start.emit()
+        data = harness.get_relation_data(relation_id, harness.model.app.name)
+        k8s_objects = apply_k8s_objects.call_args[0][1]
+        assert data["fingerprint"] == utils.manifests_fingerprint(k8s_objects)
+        assert len(json.loads(data["ledger"])) == 2
+
+        # another unit only reads what the leader published
+        apply_k8s_objects.reset_mock()
+        harness.set_leader(False)
+        harness.charm.on.start.emit()
+        apply_k8s_objects.assert_not_called()
+
+    @patch.object(OPAManagerCharm, "_check_sync_budget")
+    @patch.object(OPAManagerCharm, "_scaling_objects", return_value=([], []))
+    @patch("utils.apply_k8s_objects")
+    def test_sync_resources_change_reapplies_config(
+        self, apply_k8s_objects, _, check_sync_budget
+    ):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-sync-change"
+        relation_id = harness.add_relation("cluster", harness.model.app.name)
+        harness.set_leader(True)
+        harness.begin()
+        apply_k8s_objects.return_value = []
+
+        harness.update_config({"imagePullPolicy": "IfNotPresent"})
+        apply_k8s_objects.assert_not_called()
+
+        harness.charm.on.start.emit()
+        harness.update_config({"imagePullPolicy": "Always"})
+        assert apply_k8s_objects.call_count == 1
+
+        harness.update_config({"syncResources": "v1/Namespace,apps/v1/Deployment"})
+        assert apply_k8s_objects.call_count == 2
+        sync_only = check_sync_budget.call_args[0][0]
+        assert [r["kind"] for r in sync_only] == ["Namespace", "Deployment"]
+        k8s_objects = apply_k8s_objects.call_args[0][1]
+        data = harness.get_relation_data(relation_id, harness.model.app.name)
+        assert data["fingerprint"] == utils.manifests_fingerprint(k8s_objects)
+
+    @patch.object(OPAManagerCharm, "_apply_cluster_objects")
+    def test_new_leader_adopts_published_ledger(self, apply_cluster_objects):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-peers"
+        harness.add_oci_resource("gatekeeper-image")
+        relation_id = harness.add_relation("cluster", harness.model.app.name)
+        harness.begin()
+        k8s_objects = harness.charm._cluster_objects()[0]
+        ledger = [utils.ledger_entry(o, "1") for o in k8s_objects]
+        harness.update_relation_data(
+            relation_id,
+            harness.model.app.name,
+            {
+                "fingerprint": utils.manifests_fingerprint(k8s_objects),
+                "ledger": json.dumps(ledger),
+            },
+        )
+
+        harness.set_leader(True)
+        apply_cluster_objects.assert_not_called()
+        assert harness.charm._stored.things == ledger
+
+        harness.update_relation_data(
+            relation_id, harness.model.app.name, {"fingerprint": "stale"}
+        )
+        harness.charm.on.leader_elected.emit()
+        apply_cluster_objects.assert_called_once()
+
+    @patch.object(OPAManagerCharm, "_check_sync_budget")
+    @patch.object(OPAManagerCharm, "_scaling_objects", return_value=([], []))
+    @patch("utils.apply_k8s_objects")
+    def test_first_leader_leaves_objects_to_start(self, apply_k8s_objects, *_):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-first-leader"
+        harness.add_oci_resource("gatekeeper-image")
+        harness.add_relation("cluster", harness.model.app.name)
+        harness.begin()
+        # the Config collection is only served once the pod spec is committed
+        apply_k8s_objects.side_effect = utils.ApiException(status=404)
+
+        harness.set_leader(True)
+        apply_k8s_objects.assert_not_called()
+
+        apply_k8s_objects.side_effect = None
+        apply_k8s_objects.return_value = []
+        harness.charm.on.start.emit()
+        apply_k8s_objects.assert_called_once()
+
+    @patch.object(OPAManagerCharm, "_apply_objects")
+    @patch("utils.detect_drift")
+    def test_reconcile_drift(self, detect_drift, apply_objects):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-drift"
+        harness.begin()
+        watched = {"/apis/policy/v1beta1/podsecuritypolicies": "7"}
+        detect_drift.return_value = ([], watched)
+
+        harness.charm._reconcile_drift()
+        k8s_objects, ledger, _ = detect_drift.call_args[0]
+        assert [utils.object_kind(o) for o in k8s_objects] == [
+            "PodSecurityPolicy",
+            "Config",
+        ]
+        assert harness.charm._stored.watched == watched
+        apply_objects.assert_not_called()
+
+        psp = k8s_objects[0]
+        detect_drift.return_value = ([psp], watched)
+        harness.charm._reconcile_drift()
+        assert detect_drift.call_args[0][2] == watched
+        apply_objects.assert_called_once_with([psp], changed=True)
+
+        # CRDs the charm installs are repaired too
+        harness.update_config({"crdInstall": "api"})
+        harness.charm._reconcile_drift()
+        k8s_objects = detect_drift.call_args[0][0]
+        assert [utils.object_kind(o) for o in k8s_objects] == [
+            "CustomResourceDefinition"
+        ] * 4 + ["PodSecurityPolicy", "Config"]
+
+        # an API error leaves the repair to the next update-status
+        detect_drift.side_effect = utils.ApiException(status=503)
+        harness.charm._reconcile_drift()
+        assert harness.charm._stored.watched == watched
+
+    @patch("utils._request")
+    @patch("utils.detect_drift")
+    def test_pod_spec_crds_not_reapplied(self, detect_drift, request):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-drift"
+        harness.begin()
+        # everything checked has drifted, and is missing from the cluster
+        detect_drift.side_effect = lambda k8s_objects, *_: (k8s_objects, {})
+
+        def serve(method, path, **kwargs):
+            if method == "GET":
+                raise utils.ApiException(status=404)
+            return {"metadata": {"resourceVersion": "1"}}
+
+        request.side_effect = serve
+
+        harness.charm._reconcile_drift()
+
+        patched = [c[0][1] for c in request.call_args_list if c[0][0] == "PATCH"]
+        assert patched
+        assert not [p for p in patched if "customresourcedefinitions" in p]
+
+    @patch("utils.delete_k8s_objects")
+    def test_teardown_on_application_removal(self, delete_k8s_objects):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "test-teardown"
+        relation_id = harness.add_relation("cluster", harness.model.app.name)
+        harness.set_leader(True)
+        harness.begin()
+        patcher = patch.object(OPAManagerCharm, "_configure_k8s_client")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        harness.set_planned_units(1)
+        harness.charm.on.stop.emit()
+        delete_k8s_objects.assert_not_called()
+
+        # scaling to 0 units leaves the CRDs, and the policies, alone
+        harness.update_config({"crdInstall": "api"})
+        harness.set_planned_units(0)
+        harness.charm.on.stop.emit()
+        harness.charm.on.remove.emit()
+        delete_k8s_objects.assert_not_called()
+        harness.update_config({"crdInstall": "pod-spec"})
+
+        def delete(groups, deadline):
+            return [
+                utils.ApplyResult(
+                    utils.object_kind(o),
+                    utils.object_name(o),
+                    None,
+                    tier,
+                    (
+                        "skipped"
+                        if utils.object_kind(o) == "PodSecurityPolicy"
+                        else "deleted"
+                    ),
+                    0.1,
+                    None,
+                    None,
+                )
+                for tier, group in enumerate(groups)
+                for o in group
+            ]
+
+        delete_k8s_objects.side_effect = delete
+        # the peer relation is only broken when the application is removed
+        harness.remove_relation(relation_id)
+
+        groups = delete_k8s_objects.call_args[0][0]
+        assert [[utils.object_kind(o) for o in group] for group in groups] == [
+            ["ValidatingWebhookConfiguration"],
+            ["Config", "PodDisruptionBudget", "HorizontalPodAutoscaler"],
+            ["PodSecurityPolicy"],
+        ]
+        assert utils.object_name(groups[0][0]) == (
+            "test-teardown-gatekeeper-validating-webhook-configuration"
+        )
+        assert delete_k8s_objects.call_args[1]["deadline"] == 30
+        assert harness.charm.unit.status.name == "blocked"
+        assert harness.charm.unit.status.message == (
+            "Left behind: PodSecurityPolicy/gatekeeper-admin"
+        )
+
+        # stop retries what was left behind, until nothing is
+        delete_k8s_objects.side_effect = lambda groups, deadline: []
+        harness.charm.on.stop.emit()
+        assert delete_k8s_objects.call_count == 2
+        harness.charm.on.remove.emit()
+        assert delete_k8s_objects.call_count == 2
@@ -0,0 +1,162 @@
+import os
+import unittest
+from unittest.mock import patch
+from ops.testing import Harness
+from charm import OPAManagerCharm
+import constraints
+import utils
+
+TEMPLATES = constraints.TEMPLATES_COLLECTION
+PODS_POLICY = {
+    "kind": "ExamplePolicy",
+    "metadata": {"name": "pods", "resourceVersion": "1"},
+    "spec": {"match": {"kinds": [{"apiGroups": [""], "kinds": ["Pod"]}]}},
+}
+
+
+def resource_versions(collections):
+    return lambda collection, resource_version=None: dict(collections[collection])
+
+
+class TestConstraintIndex(unittest.TestCase):
+    def test_match_kinds(self):
+        assert constraints.match_kinds(PODS_POLICY) == [["", "Pod"]]
+        assert constraints.match_kinds({"spec": {}}) == [["*", "*"]]
+        assert constraints.match_kinds(
+            {
+                "spec": {
+                    "match": {
+                        "kinds": [
+                            {"apiGroups": ["apps", ""], "kinds": ["Deployment"]},
+                            {"kinds": ["Pod"]},
+                        ]
+                    }
+                }
+            }
+        ) == [["", "Deployment"], ["*", "Pod"], ["apps", "Deployment"]]
+
+    @patch("utils.list_objects")
+    @patch("utils.list_resource_versions")
+    def test_refresh_lists_changed_collections_only(self, list_versions, list_objects):
+        collection = f"{constraints.CONSTRAINTS_API}/examplepolicy"
+        list_versions.side_effect = resource_versions(
+            {TEMPLATES: {"examplepolicy": "1"}, collection: {"pods": "1"}}
+        )
+        list_objects.return_value = [PODS_POLICY]
+
+        index, changes = constraints.refresh_index({})
+        assert changes == 1
+        assert index == {
+            "examplepolicy/pods": {"resourceVersion": "1", "kinds": [["", "Pod"]]}
+        }
+        list_versions.assert_called_with(collection, "0")
+
+        same, changes = constraints.refresh_index(index)
+        assert (same, changes) == (index, 0)
+        list_objects.assert_called_once_with(collection, "0")
+
+        list_versions.side_effect = resource_versions(
+            {TEMPLATES: {"examplepolicy": "1"}, collection: {}}
+        )
+        assert constraints.refresh_index(index) == ({}, 1)
+
+    def test_resolve_resources(self):
+        versions = {"": "v1", "apps": "apps/v1"}
+        kinds = {
+            "v1": {"Pod": "pods", "Service": "services"},
+            "apps/v1": {"Deployment": "deployments"},
+        }
+        discovered = []
+
+        def resource_kinds(version):
+            discovered.append(version)
+            return kinds[version]
+
+        def resolve(pairs):
+            return constraints.resolve_resources(
+                pairs, lambda: versions, resource_kinds
+            )
+
+        assert resolve({("", "Pod"), ("", "Service")}) == {
+            ("", "pods"),
+            ("", "services"),
+        }
+        assert discovered == ["v1"]
+        assert resolve({("*", "Deployment")}) == {("apps", "deployments")}
+        assert resolve({("batch", "Job"), ("", "Widget")}) == {
+            ("batch", "*"),
+            ("", "*"),
+        }
+        assert resolve({("*", "Widget")}) == {("*", "*")}
+        assert resolve({("*", "*"), ("", "Pod")}) == {("*", "*")}
+
+
+class TestCharmConstraintIndex(unittest.TestCase):
+    def setUp(self):
+        os.environ["JUJU_MODEL_NAME"] = "test-constraints"
+        self.harness = Harness(OPAManagerCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.add_oci_resource("gatekeeper-image")
+        self.harness.set_leader(True)
+        self.harness.begin()
+        patcher = patch.object(
+            OPAManagerCharm, "_scaling_objects", return_value=([], [])
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(OPAManagerCharm, "_apply_objects")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(OPAManagerCharm, "_reconcile_drift")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def validation_rules(self):
+        spec, _ = self.harness.get_pod_spec()
+        configuration = spec["kubernetesResources"]["validatingWebhookConfigurations"]
+        return [
+            (rule["apiGroups"], rule["resources"])
+            for rule in configuration[0]["webhooks"][0]["rules"]
+        ]
+
+    @patch("constraints.resolve_resources")
+    @patch("constraints.refresh_index")
+    def test_update_status_narrows_webhook(self, refresh_index, resolve_resources):
+        index = {"examplepolicy/pods": {"resourceVersion": "1", "kinds": [["", "Pod"]]}}
+        refresh_index.return_value = (index, 1)
+        resolve_resources.return_value = {("", "pods")}
+        self.harness.update_config({"webhookMatchConstraints": True})
+        assert self.validation_rules() == [(["*"], ["*"])]
+
+        self.harness.charm.on.update_status.emit()
+        assert self.validation_rules() == [
+            ([""], ["pods"]),
+            (["constraints.gatekeeper.sh"], ["*"]),
+            (["templates.gatekeeper.sh"], ["constrainttemplates"]),
+        ]
+
+        refresh_index.return_value = (index, 0)
+        self.harness.charm.on.update_status.emit()
+        resolve_resources.assert_called_once_with({("", "Pod")})
+
+    @patch("constraints.refresh_index")
+    def test_update_status_disabled(self, refresh_index):
+        self.harness.charm.on.update_status.emit()
+
+        refresh_index.assert_not_called()
+
+    @patch.object(OPAManagerCharm, "_load_configured_bundle")
+    @patch.object(OPAManagerCharm, "_publish_scrape_jobs")
+    @patch("constraints.refresh_index", side_effect=utils.ApiException(status=403))
+    def test_update_status_survives_listing_error(
+        self, refresh_index, publish_scrape_jobs, load_configured_bundle
+    ):
+        self.harness.update_config({"webhookMatchConstraints": True})
+        load_configured_bundle.reset_mock()
+
+        with self.assertLogs("charm", "WARNING"):
+            self.harness.charm.on.update_status.emit()
+        refresh_index.assert_called_once()
+        publish_scrape_jobs.assert_called_once()
+        load_configured_bundle.assert_called_once()
+        assert self.validation_rules() == [(["*"], ["*"])]
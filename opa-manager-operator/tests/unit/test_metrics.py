@@ -0,0 +1,127 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from ops.testing import Harness
+from charm import OPAManagerCharm
+import metrics
+import utils
+
+
+class TestMetrics(unittest.TestCase):
+    def test_scrape_jobs(self):
+        [job] = metrics.scrape_jobs("gk", "model")
+        assert job["static_configs"] == [{"targets": ["gk.model.svc:8888"]}]
+
+        [job] = metrics.scrape_jobs("gk", "model", {"b": "10.0.0.2", "a": "10.0.0.1"})
+        assert job["static_configs"] == [
+            {"targets": ["10.0.0.1:8888"], "labels": {"pod": "a"}},
+            {"targets": ["10.0.0.2:8888"], "labels": {"pod": "b"}},
+        ]
+
+    def test_hook_metrics(self):
+        stats = utils.ApiCallStats()
+        stats.record("GET", 0.25, False)
+        stats.record("GET", 0.5, True)
+        stats.record_retry(1.5, throttled=True)
+
+        text = metrics.hook_metrics({"hook": "update-status"}, 2.5, 100, stats)
+        lines = text.splitlines()
+        assert (
+            'gatekeeper_charm_hook_duration_seconds{hook="update-status"} 2.5' in lines
+        )
+        assert (
+            'gatekeeper_charm_hook_api_calls{hook="update-status",method="GET"} 2'
+            in lines
+        )
+        assert (
+            'gatekeeper_charm_hook_api_errors{hook="update-status",method="GET"} 1'
+            in lines
+        )
+        assert (
+            'gatekeeper_charm_hook_api_throttled_seconds{hook="update-status"} 1.5'
+            in lines
+        )
+        assert lines.count("# TYPE gatekeeper_charm_hook_api_calls gauge") == 1
+
+        text = metrics.hook_metrics({"unit": 'a"b'}, 1, 100)
+        assert 'gatekeeper_charm_hook_duration_seconds{unit="a\\"b"} 1' in text
+        assert "api" not in text
+
+    def test_write_textfile(self):
+        with tempfile.TemporaryDirectory() as directory:
+            name = metrics.textfile_name("gk/0", "config-changed")
+            metrics.write_textfile(directory, name, "m 1\n")
+
+            assert os.listdir(directory) == [
+                "gatekeeper_charm_gk_0_config-changed.prom"
+            ]
+            with open(os.path.join(directory, name)) as fh:
+                assert fh.read() == "m 1\n"
+
+    @patch("urllib.request.urlopen")
+    def test_push(self, urlopen):
+        metrics.push("http://gw:9091/", [("job", "j"), ("unit", "gk/0")], "m 1\n")
+
+        request = urlopen.call_args[0][0]
+        assert request.full_url == "http://gw:9091/metrics/job/j/unit/gk%2F0"
+        assert (request.method, request.data) == ("PUT", b"m 1\n")
+
+
+class TestCharmMetrics(unittest.TestCase):
+    def setUp(self):
+        os.environ["JUJU_MODEL_NAME"] = "test-metrics"
+        self.harness = Harness(OPAManagerCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.begin()
+        patcher = patch.object(OPAManagerCharm, "_configure_k8s_client")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def scrape_jobs(self, relation_id):
+        data = self.harness.get_relation_data(relation_id, self.harness.charm.app.name)
+        return json.loads(data["scrape_jobs"])
+
+    @patch("utils.pod_addresses")
+    def test_scrape_jobs_published(self, pod_addresses):
+        pod_addresses.return_value = {"gk-abc": "10.1.0.5"}
+        relation_id = self.harness.add_relation("metrics-endpoint", "prometheus")
+        self.harness.add_relation_unit(relation_id, "prometheus/0")
+
+        [job] = self.scrape_jobs(relation_id)
+        assert job["static_configs"][0]["targets"] == ["10.1.0.5:8888"]
+        pod_addresses.assert_called_once_with(
+            "test-metrics",
+            {
+                "control-plane": "controller-manager",
+                "gatekeeper.sh/operation": "webhook",
+                "gatekeeper.sh/system": "yes",
+            },
+        )
+
+        pod_addresses.side_effect = utils.ApiException(status=403)
+        self.harness.charm._publish_scrape_jobs()
+        [job] = self.scrape_jobs(relation_id)
+        assert job["static_configs"][0]["targets"] == [
+            f"{self.harness.charm.app.name}.test-metrics.svc:8888"
+        ]
+
+    def test_hook_metrics_written_on_commit(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.harness.update_config({"metricsTextfileDirectory": directory})
+            with patch.dict(os.environ, {"JUJU_HOOK_NAME": "update-status"}):
+                self.harness.charm.framework.on.commit.emit()
+
+            [name] = os.listdir(directory)
+            assert name.endswith("_update-status.prom")
+            with open(os.path.join(directory, name)) as fh:
+                assert "gatekeeper_charm_hook_duration_seconds{" in fh.read()
+
+    @patch("metrics.push", side_effect=OSError("unreachable"))
+    def test_push_failure_does_not_fail_hook(self, push):
+        self.harness.update_config({"metricsPushgatewayURL": "http://gw:9091"})
+
+        self.harness.charm.framework.on.commit.emit()
+        assert push.call_args[0][1][2] == ("hook", self.harness.charm._hook_name())
@@ -0,0 +1,77 @@
+import json
+import os
+import unittest
+import unittest.mock
+from pathlib import Path
+from ops.testing import Harness
+from charm import OPAManagerCharm
+
+IMAGE_DETAILS = {
+    "imagePath": "openpolicyagent/gatekeeper:v3.2.3",
+    "username": "",
+    "password": "",
+}
+
+
+class TestPodSpec(unittest.TestCase):
+    def test_pod_spec_matches_golden(self):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "golden-model"
+        harness.begin()
+
+        spec = harness.charm._build_pod_spec(IMAGE_DETAILS)
+
+        golden = Path("tests/unit/golden/pod-spec.json").read_text()
+        assert json.dumps(spec, indent=2, sort_keys=True) + "\n" == golden
+
+    def test_crds_inserted_by_reference(self):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "golden-model"
+        harness.begin()
+        crds = harness.charm._load_yaml_objects(["files/psp.yaml"])
+
+        with unittest.mock.patch.object(
+            harness.charm, "_load_yaml_objects", return_value=crds
+        ):
+            spec = harness.charm._build_pod_spec(IMAGE_DETAILS)
+
+        resources = spec["kubernetesResources"]["customResourceDefinitions"]
+        assert resources[0]["spec"] is crds[0]["spec"]
+
+    def test_crds_installed_through_api(self):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        os.environ["JUJU_MODEL_NAME"] = "golden-model"
+        harness.add_oci_resource("gatekeeper-image")
+        harness.set_leader(True)
+        harness.begin()
+        patches = {
+            "_configure_k8s_client": unittest.mock.DEFAULT,
+            "_apply_objects": unittest.mock.DEFAULT,
+        }
+        with unittest.mock.patch.multiple(
+            OPAManagerCharm, **patches
+        ) as mocks, unittest.mock.patch("utils.installed_crd_versions") as installed:
+            installed.return_value = {}
+            harness.update_config({"crdInstall": "api"})
+            spec, _ = harness.get_pod_spec()
+            assert "customResourceDefinitions" not in spec["kubernetesResources"]
+            [crds] = mocks["_apply_objects"].call_args[0]
+            version = crds[0]["metadata"]["labels"]["gatekeeper.juju.is/crd-version"]
+            assert [c["kind"] for c in crds] == ["CustomResourceDefinition"] * 4
+
+            # installed once per version of the CRD files
+            harness.update_config({"imagePullPolicy": "IfNotPresent"})
+            mocks["_apply_objects"].assert_called_once()
+            installed.assert_called_once()
+
+            # a new leader finds them installed
+            harness.charm._stored.crd_version = None
+            installed.return_value = {c["metadata"]["name"]: version for c in crds}
+            harness.charm._configure_pod()
+            mocks["_apply_objects"].assert_called_once()
+
+        harness.update_config({"crdInstall": "helm"})
+        assert harness.charm.unit.status.name == "blocked"
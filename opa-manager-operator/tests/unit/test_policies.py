@@ -0,0 +1,196 @@
+import io
+import os
+import sys
+import unittest
+from unittest.mock import Mock, patch
+import yaml
+from ops.testing import Harness
+from charm import OPAManagerCharm
+import policies
+import utils
+
+
+def template(kind):
+    return {
+        "apiVersion": "templates.gatekeeper.sh/v1beta1",
+        "kind": "ConstraintTemplate",
+        "metadata": {"name": kind.lower()},
+        "spec": {"crd": {"spec": {"names": {"kind": kind}}}},
+    }
+
+
+def constraint(kind, name):
+    return {
+        "apiVersion": "constraints.gatekeeper.sh/v1beta1",
+        "kind": kind,
+        "metadata": {"name": name},
+    }
+
+
+def bundle(*documents):
+    return io.BytesIO(yaml.safe_dump_all(documents).encode())
+
+
+def applied(namespace, k8s_objects, action, max_workers):
+    return [
+        utils.ApplyResult(
+            utils.object_kind(o),
+            utils.object_name(o),
+            None,
+            2,
+            "applied",
+            0.1,
+            None,
+            "1",
+        )
+        for o in k8s_objects
+    ]
+
+
+class TestLoadBundle(unittest.TestCase):
+    def test_policy_object(self):
+        obj = policies.policy_object(constraint("ExamplePolicy", "pods"))
+        assert (obj["group"], obj["version"], obj["plural"]) == (
+            "constraints.gatekeeper.sh",
+            "v1beta1",
+            "examplepolicy",
+        )
+        assert "namespace" not in obj
+        assert utils.object_path(obj) == (
+            "/apis/constraints.gatekeeper.sh/v1beta1/examplepolicy/pods"
+        )
+        assert policies.policy_object(template("ExamplePolicy"))["plural"] == (
+            "constrainttemplates"
+        )
+        for document in [
+            {"apiVersion": "v1", "kind": "Pod", "metadata": {"name": "p"}},
+            {"kind": "ExamplePolicy"},
+        ]:
+            with self.assertRaises(policies.PolicyBundleError):
+                policies.policy_object(document)
+
+    @patch("policies.wait_for_crd", return_value=True)
+    @patch("utils.apply_k8s_objects", side_effect=applied)
+    def test_templates_applied_before_their_constraints(self, apply, wait):
+        stream = bundle(
+            template("A"),
+            constraint("A", "a1"),
+            constraint("A", "a1"),
+            None,
+            constraint("A", "a2"),
+            template("B"),
+            template("A"),
+            constraint("B", "b1"),
+        )
+
+        results, duplicates = policies.load_bundle(stream, "model", batch_size=2)
+
+        assert duplicates == 2
+        batches = [
+            [utils.object_name(o) for o in call[0][1]] for call in apply.call_args_list
+        ]
+        assert batches == [["a"], ["a1", "a2"], ["b"], ["b1"]]
+        assert [w[0][0] for w in wait.call_args_list] == [
+            "a.constraints.gatekeeper.sh",
+            "b.constraints.gatekeeper.sh",
+        ]
+        assert [r.name for r in results] == ["a", "a1", "a2", "b", "b1"]
+
+    @patch("policies.wait_for_crd", return_value=False)
+    @patch("utils.apply_k8s_objects", side_effect=applied)
+    def test_constraints_of_missing_crd_fail(self, apply, wait):
+        stream = bundle(constraint("A", "a1"), constraint("A", "a2"))
+
+        results, _ = policies.load_bundle(stream, "model", crd_timeout=0)
+
+        assert [(r.name, r.status) for r in results] == [
+            ("a1", "failed"),
+            ("a2", "failed"),
+        ]
+        assert "a.constraints.gatekeeper.sh" in str(results[0].error)
+        wait.assert_called_once()
+        apply.assert_not_called()
+
+    @patch("utils.read_object")
+    def test_crd_established(self, read_object):
+        read_object.side_effect = utils.ApiException(status=404)
+        assert not policies.crd_established("a.constraints.gatekeeper.sh")
+
+        read_object.side_effect = None
+        read_object.return_value = {
+            "status": {"conditions": [{"type": "Established", "status": "True"}]}
+        }
+        assert policies.crd_established("a.constraints.gatekeeper.sh")
+        read_object.assert_called_with(
+            "/apis/apiextensions.k8s.io/v1beta1/customresourcedefinitions/"
+            "a.constraints.gatekeeper.sh"
+        )
+
+
+class TestCharmPolicies(unittest.TestCase):
+    def setUp(self):
+        os.environ["JUJU_MODEL_NAME"] = "test-policies"
+        self.harness = Harness(OPAManagerCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.add_oci_resource("gatekeeper-image")
+        self.harness.set_leader(True)
+        self.harness.begin()
+        patcher = patch.object(OPAManagerCharm, "_configure_k8s_client")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @patch("policies.open_bundle")
+    @patch("policies.load_bundle")
+    def test_action_reports_every_object(self, load_bundle, open_bundle):
+        ok = applied(None, [policies.policy_object(template("A"))], "apply", 1)
+        failed = policies._failed(policies.policy_object(constraint("A", "a")), "no")
+        load_bundle.return_value = (ok + [failed], 3)
+        event = Mock(params={"bundle": "/tmp/bundle.yaml", "batch-size": 5})
+
+        self.harness.charm._on_load_policies_action(event)
+
+        open_bundle.assert_called_once_with("/tmp/bundle.yaml")
+        assert load_bundle.call_args[1]["batch_size"] == 5
+        results = event.set_results.call_args[0][0]
+        assert results["objects"].splitlines() == [
+            "ConstraintTemplate/a applied 0.100s",
+            "A/a failed 0.000s no",
+        ]
+        assert results["statuses"] == "1 applied, 1 failed"
+        assert results["duplicates"] == 3
+        event.fail.assert_called_once_with("1 of 2 objects failed")
+
+    def test_action_needs_a_bundle(self):
+        event = Mock(params={"bundle": "", "batch-size": 20})
+
+        self.harness.charm._on_load_policies_action(event)
+        event.fail.assert_called_once()
+
+    @patch.object(OPAManagerCharm, "_load_policies")
+    def test_configured_bundle_loaded_once(self, load_policies):
+        load_policies.side_effect = OSError("No such file")
+        self.harness.update_config({"policyBundle": "/srv/policies.yaml"})
+        assert self.harness.charm.unit.status.name == "blocked"
+
+        load_policies.side_effect = None
+        load_policies.return_value = ([], 0, 0.1)
+        self.harness.charm._load_configured_bundle()
+        self.harness.charm._load_configured_bundle()
+        assert load_policies.call_count == 2
+        assert self.harness.charm._stored.policy_bundle == "/srv/policies.yaml"
+
+    @patch.object(OPAManagerCharm, "_load_policies")
+    def test_bundle_retry_clears_blocked_status(self, load_policies):
+        load_policies.side_effect = utils.ApiException(reason="connection refused")
+        self.harness.update_config({"policyBundle": "/srv/policies.yaml"})
+        assert self.harness.charm.unit.status.name == "blocked"
+
+        load_policies.side_effect = None
+        load_policies.return_value = ([], 0, 0.1)
+        self.harness.charm._load_configured_bundle()
+        assert self.harness.charm.unit.status.name == "active"
+
+    def test_no_bundle_loads_no_kubernetes_client(self):
+        # importing a module mapped to None raises ImportError
+        with patch.dict(sys.modules, {"policies": None, "utils": None}):
+            self.harness.charm._load_configured_bundle()
@@ -0,0 +1,231 @@
+import os
+import unittest
+from unittest.mock import patch
+from ops.model import ActiveStatus
+from ops.testing import Harness
+from charm import OPAManagerCharm
+import podspec
+import scaling
+import utils
+
+DEFAULTS = {
+    "webhookReplicas": 0,
+    "webhookAntiAffinity": "preferred",
+    "webhookMaxUnavailable": 1,
+    "webhookCPURequest": "100m",
+    "webhookMemoryRequest": "256Mi",
+    "webhookCPULimit": "1000m",
+    "webhookMemoryLimit": "512Mi",
+    "webhookAutoscaling": "none",
+    "webhookAutoscalingMinReplicas": 2,
+    "webhookAutoscalingMaxReplicas": 5,
+    "webhookAutoscalingTargetCPU": 80,
+    "webhookAutoscalingMetric": "gatekeeper_request_count",
+    "webhookAutoscalingMetricTarget": "20",
+}
+
+
+def settings(**options):
+    return scaling.settings_from_config(dict(DEFAULTS, **options))
+
+
+class TestScalingSettings(unittest.TestCase):
+    def test_invalid_options(self):
+        for options in [
+            {"webhookReplicas": -1},
+            {"webhookAntiAffinity": "sometimes"},
+            {"webhookCPURequest": "a lot"},
+            {"webhookAutoscaling": "cpu", "webhookCPURequest": ""},
+            {"webhookAutoscalingMinReplicas": 0},
+            {"webhookAutoscalingMinReplicas": 3, "webhookAutoscalingMaxReplicas": 2},
+            {"webhookAutoscalingMetricTarget": "fast"},
+        ]:
+            with self.assertRaises(scaling.ScalingConfigError, msg=options):
+                settings(**options)
+
+    def test_deployment_patch(self):
+        patch = scaling.deployment_patch("gk", "model", settings(webhookReplicas=3))
+
+        assert (patch["group"], patch["plural"], patch["namespace"]) == (
+            "apps",
+            "deployments",
+            "model",
+        )
+        spec = patch["body"]["spec"]
+        # Juju owns the replica count
+        assert "replicas" not in spec
+        pod = spec["template"]["spec"]
+        assert pod["containers"] == [
+            {
+                "name": "manager",
+                "resources": {
+                    "requests": {"cpu": "100m", "memory": "256Mi"},
+                    "limits": {"cpu": "1000m", "memory": "512Mi"},
+                },
+            }
+        ]
+        term = pod["affinity"]["podAntiAffinity"][
+            "preferredDuringSchedulingIgnoredDuringExecution"
+        ][0]["podAffinityTerm"]
+        assert term["labelSelector"]["matchLabels"] == podspec.WEBHOOK_POD_LABELS
+
+    def test_replicas_warning(self):
+        assert scaling.replicas_warning("gk", settings(), 1) is None
+        assert scaling.replicas_warning("gk", settings(webhookReplicas=3), 3) is None
+        assert scaling.replicas_warning("gk", settings(webhookReplicas=3), 1) == (
+            "webhookReplicas is 3 but there are 1 units: "
+            "run juju scale-application gk 3"
+        )
+        # the autoscaler sets the replicas
+        autoscaled = settings(webhookReplicas=3, webhookAutoscaling="cpu")
+        assert scaling.replicas_warning("gk", autoscaled, 1) is None
+
+    def test_deployment_patch_with_autoscaler(self):
+        patch = scaling.deployment_patch(
+            "gk",
+            "model",
+            settings(
+                webhookReplicas=3,
+                webhookAutoscaling="cpu",
+                webhookAntiAffinity="required",
+            ),
+        )
+
+        spec = patch["body"]["spec"]
+        assert "replicas" not in spec
+        assert "requiredDuringSchedulingIgnoredDuringExecution" in (
+            spec["template"]["spec"]["affinity"]["podAntiAffinity"]
+        )
+
+    def test_nothing_to_patch(self):
+        assert (
+            scaling.deployment_patch(
+                "gk",
+                "model",
+                settings(
+                    webhookAntiAffinity="none",
+                    webhookCPURequest="",
+                    webhookMemoryRequest="",
+                    webhookCPULimit="",
+                    webhookMemoryLimit="",
+                ),
+            )
+            is None
+        )
+
+    def test_budget_and_autoscaler(self):
+        k8s_objects, removed = scaling.budget_and_autoscaler("gk", "model", settings())
+        assert [utils.object_kind(o) for o in k8s_objects] == ["PodDisruptionBudget"]
+        assert k8s_objects[0]["body"]["spec"]["maxUnavailable"] == 1
+        assert [utils.object_path(o) for o in removed] == [
+            "/apis/autoscaling/v2beta2/namespaces/model/horizontalpodautoscalers/gk"
+        ]
+
+        k8s_objects, removed = scaling.budget_and_autoscaler(
+            "gk",
+            "model",
+            settings(webhookMaxUnavailable=0, webhookAutoscaling="metrics"),
+        )
+        hpa = k8s_objects[0]["body"]["spec"]
+        assert hpa["scaleTargetRef"]["name"] == "gk"
+        assert (hpa["minReplicas"], hpa["maxReplicas"]) == (2, 5)
+        assert hpa["metrics"][0]["pods"]["metric"]["name"] == (
+            "gatekeeper_request_count"
+        )
+        assert [utils.object_kind(o) for o in removed] == ["PodDisruptionBudget"]
+
+    def test_service_selects_every_webhook_pod(self):
+        spec = podspec.manager_pod_spec([], {}, "Always", [], "model")
+        resources = spec["kubernetesResources"]
+
+        assert resources["services"][0]["spec"]["selector"] == (
+            resources["pod"]["labels"]
+        )
+
+
+class TestCharmScaling(unittest.TestCase):
+    def setUp(self):
+        os.environ["JUJU_MODEL_NAME"] = "test-scaling"
+        self.harness = Harness(OPAManagerCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.set_leader(True)
+        self.harness.begin()
+
+    @patch("utils.get_live_object")
+    def test_deployment_patched_once_created(self, get_live_object):
+        # nothing is patched into Juju's Deployment unless asked for
+        k8s_objects, _ = self.harness.charm._scaling_objects()
+        get_live_object.assert_not_called()
+        assert k8s_objects == []
+
+        self.harness.update_config({"webhookAntiAffinity": "preferred"})
+        get_live_object.return_value = None
+        k8s_objects, _ = self.harness.charm._scaling_objects()
+        assert "Deployment" not in [utils.object_kind(o) for o in k8s_objects]
+
+        get_live_object.return_value = {"kind": "Deployment"}
+        k8s_objects, _ = self.harness.charm._scaling_objects()
+        assert utils.object_kind(k8s_objects[0]) == "Deployment"
+        assert utils.object_name(k8s_objects[0]) == self.harness.charm.app.name
+
+    @patch("utils.get_live_object", return_value=None)
+    @patch("utils.apply_k8s_objects")
+    @patch("utils.changed_objects", side_effect=lambda objects, ledger: objects)
+    def test_disabled_objects_deleted(self, _, apply_k8s_objects, __):
+        def apply(namespace, k8s_objects, action):
+            return [
+                utils.ApplyResult(
+                    utils.object_kind(o), "gk", namespace, 2, "ok", 0, None, "1"
+                )
+                for o in k8s_objects
+            ]
+
+        apply_k8s_objects.side_effect = apply
+        self.harness.update_config({"webhookMaxUnavailable": 1})
+        self.harness.charm._apply_objects(*self.harness.charm._scaling_objects())
+        assert [e["kind"] for e in self.harness.charm._stored.things] == [
+            "PodDisruptionBudget"
+        ]
+
+        self.harness.update_config({"webhookMaxUnavailable": 0})
+        k8s_objects, removed = self.harness.charm._scaling_objects()
+        self.harness.charm._apply_objects(k8s_objects, removed)
+
+        # only the budget was ever applied, so the autoscaler isn't deleted
+        apply_k8s_objects.assert_called_with(
+            "test-scaling", removed[:1], action="delete"
+        )
+        assert self.harness.charm._stored.things == []
+
+    @patch.object(OPAManagerCharm, "_reconcile_drift")
+    @patch.object(OPAManagerCharm, "_apply_objects")
+    @patch.object(OPAManagerCharm, "_scaling_objects", return_value=([], []))
+    @patch.object(OPAManagerCharm, "_configure_k8s_client")
+    def test_replica_count_conflict_reported(self, *_):
+        self.harness.update_config({"webhookReplicas": 2})
+        self.harness.set_planned_units(1)
+        self.harness.charm.unit.status = ActiveStatus()
+
+        self.harness.charm.on.update_status.emit()
+        assert self.harness.charm.unit.status.message.startswith(
+            "webhookReplicas is 2 but there are 1 units"
+        )
+
+        self.harness.set_planned_units(2)
+        self.harness.charm.on.update_status.emit()
+        assert self.harness.charm.unit.status == ActiveStatus()
+
+    @patch.object(OPAManagerCharm, "_publish_scrape_jobs")
+    @patch.object(OPAManagerCharm, "_reconcile_drift")
+    @patch("utils.get_live_object", side_effect=utils.ApiException(status=503))
+    @patch.object(OPAManagerCharm, "_configure_k8s_client")
+    def test_scaling_api_error_does_not_fail_update_status(
+        self, _, get_live_object, reconcile_drift, publish_scrape_jobs
+    ):
+        self.harness.update_config({"webhookCPURequest": "100m"})
+        with self.assertLogs("charm", "WARNING"):
+            self.harness.charm.on.update_status.emit()
+
+        get_live_object.assert_called_once()
+        reconcile_drift.assert_called_once()
+        publish_scrape_jobs.assert_called_once()
@@ -0,0 +1,147 @@
+import json
+import os
+import unittest
+from unittest.mock import Mock, patch
+from ops.testing import Harness
+from charm import OPAManagerCharm
+import manifests
+import sync
+
+POD = {"kind": "Pod", "metadata": {"name": "p", "namespace": "default"}}
+
+
+class TestSyncResources(unittest.TestCase):
+    def test_parse_sync_resources(self):
+        assert sync.parse_sync_resources(
+            "v1/Namespace, networking.k8s.io/v1/Ingress,"
+        ) == [
+            {"group": "", "version": "v1", "kind": "Namespace"},
+            {"group": "networking.k8s.io", "version": "v1", "kind": "Ingress"},
+        ]
+        assert sync.parse_sync_resources("") == []
+        for value in ["Pod", "v1/pods", "apps/1/Deployment", "a/b/v1/Pod"]:
+            with self.assertRaises(sync.SyncConfigError, msg=value):
+                sync.parse_sync_resources(value)
+
+    def test_config_renders_sync_only(self):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        for sync_only in [sync.parse_sync_resources("apps/v1/Deployment"), []]:
+            config = manifests.parse_yaml(
+                harness.charm._render_jinja_template(
+                    "files/sync.yaml.jinja2",
+                    {"namespace": "model", "sync_only": sync_only},
+                )
+            )
+            assert config["body"]["spec"]["sync"]["syncOnly"] == sync_only
+
+    @patch("utils.list_page")
+    def test_count_objects_uses_remaining_item_count(self, list_page):
+        list_page.return_value = {
+            "items": [POD, POD],
+            "metadata": {"continue": "t", "remainingItemCount": 98},
+        }
+
+        count, average, calls = sync.count_objects("/api/v1/pods", 500, 2)
+        assert (count, calls) == (100, 1)
+        assert average == len(json.dumps(POD, separators=(",", ":")))
+        list_page.assert_called_once_with("/api/v1/pods", 2)
+
+    @patch("utils.list_page")
+    def test_count_objects_follows_continue(self, list_page):
+        list_page.side_effect = [
+            {"items": [POD], "metadata": {"continue": "a"}},
+            {"items": [{}, {}], "metadata": {"continue": "b"}},
+            {"items": [{}], "metadata": {}},
+        ]
+
+        count, _, calls = sync.count_objects("/api/v1/pods", 2, 1)
+        assert (count, calls) == (4, 3)
+        list_page.assert_called_with("/api/v1/pods", 2, "b", metadata_only=True)
+
+    @patch("utils.list_page")
+    @patch("utils.api_resource_kinds")
+    def test_estimate(self, api_resource_kinds, list_page):
+        api_resource_kinds.return_value = {"Pod": "pods"}
+        list_page.return_value = {"items": [POD] * 10, "metadata": {}}
+
+        estimate = sync.estimate(sync.parse_sync_resources("v1/Pod,v1/Widget"))
+        pods, widgets = estimate["kinds"]
+        assert pods["count"] == 10
+        assert pods["estimated_bytes"] == (
+            10 * pods["average_bytes"] * sync.OPA_MEMORY_FACTOR
+        )
+        assert widgets["count"] == 0
+        assert estimate["estimated_bytes"] == pods["estimated_bytes"]
+        api_resource_kinds.assert_called_once_with("v1")
+
+    def test_budget_warning(self):
+        assert sync.budget_warning(200 * 1024 * 1024, "512Mi") is None
+        assert sync.budget_warning(300 * 1024 * 1024, "") is None
+        assert sync.budget_warning(300 * 1024 * 1024, "512Mi") == (
+            "Synced objects need ~300.0MiB, over the 256.0MiB cache budget"
+        )
+
+
+class TestCharmSync(unittest.TestCase):
+    def setUp(self):
+        os.environ["JUJU_MODEL_NAME"] = "test-sync"
+        self.harness = Harness(OPAManagerCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.add_oci_resource("gatekeeper-image")
+        self.harness.set_leader(True)
+        self.harness.begin()
+
+    def test_invalid_sync_resources_blocks(self):
+        self.harness.update_config({"syncResources": "pods"})
+
+        assert self.harness.charm.unit.status.name == "blocked"
+
+    @patch("sync.estimate")
+    def test_over_budget_warns_before_apply(self, estimate):
+        estimate.return_value = {"kinds": [], "estimated_bytes": 1073741824}
+        self.harness.update_config({"webhookMemoryLimit": "512Mi"})
+        statuses = []
+
+        def apply_objects(k8s_objects, removed=()):
+            statuses.append(self.harness.charm.unit.status)
+
+        with patch.object(OPAManagerCharm, "_configure_k8s_client"), patch.object(
+            OPAManagerCharm, "_scaling_objects", return_value=([], [])
+        ), patch.object(OPAManagerCharm, "_apply_objects", side_effect=apply_objects):
+            self.harness.charm.on.start.emit()
+
+        assert statuses[0].name == "active"
+        assert statuses[0].message.startswith("Synced objects need ~1.0GiB")
+        self.harness.charm._configure_pod()
+        assert self.harness.charm.unit.status.message == statuses[0].message
+
+    @patch("sync.estimate")
+    def test_estimate_action(self, estimate):
+        estimate.return_value = {
+            "kinds": [
+                {
+                    "group": "networking.k8s.io",
+                    "version": "v1",
+                    "kind": "Ingress",
+                    "count": 3,
+                    "average_bytes": 1000,
+                    "estimated_bytes": 15000,
+                    "list_calls": 1,
+                }
+            ],
+            "estimated_bytes": 15000,
+        }
+        event = Mock(params={"page-size": 100})
+
+        with patch.object(OPAManagerCharm, "_configure_k8s_client"):
+            self.harness.charm._on_estimate_sync_memory_action(event)
+
+        estimate.assert_called_once_with(
+            sync.parse_sync_resources("v1/Namespace,v1/Pod"), 100
+        )
+        results = event.set_results.call_args[0][0]
+        assert results["networking-k8s-io-v1-ingress"].startswith("3 objects")
+        assert results["estimated-memory"] == "14.6KiB"
+        assert results["over-budget"] is False
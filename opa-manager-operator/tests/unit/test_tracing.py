@@ -0,0 +1,118 @@
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+from ops.testing import Harness
+from charm import OPAManagerCharm
+import tracing
+
+
+class TestTracer(unittest.TestCase):
+    def setUp(self):
+        self.tracer = tracing.Tracer()
+        self.addCleanup(self.tracer.finish)
+
+    def test_spans_nest(self):
+        self.tracer.start("config-changed", unit="gk/0")
+        with self.tracer.span("build_pod_spec") as outer:
+            with self.tracer.span("load_yaml", path="a.yaml") as inner:
+                inner.set(bundled=True)
+        with self.assertRaises(ValueError):
+            with self.tracer.span("set_spec"):
+                raise ValueError("rejected")
+        root = self.tracer.finish()
+
+        trace = self.tracer.to_dict(application="gk")
+        assert (trace["application"], trace["name"]) == ("gk", "config-changed")
+        assert trace["attributes"] == {"unit": "gk/0"}
+        build, set_spec = trace["spans"]
+        assert build["spans"][0]["attributes"] == {"path": "a.yaml", "bundled": True}
+        assert set_spec["error"] == "ValueError: rejected"
+        assert outer.duration >= inner.duration
+        assert root.duration >= outer.duration
+        assert "alloc_kib" not in build
+
+        with self.tracer.span("after the hook"):
+            pass
+        assert len(root.children) == 2
+
+    def test_worker_thread_spans_attach_to_open_span(self):
+        self.tracer.start("start")
+
+        def work(i):
+            with self.tracer.span("apply_object", index=i):
+                pass
+
+        with self.tracer.span("apply_k8s_objects") as apply:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(work, range(8)))
+
+        assert len(apply.children) == 8
+        assert self.tracer.root.children == [apply]
+
+    def test_allocation_deltas(self):
+        self.tracer.start("start", trace_allocations=True)
+        with self.tracer.span("allocate") as span:
+            data = [bytearray(1024) for _ in range(100)]
+        self.tracer.finish()
+
+        assert span.allocated >= 100 * 1024
+        assert self.tracer.to_dict()["spans"][0]["alloc_kib"] >= 100
+        del data
+
+    def test_otlp(self):
+        self.tracer.start("update-status")
+        with self.tracer.span("apply_object", kind="Pod", calls=2):
+            pass
+        self.tracer.finish()
+
+        request = self.tracer.otlp("gk", **{"juju.unit": "gk/0"})
+        [resource_spans] = request["resourceSpans"]
+        assert {"key": "service.name", "value": {"stringValue": "gk"}} in (
+            resource_spans["resource"]["attributes"]
+        )
+        root, child = resource_spans["scopeSpans"][0]["spans"]
+        assert root["parentSpanId"] == ""
+        assert child["parentSpanId"] == root["spanId"]
+        assert child["traceId"] == root["traceId"] == self.tracer.trace_id
+        assert child["attributes"] == [
+            {"key": "calls", "value": {"intValue": "2"}},
+            {"key": "kind", "value": {"stringValue": "Pod"}},
+        ]
+        assert int(root["startTimeUnixNano"]) <= int(child["startTimeUnixNano"])
+        assert int(child["endTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+
+
+class TestCharmTracing(unittest.TestCase):
+    def test_trace_emitted_on_commit(self):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        harness.add_oci_resource("gatekeeper-image")
+        harness.set_leader(True)
+        os.environ["JUJU_MODEL_NAME"] = "test-tracing"
+        harness.begin()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "traces.jsonl")
+            harness.update_config({"traceOTLPFile": path})
+            with self.assertLogs("charm", "INFO") as logs:
+                harness.charm.framework.on.commit.emit()
+
+            line = [o for o in logs.output if "Hook trace: " in o][0]
+            trace = json.loads(line.split("Hook trace: ", 1)[1])
+            spans = [span["name"] for span in trace["spans"]]
+            assert "image_fetch" in spans and "build_pod_spec" in spans
+            with open(path) as fh:
+                [request] = [json.loads(line) for line in fh]
+            assert request["resourceSpans"][0]["scopeSpans"][0]["spans"]
+
+    @patch("tracing.append_json_line", side_effect=OSError("read-only"))
+    def test_export_failure_does_not_fail_hook(self, append_json_line):
+        harness = Harness(OPAManagerCharm)
+        self.addCleanup(harness.cleanup)
+        harness.begin()
+        harness.update_config({"traceOTLPFile": "/nonexistent/traces.jsonl"})
+
+        harness.charm.framework.on.commit.emit()
+        append_json_line.assert_called_once()
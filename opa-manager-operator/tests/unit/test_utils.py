@@ -0,0 +1,464 @@
+import json
+import time
+import unittest
+from unittest.mock import patch
+from kubernetes import client
+from kubernetes.client.rest import ApiException
+import utils
+from tests.fake_apiserver import FakeApiServer, Faults
+
+
+class TestKubeClientManager(unittest.TestCase):
+    def setUp(self):
+        patcher = patch("utils._load_kube_config")
+        self.load_kube_config = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(utils.configure_client, pool_maxsize=utils.DEFAULT_POOL_MAXSIZE)
+        utils.configure_client(configuration=None)
+
+    def test_get_api_reuses_client(self):
+        manager = utils.KubeClientManager(pool_maxsize=2)
+        manager.configure(configuration=client.Configuration())
+        policy_api = manager.api(client.PolicyV1beta1Api)
+
+        assert manager.api(client.PolicyV1beta1Api) is policy_api
+        assert manager.api(client.CustomObjectsApi).api_client is manager.api_client
+        assert manager.api_client.configuration.connection_pool_maxsize == 2
+
+    def test_config_loaded_once(self):
+        manager = utils.KubeClientManager()
+        manager.api(client.CustomObjectsApi)
+        manager.api(client.ApiextensionsV1beta1Api)
+
+        self.load_kube_config.assert_called_once()
+
+    def test_configure_drops_client(self):
+        manager = utils.KubeClientManager()
+        api_client = manager.api_client
+        manager.configure(pool_maxsize=8)
+
+        assert manager.api_client is not api_client
+        assert manager.api_client.configuration.connection_pool_maxsize == 8
+
+    @patch("utils.get_api")
+    def test_create_psp_uses_shared_client(self, get_api):
+        psp = {"apiVersion": "policy/v1beta1", "metadata": {"name": "psp"}}
+        utils.crud_pod_security_policy_with_api("ns", psp, "create")
+
+        get_api.assert_called_once_with(client.PolicyV1beta1Api)
+        get_api.return_value.create_pod_security_policy.assert_called_once()
+
+
+CRD = {
+    "apiVersion": "apiextensions.k8s.io/v1beta1",
+    "kind": "CustomResourceDefinition",
+    "metadata": {"name": "configs.config.gatekeeper.sh"},
+}
+PSP = {
+    "apiVersion": "policy/v1beta1",
+    "kind": "PodSecurityPolicy",
+    "metadata": {"name": "psp"},
+}
+CONFIG = {
+    "group": "config.gatekeeper.sh",
+    "version": "v1alpha1",
+    "plural": "configs",
+    "namespace": "ns",
+    "body": {"kind": "Config", "metadata": {"name": "config"}},
+}
+
+
+class TestApplyK8sObjects(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        handlers = {
+            "CustomResourceDefinition": lambda ns, obj, action: self.calls.append(
+                utils.object_name(obj)
+            ),
+            "PodSecurityPolicy": lambda ns, obj, action: self.calls.append(
+                utils.object_name(obj)
+            ),
+        }
+        for patcher in [
+            patch.dict(utils.ACTION_MAP, handlers),
+            patch(
+                "utils.crud_custom_object",
+                lambda ns, obj, action: self.calls.append(utils.object_name(obj)),
+            ),
+            patch("utils.wait_for_crds_established"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_objects_applied_in_tier_order(self):
+        results = utils.apply_k8s_objects("ns", [CONFIG, PSP, CRD])
+
+        assert self.calls == ["configs.config.gatekeeper.sh", "psp", "config"]
+        assert [r.tier for r in results] == [
+            utils.TIER_NAMESPACED,
+            utils.TIER_CLUSTER,
+            utils.TIER_CRD,
+        ]
+        assert all(r.status == "ok" for r in results)
+        utils.wait_for_crds_established.assert_called_once_with(
+            ["configs.config.gatekeeper.sh"], timeout=60
+        )
+
+    def test_failed_tier_skips_later_tiers(self):
+        def fail(ns, obj, action):
+            raise RuntimeError("boom")
+
+        with patch.dict(utils.ACTION_MAP, {"PodSecurityPolicy": fail}):
+            results = utils.apply_k8s_objects("ns", [CONFIG, PSP])
+
+        assert [r.status for r in results] == ["skipped", "failed"]
+        assert str(results[1].error) == "boom"
+        assert self.calls == []
+
+    def test_unsupported_kind_rejected(self):
+        with self.assertRaises(ValueError):
+            utils.apply_k8s_objects("ns", [{"kind": "Secret", "metadata": {}}])
+
+
+class TestServerSideApply(unittest.TestCase):
+    def setUp(self):
+        patcher = patch("utils._request")
+        self.request = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_object_path(self):
+        assert utils.object_path(PSP) == "/apis/policy/v1beta1/podsecuritypolicies/psp"
+        assert (
+            utils.object_path(CONFIG)
+            == "/apis/config.gatekeeper.sh/v1alpha1/namespaces/ns/configs/config"
+        )
+
+    def test_unchanged_object_not_patched(self):
+        live = dict(PSP, metadata={"name": "psp", "resourceVersion": "7"})
+        live["spec"] = {"defaulted": True}
+        desired = dict(PSP, spec={})
+        self.request.return_value = live
+
+        assert utils.server_side_apply("ns", desired) == ("unchanged", "7")
+        self.request.assert_called_once_with("GET", utils.object_path(PSP))
+
+    def test_changed_object_patched(self):
+        applied = dict(PSP, metadata={"name": "psp", "resourceVersion": "8"})
+        self.request.side_effect = [dict(PSP, spec={"a": 1}), applied]
+        desired = dict(PSP, spec={"a": 2})
+
+        assert utils.server_side_apply("ns", desired) == ("applied", "8")
+        method, path = self.request.call_args[0]
+        kwargs = self.request.call_args[1]
+        assert method == "PATCH"
+        assert kwargs["content_type"] == "application/apply-patch+yaml"
+        assert ("fieldManager", utils.FIELD_MANAGER) in kwargs["query_params"]
+        assert json.loads(kwargs["body"])["spec"] == {"a": 2}
+
+    def test_missing_object_dry_run(self):
+        self.request.side_effect = [ApiException(status=404), {}]
+
+        assert utils.server_side_apply("ns", CONFIG, dry_run=True) == (
+            "would-apply",
+            None,
+        )
+        assert ("dryRun", "All") in self.request.call_args[1]["query_params"]
+
+    def test_server_metadata_stripped(self):
+        crd = dict(CRD, status={}, metadata={"name": "x", "creationTimestamp": None})
+
+        assert utils.object_manifest(crd) == dict(CRD, metadata={"name": "x"})
+
+
+def result(k8s_object, resource_version, error=None):
+    return utils.ApplyResult(
+        utils.object_kind(k8s_object),
+        utils.object_name(k8s_object),
+        k8s_object.get("namespace"),
+        utils.object_tier(k8s_object),
+        "failed" if error else "applied",
+        0.1,
+        error,
+        resource_version,
+    )
+
+
+class TestLedger(unittest.TestCase):
+    @patch("utils.list_resource_versions")
+    def test_empty_ledger_applies_everything(self, list_resource_versions):
+        assert utils.changed_objects([PSP, CONFIG], []) == [PSP, CONFIG]
+        list_resource_versions.assert_not_called()
+
+    @patch("utils.list_resource_versions")
+    def test_unchanged_objects_skipped(self, list_resource_versions):
+        ledger = utils.update_ledger(
+            [], [PSP, CONFIG], [result(PSP, "1"), result(CONFIG, "2")]
+        )
+        list_resource_versions.side_effect = [{"psp": "1"}, {"config": "3"}]
+
+        assert utils.changed_objects([PSP, CONFIG], ledger) == [CONFIG]
+        assert list_resource_versions.call_count == 2
+
+    @patch("utils.list_resource_versions")
+    def test_changed_content_applied(self, list_resource_versions):
+        ledger = utils.update_ledger([], [PSP], [result(PSP, "1")])
+        changed = dict(PSP, spec={"volumes": ["secret"]})
+
+        assert utils.changed_objects([changed], ledger) == [changed]
+        list_resource_versions.assert_not_called()
+
+    def test_failed_objects_dropped_from_ledger(self):
+        ledger = utils.update_ledger([], [PSP], [result(PSP, "1")])
+        ledger = utils.update_ledger(
+            ledger, [PSP], [result(PSP, None, RuntimeError("boom"))]
+        )
+
+        assert ledger == []
+
+    def test_dry_run_objects_not_recorded(self):
+        ledger = utils.update_ledger([], [PSP], [result(PSP, "1")])
+        would_apply = result(CONFIG, "2")._replace(status="would-apply")
+        ledger = utils.update_ledger(
+            ledger, [PSP, CONFIG], [result(PSP, "1"), would_apply]
+        )
+
+        assert utils.in_ledger(ledger, PSP)
+        assert not utils.in_ledger(ledger, CONFIG)
+
+
+def event(event_type, name, resource_version):
+    return {
+        "type": event_type,
+        "object": {"metadata": {"name": name, "resourceVersion": resource_version}},
+    }
+
+
+class TestDriftDetection(unittest.TestCase):
+    def setUp(self):
+        self.ledger = utils.update_ledger(
+            [],
+            [PSP, CONFIG],
+            [result(PSP, "1"), result(CONFIG, "2")],
+        )
+        self.psps = utils.collection_path(PSP)
+        self.configs = utils.collection_path(CONFIG)
+
+    @patch("utils._watch_events")
+    def test_watch_changes(self, watch_events):
+        watch_events.return_value = [
+            event("MODIFIED", "psp", "5"),
+            event("ADDED", "other", "6"),
+            event("BOOKMARK", "", "7"),
+            event("DELETED", "other", "8"),
+        ]
+        assert utils.watch_changes(self.psps, "4") == (
+            {"psp": "5", "other": None},
+            "8",
+        )
+
+        watch_events.return_value = [
+            {"type": "ERROR", "object": {"kind": "Status", "code": 410}}
+        ]
+        assert utils.watch_changes(self.psps, "4") == (None, "4")
+
+    @patch("utils.list_collection_versions")
+    @patch("utils.watch_changes")
+    def test_watched_collections_not_listed(self, watch_changes, list_versions):
+        watch_changes.side_effect = lambda collection, version, timeout: (
+            {"psp": "1", "other": "9"} if collection == self.psps else {},
+            "10",
+        )
+        watched = {self.psps: "3", self.configs: "3"}
+
+        drifted, watched = utils.detect_drift([PSP, CONFIG], self.ledger, watched)
+
+        assert drifted == []
+        assert watched == {self.psps: "10", self.configs: "10"}
+        list_versions.assert_not_called()
+
+    @patch("utils.list_collection_versions")
+    @patch("utils.watch_changes")
+    def test_changed_and_deleted_objects_drift(self, watch_changes, list_versions):
+        watch_changes.side_effect = [({"psp": "4"}, "5"), ({"config": None}, "6")]
+        watched = {self.psps: "3", self.configs: "3"}
+
+        drifted, _ = utils.detect_drift([PSP, CONFIG], self.ledger, watched)
+
+        assert drifted == [PSP, CONFIG]
+
+    @patch("utils.list_collection_versions")
+    @patch("utils.watch_changes")
+    def test_expired_watch_lists_collection(self, watch_changes, list_versions):
+        watch_changes.return_value = (None, "3")
+        list_versions.side_effect = [({"psp": "1"}, "20"), ({}, "21")]
+        watched = {self.psps: "3"}
+
+        drifted, watched = utils.detect_drift([PSP, CONFIG], self.ledger, watched)
+
+        # the configs collection was never watched
+        watch_changes.assert_called_once_with(self.psps, "3", utils.WATCH_TIMEOUT)
+        assert drifted == [CONFIG]
+        assert watched == {self.psps: "20", self.configs: "21"}
+
+    @patch("utils.watch_changes", return_value=({}, "5"))
+    def test_objects_missing_from_ledger_drift(self, watch_changes):
+        changed = dict(PSP, spec={"volumes": ["secret"]})
+        watched = {self.psps: "3", self.configs: "3"}
+
+        drifted, _ = utils.detect_drift([changed, CONFIG], self.ledger[1:], watched)
+
+        assert drifted == [changed]
+
+
+class TestDeleteK8sObjects(unittest.TestCase):
+    @patch("utils._request")
+    def test_groups_deleted_in_order(self, request):
+        def delete(method, path, body, deadline):
+            if path.endswith("/psp"):
+                raise ApiException(status=404)
+            if path.endswith("/config"):
+                return {"metadata": {"deletionTimestamp": "2026-10-18T00:00:00Z"}}
+            return {"kind": "Status", "status": "Success"}
+
+        request.side_effect = delete
+        results = utils.delete_k8s_objects([[CONFIG], [PSP], [CRD]], deadline=5)
+
+        assert [(r.name, r.tier, r.status) for r in results] == [
+            ("config", 0, "deleting"),
+            ("psp", 1, "absent"),
+            ("configs.config.gatekeeper.sh", 2, "deleted"),
+        ]
+        assert [c[0][1] for c in request.call_args_list] == [
+            utils.object_path(CONFIG),
+            utils.object_path(PSP),
+            utils.object_path(CRD),
+        ]
+        assert request.call_args[1]["body"]["propagationPolicy"] == "Background"
+        assert 0 < request.call_args[1]["deadline"] - time.monotonic() <= 5
+
+    @patch("utils._request")
+    def test_deadline_bounds_teardown(self, request):
+        request.side_effect = lambda *args, **kwargs: time.sleep(0.5)
+
+        started = time.monotonic()
+        results = utils.delete_k8s_objects([[CONFIG], [PSP]], deadline=0.1)
+
+        assert time.monotonic() - started < 0.4
+        assert [r.status for r in results] == ["failed", "skipped"]
+        assert isinstance(results[0].error, TimeoutError)
+
+    def test_deadline_bounds_retries(self):
+        faults = Faults(error_rate=1.0, error_code=503)
+        with FakeApiServer(faults) as server:
+            utils.configure_client(
+                configuration=server.configuration(), qps=0, max_retries=20
+            )
+            self.addCleanup(utils.configure_client)
+
+            started = time.monotonic()
+            results = utils.delete_k8s_objects([[CONFIG], [PSP]], deadline=0.5)
+            assert time.monotonic() - started < 1.0
+            sent = server.requests["DELETE"]
+            # the workers stop retrying too, or they would hold the hook
+            # process open, as it waits for them on exit
+            time.sleep(0.5)
+            assert server.requests["DELETE"] == sent
+
+        assert results[0].status == "failed"
+        assert results[1].status in ("failed", "skipped")
+        assert sent > 1
+
+
+class TestApiCallStats(unittest.TestCase):
+    @patch("kubernetes.client.ApiClient.call_api")
+    def test_calls_recorded(self, call_api):
+        utils.api_stats.reset()
+        api_client = utils.InstrumentedApiClient(client.Configuration())
+        api_client.call_api("/api", "GET")
+        call_api.side_effect = ApiException(status=500)
+        with self.assertRaises(ApiException):
+            api_client.call_api("/api", "PATCH")
+
+        assert utils.api_stats.calls == 2
+        stats = utils.api_stats.snapshot()
+        assert stats["GET"]["calls"] == 1 and stats["GET"]["errors"] == 0
+        assert stats["PATCH"]["errors"] == 1
+
+
+class TestRateLimitAndRetry(unittest.TestCase):
+    def setUp(self):
+        utils.api_stats.reset()
+        patcher = patch("utils.time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_token_bucket_allows_burst(self):
+        bucket = utils.TokenBucket(qps=1, burst=3)
+
+        waits = [bucket.acquire() for _ in range(4)]
+
+        assert waits[:3] == [0.0, 0.0, 0.0]
+        assert 0.9 < waits[3] <= 1.0
+
+    def test_token_bucket_disabled(self):
+        bucket = utils.TokenBucket(qps=0, burst=1)
+
+        assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+
+    @patch("kubernetes.client.ApiClient.call_api")
+    def test_throttled_request_retried_after_retry_after(self, call_api):
+        throttled = ApiException(status=429)
+        throttled.headers = {"Retry-After": "2"}
+        call_api.side_effect = [throttled, ApiException(status=503), {"ok": True}]
+        api_client = utils.InstrumentedApiClient(client.Configuration(), max_retries=3)
+
+        assert api_client.call_api("/api", "GET") == {"ok": True}
+        assert self.sleep.call_args_list[0][0][0] >= 2
+        assert utils.api_stats.retries == 2
+        assert utils.api_stats.throttled == 1
+        assert utils.api_stats.throttled_seconds >= 2
+
+    @patch("kubernetes.client.ApiClient.call_api")
+    def test_client_errors_not_retried(self, call_api):
+        call_api.side_effect = ApiException(status=404)
+        api_client = utils.InstrumentedApiClient(client.Configuration(), max_retries=3)
+
+        with self.assertRaises(ApiException):
+            api_client.call_api("/api", "GET")
+        assert call_api.call_count == 1
+
+    @patch("kubernetes.client.ApiClient.call_api")
+    def test_retries_exhausted(self, call_api):
+        call_api.side_effect = ApiException(status=500)
+        api_client = utils.InstrumentedApiClient(client.Configuration(), max_retries=2)
+
+        with self.assertRaises(ApiException):
+            api_client.call_api("/api", "PATCH")
+        assert call_api.call_count == 3
+
+
+class TestDiscovery(unittest.TestCase):
+    @patch("utils._request")
+    def test_api_groups(self, request):
+        request.return_value = {
+            "groups": [
+                {"name": "apps", "preferredVersion": {"groupVersion": "apps/v1"}}
+            ]
+        }
+
+        assert utils.api_groups() == {"": "v1", "apps": "apps/v1"}
+        request.assert_called_once_with("GET", "/apis")
+
+    @patch("utils._request")
+    def test_api_resources_writable_only(self, request):
+        request.return_value = {
+            "resources": [
+                {"name": "pods", "verbs": ["create", "get", "list"]},
+                {"name": "pods/status", "verbs": ["get", "patch"]},
+                {"name": "componentstatuses", "verbs": ["get", "list"]},
+                {"name": "events", "verbs": ["create", "update"]},
+            ]
+        }
+
+        assert utils.api_resources("v1") == ["events", "pods"]
+        request.assert_called_once_with("GET", "/api/v1")
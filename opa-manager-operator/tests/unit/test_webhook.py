@@ -0,0 +1,180 @@
+import os
+import unittest
+from unittest.mock import patch
+from ops.testing import Harness
+from charm import OPAManagerCharm
+import podspec
+import webhook
+
+DEFAULTS = {
+    "webhookResources": "*",
+    "webhookExcludeResources": "",
+    "webhookValidateUpdates": True,
+    "webhookTimeoutSeconds": 3,
+    "webhookFailurePolicy": "Ignore",
+    "ignoreLabelWebhookTimeoutSeconds": 3,
+    "ignoreLabelWebhookFailurePolicy": "Fail",
+    "exemptNamespaces": "",
+}
+
+API_GROUPS = ["", "apps", "coordination.k8s.io"]
+API_RESOURCES = {
+    "": ["configmaps", "events", "pods"],
+    "apps": ["deployments", "statefulsets"],
+    "coordination.k8s.io": ["leases"],
+}
+
+
+def settings(**options):
+    return webhook.settings_from_config(dict(DEFAULTS, **options))
+
+
+def rules(**options):
+    return webhook.webhook_rules(
+        settings(**options), API_GROUPS, API_RESOURCES.__getitem__
+    )
+
+
+class TestWebhookSettings(unittest.TestCase):
+    def test_defaults_intercept_everything(self):
+        assert not webhook.needs_discovery(settings())
+        assert webhook.webhook_rules(settings()) == [
+            {
+                "apiGroups": ["*"],
+                "apiVersions": ["*"],
+                "operations": ["CREATE", "UPDATE"],
+                "resources": ["*"],
+            }
+        ]
+
+    def test_parse_resources(self):
+        assert webhook.parse_resources(
+            "pods, deployments.apps,*.core,*.batch", "option"
+        ) == {("", "pods"), ("apps", "deployments"), ("", "*"), ("batch", "*")}
+
+    def test_invalid_options(self):
+        for options in [
+            {"webhookResources": ""},
+            {"webhookResources": "Pods"},
+            {"webhookExcludeResources": "*"},
+            {"webhookTimeoutSeconds": 0},
+            {"ignoreLabelWebhookTimeoutSeconds": 31},
+            {"webhookFailurePolicy": "ignore"},
+            {"exemptNamespaces": "kube-system,Bad_Namespace"},
+        ]:
+            with self.assertRaises(webhook.WebhookConfigError, msg=options):
+                settings(**options)
+
+    def test_explicit_resources_grouped(self):
+        assert rules(
+            webhookResources="pods,deployments.apps,statefulsets.apps,*.batch",
+            webhookValidateUpdates=False,
+        ) == [
+            {
+                "apiGroups": [""],
+                "apiVersions": ["*"],
+                "operations": ["CREATE"],
+                "resources": ["pods"],
+            },
+            {
+                "apiGroups": ["apps"],
+                "apiVersions": ["*"],
+                "operations": ["CREATE"],
+                "resources": ["deployments", "statefulsets"],
+            },
+            {
+                "apiGroups": ["batch"],
+                "apiVersions": ["*"],
+                "operations": ["CREATE"],
+                "resources": ["*"],
+            },
+        ]
+
+    def test_exclusions_from_wildcard(self):
+        excluded = settings(webhookExcludeResources="events,*.coordination.k8s.io")
+        assert webhook.needs_discovery(excluded)
+
+        assert [
+            (rule["apiGroups"], rule["resources"])
+            for rule in rules(webhookExcludeResources="events,*.coordination.k8s.io")
+        ] == [([""], ["configmaps", "pods"]), (["apps"], ["*"])]
+
+    def test_exclusions_without_discovery(self):
+        excluded = settings(
+            webhookResources="pods,configmaps,*.apps",
+            webhookExcludeResources="configmaps,*.batch",
+        )
+        assert not webhook.needs_discovery(excluded)
+        assert [
+            (rule["apiGroups"], rule["resources"])
+            for rule in webhook.webhook_rules(excluded)
+        ] == [([""], ["pods"]), (["apps"], ["*"])]
+
+    def test_excluding_every_resource(self):
+        with self.assertRaises(webhook.WebhookConfigError):
+            rules(webhookResources="pods", webhookExcludeResources="pods")
+
+    def test_webhook_configuration_options(self):
+        options = settings(
+            webhookTimeoutSeconds=1,
+            webhookFailurePolicy="Fail",
+            ignoreLabelWebhookTimeoutSeconds=5,
+            exemptNamespaces="monitoring,kube-system",
+        )
+        configuration = podspec.validating_webhook_configuration(
+            "model", **webhook.pod_spec_options(options, rules(webhookResources="pods"))
+        )
+        validation, check_ignore_label = configuration["webhooks"]
+
+        assert validation["timeoutSeconds"] == 1
+        assert validation["failurePolicy"] == "Fail"
+        assert validation["rules"][0]["resources"] == ["pods"]
+        assert validation["namespaceSelector"]["matchExpressions"][1] == {
+            "key": "kubernetes.io/metadata.name",
+            "operator": "NotIn",
+            "values": ["kube-system", "monitoring"],
+        }
+        assert check_ignore_label["timeoutSeconds"] == 5
+        assert check_ignore_label["failurePolicy"] == "Fail"
+
+
+class TestCharmWebhookConfig(unittest.TestCase):
+    def setUp(self):
+        os.environ["JUJU_MODEL_NAME"] = "test-webhook"
+        self.harness = Harness(OPAManagerCharm)
+        self.addCleanup(self.harness.cleanup)
+        self.harness.add_oci_resource("gatekeeper-image")
+        self.harness.set_leader(True)
+        self.harness.begin()
+
+    def test_exempt_namespace_args(self):
+        self.harness.update_config({"exemptNamespaces": "test-webhook,kube-system"})
+
+        assert self.harness.charm._cli_args() == [
+            "--logtostderr",
+            "--port=8443",
+            "--exempt-namespace=test-webhook",
+            "--exempt-namespace=kube-system",
+            "--operation=webhook",
+        ]
+
+    def test_invalid_config_blocks(self):
+        self.harness.update_config({"webhookFailurePolicy": "Sometimes"})
+
+        assert self.harness.charm.unit.status.name == "blocked"
+        assert "webhookFailurePolicy" in self.harness.charm.unit.status.message
+
+    @patch("utils.api_resources")
+    @patch("utils.api_groups")
+    def test_exclusions_discover_resources(self, api_groups, api_resources):
+        api_groups.return_value = {"": "v1", "apps": "apps/v1"}
+        api_resources.side_effect = lambda version: {
+            "v1": ["events", "pods"],
+            "apps/v1": ["deployments"],
+        }[version]
+        self.harness.update_config({"webhookExcludeResources": "events"})
+
+        spec, _ = self.harness.get_pod_spec()
+        configuration = spec["kubernetesResources"]["validatingWebhookConfigurations"]
+        assert configuration[0]["webhooks"][0]["rules"][0]["resources"] == ["pods"]
+        assert self.harness.charm.unit.status.name == "active"